@@ -0,0 +1,122 @@
+import os, sys, json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import yacc, pipeline
+
+# Batch mode: compile (and with "jit" run) many .ek files across a process
+# pool. Each worker builds its parser and execution engines once and reuses
+# them for every file it is given. For every input <name>.ek the output
+# directory gets <name>.ast.yaml / <name>.ll / <name>.out as requested, or
+# <name>.err when that file failed, plus a summary.json of all results.
+
+PHASES = ["parse", "codegen", "optimize", "execute", "total"]
+
+_pool = None
+
+def collect_inputs(inputs):
+    """
+    Expand directories in inputs to the .ek files below them.
+    """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(".ek"):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+def output_stems(files, out_dir):
+    # mirror the layout of the inputs below their common directory
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+    return [os.path.join(out_dir, os.path.splitext(os.path.relpath(os.path.abspath(f), base))[0])
+            for f in files]
+
+def compile_one(path, stem, options):
+    """
+    Compile one file in a worker process and return its summary record.
+    Errors are recorded rather than raised so one bad file does not stop
+    the batch.
+    """
+    global _pool
+    start_time = time.time()
+    record = {"file": path, "ok": True, "error": None, "warnings": [], "exit_status": None, "timings": {}}
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    try:
+        with open(path, 'r') as input:
+            source = input.read()
+        entry = pipeline.compile_source(source, options)
+        record["timings"] = entry["timings"]
+        record["warnings"] = entry["warnings"]
+        if entry["ast"] is not None:
+            write_output(stem + ".ast.yaml", entry["ast"])
+        if options.get("emit") == "llvm":
+            write_output(stem + ".ll", entry["ir"])
+        if options.get("jit"):
+            if _pool is None:
+                _pool = pipeline.EnginePool(size=1)
+            slot = _pool.acquire()
+            exec_time = time.time()
+            try:
+                output, exit_status, result = pipeline.execute_captured(slot[0], entry["ir"], [str(a) for a in options.get("args", [])])
+            finally:
+                _pool.release(slot)
+            record["timings"]["execute"] = time.time() - exec_time
+            record["exit_status"] = exit_status
+            write_output(stem + ".out", output)
+    except yacc.CompilerException as e:
+        record.update(ok=False, error=e.message)
+    except SystemExit as e:
+        # codeGen exits on literal overflow
+        record.update(ok=False, error="compiler exited with status %s" % e.code)
+    except Exception as e:
+        record.update(ok=False, error="%s: %s" % (type(e).__name__, e))
+    record["timings"]["total"] = time.time() - start_time
+    if not record["ok"]:
+        write_output(stem + ".err", record["error"] + "\n")
+    return record
+
+def write_output(path, content):
+    with open(path, 'w') as output:
+        output.write(content)
+
+def print_summary(records, elapsed, file=sys.stdout):
+    width = max([len("file")] + [len(r["file"]) for r in records])
+    print("%-*s  %-6s %s" % (width, "file", "status", " ".join("%9s" % p for p in PHASES)), file=file)
+    for r in records:
+        status = "ok" if r["ok"] else "FAILED"
+        cells = " ".join("%9s" % ("%.4f" % r["timings"][p] if p in r["timings"] else "-") for p in PHASES)
+        print("%-*s  %-6s %s" % (width, r["file"], status, cells), file=file)
+        for warning in r["warnings"]:
+            print("    " + warning, file=file)
+        if not r["ok"]:
+            print("    " + r["error"], file=file)
+    failed = len([r for r in records if not r["ok"]])
+    print("%d files, %d failed, %.3f seconds" % (len(records), failed, elapsed), file=file)
+
+# The function called by ekcc.py
+def run_batch(inputs, options, out_dir, jobs=None):
+    """
+    Compile every file in inputs with options across jobs worker processes.
+    Returns the per-file records, which are also written to summary.json.
+    """
+    files = collect_inputs(inputs)
+    if not files:
+        raise Exception("no .ek files found in " + " ".join(inputs))
+    stems = output_stems(files, out_dir)
+    start_time = time.time()
+    # the parent builds the tables first so the workers only load them
+    yacc.get_parser()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(files) // ((jobs or os.cpu_count() or 1) * 4))
+        records = list(executor.map(compile_one, files, stems, repeat(options), chunksize=chunksize))
+    elapsed = time.time() - start_time
+    with open(os.path.join(out_dir, "summary.json"), 'w') as output:
+        json.dump({"options": options, "elapsed": elapsed, "files": records}, output, indent=2)
+    print_summary(records, elapsed)
+    return records
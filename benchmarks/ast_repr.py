@@ -0,0 +1,104 @@
+"""
+AST representation benchmark: memory and check/codegen time on a large
+generated program.
+
+Runs the measurement in a fresh process for the working tree and, with
+--baseline, for another git revision (for example the last commit that
+still used dict nodes), and prints both side by side.
+
+    python3 benchmarks/ast_repr.py [--functions N] [--stmts M] [--baseline REV]
+"""
+import argparse, os, sys, json
+import resource
+import shutil, subprocess, tempfile
+import time
+import tracemalloc
+
+from codegen_ir import generate_code, reset_checker, extract
+from generator import generate_program
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def check(yacc, ast):
+    """
+    Run the semantic checks of the tree's yacc on ast.
+    """
+    if hasattr(yacc, "Checker"):
+        yacc.Checker().check(ast)
+        return
+    reset_checker(yacc)
+    yacc.check_violation(ast)
+    yacc.check_run()
+
+def measure(tree, path):
+    """
+    Runs in the child process: times parsing, checking and code generation
+    with the compiler in tree and reports peak RSS and the size of the AST.
+    """
+    sys.path.insert(0, tree)
+    import lexer, yacc, codeGen
+    with open(path) as f:
+        source = f.read()
+    sys.setrecursionlimit(100000)
+    if hasattr(yacc, "get_parser"):
+        parser = yacc.get_parser()
+    else:
+        # trees from before the parse table cache build it every time
+        parser = yacc.yacc.yacc(module=yacc)
+
+    tracemalloc.start()
+    ast = parser.parse(source, lexer=lexer.lexer)
+    ast_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del ast
+
+    start_time = time.perf_counter()
+    ast = parser.parse(source, lexer=lexer.lexer)
+    parse_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    check(yacc, ast)
+    check_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    generate_code(codeGen, ast)
+    codegen_time = time.perf_counter() - start_time
+    json.dump({"parse": parse_time, "check": check_time, "codegen": codegen_time,
+               "ast_mb": ast_bytes / 2**20,
+               "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}, sys.stdout)
+
+def run_measure(tree, path):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", tree, path],
+                         stdout=subprocess.PIPE, check=True)
+    return json.loads(out.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--functions", type=int, default=1000)
+    parser.add_argument("--stmts", type=int, default=20, help="statements per function (see generator.py)")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        path = os.path.join(tmp, "big.ek")
+        with open(path, "w") as f:
+            f.write(generate_program(functions=args.functions, stmts=args.stmts))
+        results = [("working tree", run_measure(ROOT, path))]
+        if args.baseline:
+            tree = os.path.join(tmp, "baseline")
+            os.makedirs(tree)
+            extract(args.baseline, tree)
+            results.append((args.baseline, run_measure(tree, path)))
+    finally:
+        shutil.rmtree(tmp)
+
+    print("%d functions x %d statements" % (args.functions, args.stmts))
+    print("%-16s %10s %10s %10s %10s %12s" % ("", "parse s", "check s", "codegen s", "AST MB", "peak RSS MB"))
+    for name, r in results:
+        print("%-16s %10.3f %10.3f %10.3f %10.1f %12.1f" % (name, r["parse"], r["check"], r["codegen"], r["ast_mb"], r["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Generated code benchmark: IR instruction counts, optimizer time and JIT
+run time of programs, without optimization and with -O.
+
+Each program is compiled in a fresh process for the working tree and, with
+--baseline, for another git revision, and the two are printed side by side.
+By default the programs in benchmarks/programs and test_files/test8.ek are
+used. A program that a tree's compiler fails on is shown as failed for it.
+
+    python3 benchmarks/codegen_ir.py [--baseline REV] [-n RUNS] [file.ek ...]
+"""
+import argparse, os, sys, json
+import glob
+import inspect
+from contextlib import contextmanager
+from ctypes import CFUNCTYPE, CDLL, c_int
+import shutil, subprocess, tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROGRAMS = sorted(glob.glob(os.path.join(ROOT, "benchmarks", "programs", "*.ek"))) + \
+    [os.path.join(ROOT, "test_files", "test8.ek")]
+
+OPTIMIZATION = [False, 10, False, 3, 2, False]
+
+def count_instructions(mod):
+    counts = {"instructions": 0, "alloca": 0, "load": 0, "store": 0}
+    for func in mod.functions:
+        for block in func.blocks:
+            for instr in block.instructions:
+                counts["instructions"] += 1
+                if instr.opcode in counts:
+                    counts[instr.opcode] += 1
+    return counts
+
+@contextmanager
+def discard_stdout():
+    """
+    Send fd 1 to /dev/null for the block, to keep the output of the
+    programs run there out of the report.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def generate_code(codeGen, ast):
+    """
+    codeGen's module for ast, in any tree.
+    """
+    # trees from before the runtime argument array take the arg() values
+    if "undefined_args" in inspect.signature(codeGen.generate_code).parameters:
+        return codeGen.generate_code(ast, [])
+    return codeGen.generate_code(ast)
+
+# Trees from before binding.optimize_module and binding.run_function (the
+# parse table cache) optimized and ran inside compile_and_execute, and trees
+# from before the Checker class kept its state in globals; these do the same
+# for them.
+
+def reset_checker(yacc):
+    if not hasattr(yacc, "Checker"):
+        yacc.funcs_declare = {}
+        yacc.variables = {}
+        yacc.current_func_prefix = None
+
+def optimize_module(binding, mod):
+    if hasattr(binding, "optimize_module"):
+        binding.optimize_module(mod, OPTIMIZATION)
+        return
+    import llvmlite.binding as llvm
+    pmb = llvm.create_pass_manager_builder()
+    pmb.disable_unroll_loops = OPTIMIZATION[0]
+    pmb.loop_vectorize = OPTIMIZATION[2]
+    pmb.opt_level = OPTIMIZATION[3]
+    pmb.size_level = OPTIMIZATION[4]
+    pmb.slp_vectorize = OPTIMIZATION[5]
+    pm = llvm.create_module_pass_manager()
+    pmb.populate(pm)
+    pm.run(mod)
+
+def run_function(binding, engine):
+    if hasattr(binding, "run_function"):
+        return binding.run_function(engine)
+    return CFUNCTYPE(c_int)(engine.get_function_address("run"))()
+
+def flush_stdio(binding):
+    if hasattr(binding, "flush_stdio"):
+        binding.flush_stdio()
+    else:
+        CDLL(None).fflush(None)
+
+def measure(tree, path, runs):
+    """
+    Runs in the child process: compiles path with the compiler in tree and
+    reports instruction counts and the best run() time of runs runs, with
+    and without optimization.
+    """
+    sys.path.insert(0, tree)
+    import yacc, codeGen, binding
+    import llvmlite.binding as llvm
+    try:
+        import fold
+    except ImportError:
+        # trees from before the AST optimizer
+        fold = None
+    with open(path) as f:
+        source = f.read()
+    results = {}
+    for optimize in [False, True]:
+        reset_checker(yacc)
+        ast, err = yacc.parse(source)
+        if err:
+            raise Exception(err)
+        if fold is not None:
+            fold.fold_program(ast)
+        mod = llvm.parse_assembly(str(generate_code(codeGen, ast)))
+        opt_time = 0.0
+        if optimize:
+            start_time = time.perf_counter()
+            optimize_module(binding, mod)
+            opt_time = time.perf_counter() - start_time
+        mod.verify()
+        result = count_instructions(mod)
+        result["optimize"] = opt_time
+        engine = binding.create_execution_engine()
+        engine.add_module(mod)
+        engine.finalize_object()
+        with discard_stdout():
+            best = None
+            for _ in range(runs):
+                start_time = time.perf_counter()
+                run_function(binding, engine)
+                elapsed = time.perf_counter() - start_time
+                best = elapsed if best is None else min(best, elapsed)
+            flush_stdio(binding)
+        result["run"] = best
+        results["O" if optimize else "noopt"] = result
+    json.dump(results, sys.stdout)
+
+def run_measure(tree, path, runs):
+    """
+    The results of measure, or None if the compiler in tree failed on path.
+    """
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", tree, path, str(runs)],
+                         stdout=subprocess.PIPE)
+    if out.returncode != 0:
+        return None
+    return json.loads(out.stdout)
+
+def extract(revision, directory):
+    archive = subprocess.run(["git", "-C", ROOT, "archive", revision], stdout=subprocess.PIPE, check=True)
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="programs to compile (default: %(default)s)")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("-n", type=int, default=5, help="runs of each program, the best is reported")
+    parser.add_argument("--measure", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure[0], args.measure[1], int(args.measure[2]))
+        return
+
+    trees = [("working tree", ROOT)]
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        if args.baseline:
+            extract(args.baseline, tmp)
+            trees.append((args.baseline, tmp))
+        print("%-12s %-6s %-14s %8s %7s %6s %6s %8s %10s" % ("program", "opt", "tree", "instrs", "alloca", "load", "store", "opt ms", "run ms"))
+        for path in args.files or DEFAULT_PROGRAMS:
+            results = [(name, run_measure(tree, path, args.n)) for name, tree in trees]
+            for opt in ["noopt", "O"]:
+                for name, r in results:
+                    if r is None:
+                        print("%-12s %-6s %-14s %8s" % (os.path.basename(path)[:12], opt, name[:14], "failed"))
+                        continue
+                    c = r[opt]
+                    print("%-12s %-6s %-14s %8d %7d %6d %6d %8.2f %10.3f" % (os.path.basename(path)[:12], opt, name[:14], c["instructions"],
+                          c["alloca"], c["load"], c["store"], c["optimize"] * 1000, c["run"] * 1000))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Synthetic program generator: valid, terminating .ek programs whose size
+grows along one axis at a time.
+
+    python3 benchmarks/generator.py [--functions N] [--stmts N] [--depth N]
+        [--length N] [--nesting N] [--prints N] [--fanout N] [--seed S] [-o file.ek]
+
+The axes are
+    functions  number of functions besides run()
+    stmts      assignments, ifs and loop nests per function
+    depth      nesting depth of the parenthesized expressions
+    length     operands per parenthesized expression
+    nesting    depth of every loop nest
+    prints     print statements per function
+    fanout     functions every function calls
+"""
+import argparse, sys
+import random
+
+DEFAULTS = {"functions": 20, "stmts": 20, "depth": 2, "length": 3,
+            "nesting": 2, "prints": 2, "fanout": 2}
+
+# every function works on these, declared at its start
+VARIABLES = 4
+
+class Generator():
+    def __init__(self, seed, functions, stmts, depth, length, nesting, prints, fanout):
+        self.rng = random.Random(seed)
+        self.functions = functions
+        self.stmts = stmts
+        self.depth = depth
+        self.length = length
+        self.nesting = nesting
+        self.prints = prints
+        self.fanout = fanout
+
+    def var(self):
+        return "$v%d" % self.rng.randrange(VARIABLES)
+
+    def exp(self, depth):
+        if depth == 0:
+            if self.rng.randrange(3) == 0:
+                return str(self.rng.randrange(1, 10))
+            return self.var()
+        exp = self.exp(depth - 1)
+        for _ in range(self.length - 1):
+            op = self.rng.choice("+-*/")
+            # only divide by literals, which are never 0
+            operand = str(self.rng.randrange(1, 10)) if op == "/" else self.exp(depth - 1)
+            exp = "%s %s %s" % (exp, op, operand)
+        return "(" + exp + ")" if self.length > 1 else exp
+
+    def assign(self, indent):
+        return ["%s%s = %s;" % (indent, self.var(), self.exp(self.depth))]
+
+    def loop_nest(self, k, indent):
+        # counters are declared up front and loop twice each, so a nest runs
+        # its body 2 ** nesting times
+        lines = []
+        for level in range(self.nesting):
+            counter = "$l%d_%d" % (k, level)
+            lines.append("%s%s = 0;" % (indent, counter))
+            lines.append("%swhile (%s < 2) {" % (indent, counter))
+            indent += "    "
+        lines.extend(self.assign(indent))
+        for level in reversed(range(self.nesting)):
+            counter = "$l%d_%d" % (k, level)
+            lines.append("%s%s = %s + 1;" % (indent, counter, counter))
+            indent = indent[4:]
+            lines.append("%s}" % indent)
+        return lines
+
+    def function(self, f):
+        lines = ["def int f%d (int $n) {" % f]
+        for v in range(VARIABLES):
+            lines.append("    int $v%d = $n + %d;" % (v, v))
+        body = []
+        loops = 0
+        for s in range(self.stmts):
+            kind = self.rng.randrange(3)
+            if kind == 0:
+                body.extend(self.assign("    "))
+            elif kind == 1:
+                body.append("    if (%s > %s)" % (self.var(), self.var()))
+                body.extend(self.assign("        "))
+                body.append("    else")
+                body.extend(self.assign("        "))
+            else:
+                body.extend(self.loop_nest(loops, "    "))
+                loops += 1
+        for k in range(loops):
+            for level in range(self.nesting):
+                lines.append("    int $l%d_%d = 0;" % (k, level))
+        lines.extend(body)
+        for p in range(self.prints):
+            lines.append("    print %s;" % self.var())
+        # calls go to functions defined before, only while $n > 0, so run()
+        # makes functions * (1 + fanout) calls in all
+        for callee in sorted(self.rng.sample(range(f), min(self.fanout, f))):
+            lines.append("    if ($n > 0)")
+            lines.append("        $v0 = $v0 + f%d($n - 1);" % callee)
+        lines.append("    return $v0;")
+        lines.append("}")
+        return lines
+
+    def program(self):
+        lines = []
+        for f in range(self.functions):
+            lines.extend(self.function(f))
+        lines.append("def int run () {")
+        lines.append("    int $s = 0;")
+        for f in range(self.functions):
+            lines.append("    $s = $s + f%d(1);" % f)
+        lines.append("    print $s;")
+        lines.append("    return 0;")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+def generate_program(seed=0, **axes):
+    """
+    The source of a program with the given axes (see DEFAULTS for the
+    rest).
+    """
+    config = dict(DEFAULTS, **axes)
+    return Generator(seed, **config).program()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    for axis, default in DEFAULTS.items():
+        parser.add_argument("--" + axis, type=int, default=default)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", default=None, help="output file (default stdout)")
+    args = parser.parse_args()
+    source = generate_program(args.seed, **{axis: getattr(args, axis) for axis in DEFAULTS})
+    if args.o is None:
+        sys.stdout.write(source)
+    else:
+        with open(args.o, "w") as f:
+            f.write(source)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cold vs. warm JIT latency with the MCJIT object cache.
+
+Measures, for one program, the time MCJIT takes to produce code for the
+module (finalize_object) with an empty object cache and with one that
+already holds the module, and the end-to-end latency of
+`ekcc.py -jit --object-cache` in both states.
+
+    python3 benchmarks/jit_object_cache.py [-O] [-n REPS] [file.ek]
+"""
+import argparse, os, sys
+import shutil, subprocess, tempfile
+import statistics, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import llvmlite.binding as llvm
+import yacc, codeGen, binding, cache
+
+def finalize_time(llvm_ir, directory):
+    objects = cache.ObjectCache(directory, binding.target_id())
+    engine = binding.create_execution_engine(objects)
+    mod = llvm.parse_assembly(llvm_ir)
+    engine.add_module(mod)
+    start_time = time.perf_counter()
+    engine.finalize_object()
+    elapsed = time.perf_counter() - start_time
+    engine.close()
+    return elapsed
+
+def ekcc_time(path, optimize, cache_root):
+    cmd = [sys.executable, os.path.join(ROOT, "ekcc.py"), "-jit", "--object-cache", path]
+    if optimize:
+        cmd.append("-O")
+    env = dict(os.environ, EKCC_CACHE_DIR=cache_root)
+    start_time = time.perf_counter()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start_time
+
+def report(name, cold, warm):
+    c, w = statistics.median(cold), statistics.median(warm)
+    print("%-28s cold %9.3f ms   warm %9.3f ms   speed-up %.2fx" % (name, c * 1000, w * 1000, c / w))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("file", nargs="?", default=os.path.join(ROOT, "test_files", "test1.ek"))
+    parser.add_argument("-O", action="store_true", help="optimize the module first")
+    parser.add_argument("-n", type=int, default=20, help="repetitions per measurement")
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        ast, err = yacc.parse(f.read())
+    if err:
+        sys.exit(err)
+    mod = llvm.parse_assembly(str(codeGen.generate_code(ast)))
+    if args.O:
+        binding.optimize_module(mod, [False, 10, False, 3, 2, False])
+    llvm_ir = str(mod)
+
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        objects = os.path.join(tmp, "objects")
+        cold, warm = [], []
+        for _ in range(args.n):
+            shutil.rmtree(objects, ignore_errors=True)
+            cold.append(finalize_time(llvm_ir, objects))
+            warm.append(finalize_time(llvm_ir, objects))
+        report("finalize_object", cold, warm)
+
+        # prime the parser table cache so only the object cache differs
+        ekcc_time(args.file, args.O, tmp)
+        cold, warm = [], []
+        for _ in range(args.n):
+            shutil.rmtree(os.path.join(tmp, "objects"), ignore_errors=True)
+            cold.append(ekcc_time(args.file, args.O, tmp))
+            warm.append(ekcc_time(args.file, args.O, tmp))
+        report("ekcc -jit (end to end)", cold, warm)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
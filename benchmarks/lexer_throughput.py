@@ -0,0 +1,116 @@
+"""
+Tokenizer throughput benchmark: MB/s of lexer.py on a large generated
+program (benchmarks/generator.py).
+
+Runs the measurement in a fresh process for the working tree and, with
+--baseline, for another git revision (for example the last one with the PLY
+lexer), and prints both side by side. Every tree is timed through the
+input()/token() interface the parser uses, and through lexer.tokenize where
+it has one. The token streams of the trees are compared as well.
+
+    python3 benchmarks/lexer_throughput.py [--mb N] [--runs N] [--baseline REV]
+"""
+import argparse, os, sys, json
+import hashlib
+import shutil, subprocess, tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generator import generate_program
+from codegen_ir import extract
+
+def generate_source(mb):
+    """
+    A valid .ek program of at least mb megabytes.
+    """
+    sample = generate_program(functions=10)
+    functions = int(mb * 2**20 / len(sample) * 10) + 1
+    return generate_program(functions=functions)
+
+def token_stream(lexer, source):
+    lexer.lexer.lineno = 1
+    lexer.lexer.input(source)
+    while True:
+        token = lexer.lexer.token()
+        if not token:
+            return
+        yield token
+
+def measure(tree, path, runs):
+    """
+    Runs in the child process: best time of runs passes over path with the
+    lexer in tree.
+    """
+    sys.path.insert(0, tree)
+    import lexer
+    with open(path) as f:
+        source = f.read()
+    result = {}
+    digest = hashlib.sha256()
+    count = 0
+    # (type, value) only, the old lexer's line numbers are off
+    for token in token_stream(lexer, source):
+        digest.update(repr((token.type, token.value)).encode("utf8"))
+        count += 1
+    result["tokens"] = count
+    result["digest"] = digest.hexdigest()
+
+    passes = {"token()": lambda: sum(1 for _ in token_stream(lexer, source))}
+    if hasattr(lexer, "tokenize"):
+        passes["tokenize"] = lambda: len(lexer.tokenize(source))
+    for name, run in passes.items():
+        best = None
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        result[name] = best
+    json.dump(result, sys.stdout)
+
+def run_measure(tree, path, runs):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", tree, path, str(runs)],
+                         stdout=subprocess.PIPE, check=True)
+    return json.loads(out.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mb", type=float, default=4, help="size of the generated source in megabytes")
+    parser.add_argument("--runs", type=int, default=3, help="passes per interface, the best is kept")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--measure", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        tree, path, runs = args.measure
+        measure(tree, path, int(runs))
+        return
+
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        path = os.path.join(tmp, "big.ek")
+        source = generate_source(args.mb)
+        with open(path, "w") as f:
+            f.write(source)
+        results = [("working tree", run_measure(ROOT, path, args.runs))]
+        if args.baseline:
+            tree = os.path.join(tmp, "baseline")
+            os.makedirs(tree)
+            extract(args.baseline, tree)
+            results.append((args.baseline, run_measure(tree, path, args.runs)))
+    finally:
+        shutil.rmtree(tmp)
+
+    mb = len(source.encode("utf8")) / 2**20
+    print("%.1f MB, %d tokens" % (mb, results[0][1]["tokens"]))
+    print("%-16s %12s %12s" % ("", "token() MB/s", "tokenize MB/s"))
+    for name, r in results:
+        print("%-16s %12.2f %12s" % (name, mb / r["token()"],
+              "%.2f" % (mb / r["tokenize"]) if "tokenize" in r else "-"))
+    if len(results) > 1:
+        same = all(r["digest"] == results[0][1]["digest"] for name, r in results)
+        print("token streams %s" % ("match" if same else "DIFFER"))
+
+if __name__ == "__main__":
+    main()
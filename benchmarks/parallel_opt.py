@@ -0,0 +1,56 @@
+"""
+Parallel optimization benchmark: time of -O over a large generated program
+with the whole module optimized at once and split by function over 1, 2,
+4, ... worker processes (ekcc --opt-jobs).
+
+    python3 benchmarks/parallel_opt.py [--functions N] [--stmts M] [--jobs 1,2,4,8]
+"""
+import argparse, os, sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llvmlite.binding as llvm
+
+import yacc, codeGen, binding, parallel, fold
+from generator import generate_program
+from codegen_ir import OPTIMIZATION, count_instructions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--functions", type=int, default=400)
+    parser.add_argument("--stmts", type=int, default=10, help="statements per function (see generator.py)")
+    parser.add_argument("--jobs", default=None, help="comma separated worker counts (default: powers of two up to twice the CPUs)")
+    args = parser.parse_args()
+    if args.jobs:
+        jobs = [int(j) for j in args.jobs.split(",")]
+    else:
+        jobs = [1]
+        while jobs[-1] < 2 * (os.cpu_count() or 1):
+            jobs.append(jobs[-1] * 2)
+
+    sys.setrecursionlimit(100000)
+    ast, err = yacc.parse(generate_program(functions=args.functions, stmts=args.stmts))
+    if err:
+        raise Exception(err)
+    fold.fold_program(ast)
+    module = codeGen.generate_code(ast)
+
+    # both start from codeGen's module, as in ekcc
+    start_time = time.perf_counter()
+    mod = llvm.parse_assembly(str(module))
+    binding.optimize_module(mod, OPTIMIZATION)
+    serial = time.perf_counter() - start_time
+    print("%d functions x %d statements, %d CPUs" % (args.functions, args.stmts, os.cpu_count() or 1))
+    print("%-14s %10s %9s %8s" % ("", "opt s", "speed-up", "instrs"))
+    print("%-14s %10.3f %9.2f %8d" % ("whole module", serial, 1.0, count_instructions(mod)["instructions"]))
+    for j in jobs:
+        start_time = time.perf_counter()
+        mod = parallel.optimize_module(module, OPTIMIZATION, j)
+        elapsed = time.perf_counter() - start_time
+        print("%-14s %10.3f %9.2f %8d" % ("%d workers" % j, elapsed, serial / elapsed, count_instructions(mod)["instructions"]))
+
+if __name__ == "__main__":
+    main()
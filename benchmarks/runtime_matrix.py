@@ -0,0 +1,156 @@
+"""
+Runtime benchmark: run() time of the kernels in benchmarks/programs under a
+matrix of optimization flags, JIT-ed and as a linked executable.
+
+Every kernel is compiled under every configuration in a fresh process with
+binding.compile_module, run --warmup times and then timed --reps times; the
+median is reported. The executable (ekcc -emit-llvm -o exe) is built from
+the same final IR and timed as a whole process, including its start-up.
+
+By default the configurations vary one flag at a time from -O -ol 3 -sl 2
+-it 10 (the ekcc defaults); --full runs the whole cross product.
+
+    python3 benchmarks/runtime_matrix.py [--full] [--warmup N] [--reps N]
+        [--no-exe] [-o results.json] [kernel.ek ...]
+"""
+import argparse, os, sys, json
+import itertools
+import shutil, subprocess, tempfile
+import statistics
+import time
+
+from codegen_ir import discard_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KERNELS = [os.path.join(ROOT, "benchmarks", "programs", name + ".ek")
+           for name in ["fib", "loops", "floats", "cint", "refs", "prints", "numbers"]]
+
+# [dul, it, lv, ol, sl, sv] as in ekcc
+DEFAULT = {"O": True, "dul": False, "it": 10, "lv": False, "ol": 3, "sl": 2, "sv": False}
+
+VALUES = {
+    "O": [False, True],
+    "ol": [0, 1, 2, 3],
+    "sl": [0, 1, 2],
+    "it": [0, 10, 250],
+    "lv": [False, True],
+    "sv": [False, True],
+    "dul": [False, True],
+}
+
+def configurations(full):
+    if full:
+        # without -O the other flags do nothing
+        configs = [dict(DEFAULT, O=False)]
+        names = [name for name in VALUES if name != "O"]
+        for values in itertools.product(*[VALUES[name] for name in names]):
+            configs.append(dict(DEFAULT, **dict(zip(names, values))))
+        return configs
+    configs = [DEFAULT]
+    for name, values in VALUES.items():
+        for value in values:
+            config = dict(DEFAULT, **{name: value})
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+def label(config):
+    if not config["O"]:
+        return "noopt"
+    flags = ["-ol %d" % config["ol"], "-sl %d" % config["sl"], "-it %d" % config["it"]]
+    flags += ["-" + name for name in ["lv", "sv", "dul"] if config[name]]
+    return " ".join(flags)
+
+def optimization(config):
+    return [config["dul"], config["it"], config["lv"], config["ol"], config["sl"], config["sv"]]
+
+def measure(path, config, warmup, reps, exe):
+    """
+    Runs in the child process: JIT path with config and time run(). With
+    exe, also link the final IR into that executable.
+    """
+    sys.path.insert(0, ROOT)
+    import yacc, codeGen, binding, fold, linker
+    with open(path) as f:
+        source = f.read()
+    start_time = time.perf_counter()
+    ast, err = yacc.parse(source)
+    if err:
+        raise Exception(err)
+    fold.fold_program(ast)
+    module = codeGen.generate_code(ast)
+    engine, llvm_ir = binding.compile_module(module, config["O"], optimization(config), 0)
+    compile_time = time.perf_counter() - start_time
+    times = []
+    with discard_stdout():
+        for i in range(warmup + reps):
+            start_time = time.perf_counter()
+            binding.run_function(engine)
+            elapsed = time.perf_counter() - start_time
+            if i >= warmup:
+                times.append(elapsed)
+            binding.flush_stdio()
+    if exe:
+        linker.link_executable(binding.emit_object(llvm_ir), exe)
+    json.dump({"compile": compile_time, "jit": statistics.median(times)}, sys.stdout)
+
+def time_exe(exe, warmup, reps):
+    times = []
+    for i in range(warmup + reps):
+        start_time = time.perf_counter()
+        subprocess.run([exe], stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start_time
+        if i >= warmup:
+            times.append(elapsed)
+    return statistics.median(times)
+
+def run_measure(path, config, warmup, reps, exe):
+    command = [sys.executable, os.path.abspath(__file__), "--measure", path, json.dumps(config),
+               str(warmup), str(reps), exe or ""]
+    out = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    result = json.loads(out.stdout)
+    if exe:
+        result["exe"] = time_exe(exe, warmup, reps)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="kernels to run (default: fib, loops, floats, cint, refs, prints, numbers)")
+    parser.add_argument("--full", action="store_true", help="the cross product of all flag values")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs first")
+    parser.add_argument("--reps", type=int, default=5, help="timed runs, the median is reported")
+    parser.add_argument("--no-exe", action="store_true", help="leave out the linked executables")
+    parser.add_argument("-o", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--measure", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        path, config, warmup, reps, exe = args.measure
+        measure(path, json.loads(config), int(warmup), int(reps), exe or None)
+        return
+
+    configs = configurations(args.full)
+    results = []
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        exe = None if args.no_exe else os.path.join(tmp, "exe")
+        print("%-10s %-28s %10s %10s %10s" % ("kernel", "flags", "compile ms", "jit ms", "exe ms"))
+        for path in args.files or KERNELS:
+            kernel = os.path.basename(path)[:-3]
+            best = None
+            for config in configs:
+                r = run_measure(path, config, args.warmup, args.reps, exe)
+                results.append(dict(r, kernel=kernel, flags=label(config), config=config))
+                print("%-10s %-28s %10.2f %10.3f %10s" % (kernel[:10], label(config), r["compile"] * 1000, r["jit"] * 1000,
+                      "%.3f" % (r["exe"] * 1000) if "exe" in r else "-"))
+                if best is None or r["jit"] < best[1]:
+                    best = (label(config), r["jit"])
+            print("%-10s fastest JIT: %s" % (kernel[:10], best[0]))
+    finally:
+        shutil.rmtree(tmp)
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Compiler scalability benchmark: the time of every ekcc phase, peak memory
+and IR size on generated programs (benchmarks/generator.py) as each axis
+grows with the others at their defaults.
+
+Every program is compiled and run by ekcc in a fresh process with -trace
+and -stats, the best of --runs runs is kept, and the results are written as
+JSON. With --baseline, a phase of any program that got slower than the
+baseline by more than --threshold (and by more than --min-ms) is reported
+and the benchmark exits with status 1.
+
+    python3 benchmarks/scaling.py [--axes functions,stmts,...] [--runs N]
+        [--flags "-O -jit"] [-o results.json] [--baseline results.json]
+        [--threshold 0.25] [--min-ms 2]
+"""
+import argparse, os, sys, json
+import shutil, subprocess, tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generator import DEFAULTS, generate_program
+
+AXES = {
+    "functions": [10, 40, 160],
+    "stmts": [10, 40, 160],
+    "depth": [1, 2, 3, 4],
+    "length": [2, 4, 8],
+    "nesting": [1, 2, 4, 6],
+    "prints": [0, 8, 32],
+    "fanout": [0, 2, 8],
+}
+
+def phase_times(trace):
+    """
+    Seconds spent in every span of an ekcc -trace file, added up by name.
+    """
+    phases = {}
+    for event in trace["traceEvents"]:
+        # an open span is a program that exit()ed
+        if event["ph"] == "X":
+            phases[event["name"]] = phases.get(event["name"], 0.0) + event["dur"] / 1e6
+    return phases
+
+def run_ekcc(path, flags, tmp):
+    """
+    Compile (and run) path once; returns the phase times, the wall time,
+    the peak RSS and the IR statistics before and after optimization.
+    """
+    trace_file = os.path.join(tmp, "trace.json")
+    stats_file = os.path.join(tmp, "stats.json")
+    command = [sys.executable, os.path.join(ROOT, "ekcc.py")] + flags + \
+        ["-trace", trace_file, "-stats", "-stats-file", stats_file, path]
+    with open(os.path.join(tmp, "stderr"), "w+") as errors:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=errors)
+        # wait4 for the peak RSS of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start_time
+        if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+            errors.seek(0)
+            raise Exception("ekcc failed on %s:\n%s" % (path, errors.read()))
+    with open(trace_file) as f:
+        phases = phase_times(json.load(f))
+    with open(stats_file) as f:
+        ir_stats = json.load(f)["ir"]
+    return {"phases": phases, "wall": wall, "peak_rss_mb": usage.ru_maxrss / 1024,
+            "ir": {when: ir_stats[when]["totals"] for when in ir_stats}}
+
+def measure(axis, value, flags, runs, tmp):
+    path = os.path.join(tmp, "%s-%d.ek" % (axis, value))
+    source = generate_program(**{axis: value})
+    with open(path, "w") as f:
+        f.write(source)
+    best = None
+    for _ in range(runs):
+        result = run_ekcc(path, flags, tmp)
+        if best is None:
+            best = result
+            continue
+        for name, seconds in result["phases"].items():
+            best["phases"][name] = min(best["phases"].get(name, seconds), seconds)
+        best["wall"] = min(best["wall"], result["wall"])
+        best["peak_rss_mb"] = min(best["peak_rss_mb"], result["peak_rss_mb"])
+    best["source_bytes"] = len(source)
+    return best
+
+def regressions(results, baseline, threshold, min_seconds):
+    """
+    (program, phase, baseline s, s) of every phase slower than in baseline
+    by more than threshold and min_seconds.
+    """
+    found = []
+    for program, result in results["programs"].items():
+        base = baseline["programs"].get(program)
+        if base is None:
+            continue
+        for name, seconds in sorted(result["phases"].items()):
+            old = base["phases"].get(name)
+            if old is not None and seconds > old * (1 + threshold) and seconds - old > min_seconds:
+                found.append((program, name, old, seconds))
+    return found
+
+def print_table(results):
+    names = ["lex/parse", "check_violation", "fold", "generate_code", "str(module)",
+             "parse_assembly", "optimize", "finalize", "execute"]
+    print("%-14s" % "" + "".join("%12s" % name[:11] for name in names) + "%9s %9s %9s"
+          % ("wall s", "RSS MB", "instrs"))
+    for program, r in results["programs"].items():
+        print("%-14s" % program + "".join("%12.4f" % r["phases"].get(name, 0.0) for name in names)
+              + "%9.3f %9.1f %9d" % (r["wall"], r["peak_rss_mb"], r["ir"]["after"]["instructions"]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--axes", default=",".join(AXES), help="comma separated axes to scale")
+    parser.add_argument("--runs", type=int, default=1, help="runs per program, the best is kept")
+    parser.add_argument("--flags", default="-O -jit", help="ekcc flags")
+    parser.add_argument("-o", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown of a phase, as a fraction")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="slowdowns of less than this many ms are ignored")
+    args = parser.parse_args()
+    flags = args.flags.split()
+
+    results = {"flags": flags, "defaults": DEFAULTS, "programs": {}}
+    tmp = tempfile.mkdtemp(prefix="ekcc-bench-")
+    try:
+        for axis in args.axes.split(","):
+            for value in AXES[axis]:
+                program = "%s=%d" % (axis, value)
+                results["programs"][program] = measure(axis, value, flags, args.runs, tmp)
+    finally:
+        shutil.rmtree(tmp)
+    print_table(results)
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold, args.min_ms / 1000)
+        for program, name, old, seconds in found:
+            print("regression: %s %s %.4f s -> %.4f s (+%.0f%%)"
+                  % (program, name, old, seconds, (seconds / old - 1) * 100))
+        if found:
+            sys.exit(1)
+        print("no phase regressed by more than %.0f%%" % (args.threshold * 100))
+
+if __name__ == "__main__":
+    main()
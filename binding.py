@@ -1,85 +1,331 @@
 from __future__ import print_function
 
-from ctypes import CFUNCTYPE, c_int, c_float
+import os, sys
+import tempfile
+from ctypes import CFUNCTYPE, CDLL, c_int, c_int64, c_float, c_char_p, c_void_p, addressof, cast, string_at
 
+from llvmlite import ir
 import llvmlite.binding as llvm
 
 import time
 
+import cache
+import tracing
+import codeGen
+import runtime
+
 # All these initializations are required for code generation!
 llvm.initialize()
 llvm.initialize_native_target()
 llvm.initialize_native_asmprinter()  # yes, even this one
 
-def create_execution_engine():
+def cpu_features(cpu=None):
     """
-    Create an ExecutionEngine suitable for JIT code generation on
-    the host CPU.  The engine is reusable for an arbitrary number of
-    modules.
+    The CPU name and features code is generated for: the host's, or the
+    plain cpu given with -march.
+    """
+    if cpu is None:
+        return llvm.get_host_cpu_name(), llvm.get_host_cpu_features().flatten()
+    return cpu, ""
+
+def known_cpu(cpu):
+    """
+    Whether the host target knows the CPU name cpu. LLVM only warns about an
+    unknown one, on stderr, and aborts once it generates code for it.
     """
-    # Create a target machine representing the host
+    sys.stderr.flush()
+    saved = os.dup(2)
+    with tempfile.TemporaryFile() as log:
+        os.dup2(log.fileno(), 2)
+        try:
+            llvm.Target.from_default_triple().create_target_machine(cpu=cpu)
+        finally:
+            os.dup2(saved, 2)
+            os.close(saved)
+        log.seek(0)
+        return b"is not a recognized processor" not in log.read()
+
+def codegen_level(should_optimize, optimization):
+    """
+    The code generator's opt level: -ol with -O, LLVM's default 2 otherwise.
+    """
+    if should_optimize:
+        return min(int(optimization[3]), 3)
+    return 2
+
+def target_id(cpu=None, opt=2):
+    """
+    Identifies the machine code the engines produce, for the object cache.
+    """
+    name, features = cpu_features(cpu)
+    return "%s %s %s opt%d llvm-%s" % (llvm.get_default_triple(), name, features, opt,
+                                        ".".join(str(v) for v in llvm.llvm_version_info))
+
+def create_target_machine(cpu=None, opt=2, reloc="default"):
+    """
+    A target machine for the host CPU and its features (so that e.g. AVX is
+    used where the host has it), or for cpu.
+    """
+    name, features = cpu_features(cpu)
     target = llvm.Target.from_default_triple()
-    target_machine = target.create_target_machine()
+    return target.create_target_machine(cpu=name, features=features, opt=opt, reloc=reloc)
+
+def create_execution_engine(object_cache=None, cpu=None, opt=2):
+    """
+    Create an ExecutionEngine suitable for JIT code generation on
+    the host CPU (or cpu), generating code at the opt level opt. The
+    engine is reusable for an arbitrary number of modules.
+    With a cache.ObjectCache, machine code is stored in and loaded from
+    it through MCJIT's object cache hooks.
+    """
+    target_machine = create_target_machine(cpu, opt)
     # And an execution engine with an empty backing module
     backing_mod = llvm.parse_assembly("")
     engine = llvm.create_mcjit_compiler(backing_mod, target_machine)
+    if object_cache is not None:
+        engine.set_object_cache(object_cache.notify, object_cache.getbuffer)
     return engine
 
 
-def compile_ir(engine, llvm_ir, should_optimize, optimization):
+def emit_object(llvm_ir, cpu=None, opt=2):
+    """
+    Compile the LLVM IR string to a relocatable object for the host (or
+    cpu), for linking into an executable. Returns the object code as bytes.
+    """
+    # position independent, so it can be linked into a PIE executable
+    target_machine = create_target_machine(cpu, opt, reloc="pic")
+    mod = parse_assembly(llvm_ir)
+    with tracing.span("verify"):
+        mod.verify()
+    with tracing.span("emit object"):
+        return target_machine.emit_object(mod)
+
+def optimize_module(mod, optimization, cpu=None):
+    """
+    Run the function and module pass pipelines selected by the optimization
+    flags [dul, it, lv, ol, sl, sv] over mod in place, with the cost model
+    of the host CPU (or cpu).
+    """
+    pmb = llvm.create_pass_manager_builder()
+    if optimization[0]:
+        pmb.disable_unroll_loops = True
+    pmb.inlining_threshold = int(optimization[1])
+    if optimization[2]:
+        pmb.loop_vectorize = True
+    pmb.opt_level = int(optimization[3])
+    pmb.size_level = int(optimization[4])
+    if optimization[5]:
+        pmb.slp_vectorize = True
+    target_machine = create_target_machine(cpu, codegen_level(True, optimization))
+
+    # the per-function simplifications first, as clang runs them
+    fpm = llvm.create_function_pass_manager(mod)
+    target_machine.add_analysis_passes(fpm)
+    pmb.populate(fpm)
+    pm = llvm.create_module_pass_manager()
+    target_machine.add_analysis_passes(pm)
+    pmb.populate(pm)
+    with tracing.span("function pass manager"):
+        fpm.initialize()
+        for func in mod.functions:
+            fpm.run(func)
+        fpm.finalize()
+    with tracing.span("module pass manager", opt_level=pmb.opt_level, size_level=pmb.size_level):
+        pm.run(mod)
+    # the function pass manager holds on to mod otherwise
+    fpm.close()
+    pm.close()
+    pmb.close()
+
+def compile_ir(engine, llvm_ir, should_optimize, optimization, artifacts=None, jobs=None, report=None, cpu=None):
     """
-    Compile the LLVM IR string with the given engine.
-    The compiled module object is returned.
+    Compile the LLVM IR string (or llvm.ModuleRef) with the given engine.
+    The final IR is returned.
+    If artifacts is a dict, the input IR and the final IR are stored in it
+    as "ir" and "optimized_ir".
+    With jobs and an llvmlite.ir.Module from codeGen, the functions are
+    optimized separately in jobs processes (see parallel.py).
+    A stats.Report is filled in with the pass timings and IR statistics.
+    The optimizer's cost model is that of the host CPU, or of cpu.
     """
+    split = should_optimize and jobs is not None and isinstance(llvm_ir, ir.Module)
     # Create a LLVM module object from the IR
-    mod = llvm.parse_assembly(str(llvm_ir))
+    if isinstance(llvm_ir, llvm.ModuleRef):
+        mod = llvm_ir
+    elif not split:
+        mod = parse_assembly(llvm_ir)
+    else:
+        # built by parallel.optimize_module
+        mod = None
+    if artifacts is not None:
+        artifacts["ir"] = str(llvm_ir)
+    if report is not None:
+        report.start(mod if mod is not None else parse_assembly(llvm_ir))
 
     if should_optimize:
-        print("######## Optimization Start ########")
-        pmb = llvm.create_pass_manager_builder()
-        if optimization[0]:
-            pmb.disable_unroll_loops = True
-        pmb.opt_level = int(optimization[1])
-        if optimization[2]:
-            pmb.loop_vectorize = True
-        pmb.opt_level = int(optimization[3])
-        pmb.size_level = int(optimization[4])
-        if optimization[5]:
-            pmb.slp_vectorize = True
-
-        fpm = llvm.create_function_pass_manager(mod)
-        pmb.populate(fpm)
-
-        pm = llvm.create_module_pass_manager()
-        pmb.populate(pm)
-        
+        print("######## Optimization Start ########", file=sys.stderr)
         start_time = time.time()
-        pm.run(mod)
-        print("######## Total Optimization Time: %s seconds ########" % (time.time() - start_time))
+        with tracing.span("optimize", jobs=jobs if split else None):
+            if split:
+                import parallel
+                mod = parallel.optimize_module(llvm_ir, optimization, jobs, cpu)
+            else:
+                optimize_module(mod, optimization, cpu)
+        print("######## Total Optimization Time: %s seconds ########" % (time.time() - start_time), file=sys.stderr)
+        if report is not None:
+            report.phase("optimize", time.time() - start_time)
 
-    mod.verify()
+    with tracing.span("verify"):
+        mod.verify()
+    if report is not None:
+        report.optimized(mod)
     # Now add the module and make sure it is ready for execution
-    engine.add_module(mod)
-    engine.finalize_object()
-    engine.run_static_constructors()
+    with tracing.span("finalize"):
+        engine.add_module(mod)
+        engine.finalize_object()
+        engine.run_static_constructors()
+    if report is not None:
+        report.finish()
+    if artifacts is not None:
+        artifacts["optimized_ir"] = str(mod)
     return str(mod)
 
-# The function called by ekcc
-def compile_and_execute(llvm_ir, should_optimize, jit, optimization, total_time):
-    print("################## Compile Start ##################")
+def parse_assembly(llvm_ir):
+    """
+    Print the llvmlite.ir.Module (or take the IR string) llvm_ir and parse
+    it into an llvm.ModuleRef.
+    """
+    with tracing.span("str(module)"):
+        text = str(llvm_ir)
+    with tracing.span("parse_assembly", bytes=len(text)):
+        return llvm.parse_assembly(text)
+
+def load_object(engine, object_code):
+    """
+    Add previously generated object code to the engine instead of a module.
+    """
+    with tracing.span("finalize", cached=True):
+        engine.add_object_file(llvm.ObjectFileRef.from_data(object_code))
+        engine.finalize_object()
+
+_libc = CDLL(None)
+
+def flush_stdio():
+    """
+    Flush the C stdio buffers that JIT-compiled code printed into.
+    """
+    _libc.fflush(None)
+
+def set_args(engine, args):
+    """
+    Make args (strings) the values of arg()/argf() for the program in
+    engine. Returns the argument array, which must be kept alive while the
+    program runs.
+    """
+    values = [str(a).encode("utf8") for a in args]
+    argv = (c_char_p * (len(values) + 1))(*values)
+    # programs without arg() and argf() have no argument array
+    argc_address = engine.get_global_value_address(codeGen.ARGC)
+    if argc_address:
+        c_int.from_address(argc_address).value = len(values)
+        c_void_p.from_address(engine.get_global_value_address(codeGen.ARGV)).value = addressof(argv)
+    return argv
+
+def flush_output(engine):
+    """
+    Write out what the program in engine printed into its output buffer
+    (see runtime.py).
+    """
+    address = engine.get_function_address(runtime.FLUSH)
+    if address:
+        CFUNCTYPE(None)(address)()
+
+OUTPUT_CALLBACK = CFUNCTYPE(None, c_void_p, c_int64)
+
+def capture_output(engine, output):
+    """
+    Make the program in engine append what it prints to the bytearray
+    output instead of writing it to stdout, or write to stdout again if
+    output is None. Returns the callback, which must be kept alive while
+    the program runs.
+    """
+    callback = None
+    if output is not None:
+        callback = OUTPUT_CALLBACK(lambda data, size: output.extend(string_at(data, size)))
+    c_void_p.from_address(engine.get_global_value_address(runtime.CALLBACK)).value = \
+        cast(callback, c_void_p).value if callback is not None else None
+    return callback
+
+def run_function(engine, args=(), output=None):
+    """
+    Call the program's run() function in a module that has already been
+    added to engine and finalized, with args as the values of arg()/argf(),
+    and return its result. The program's output is flushed when run()
+    returns; with a bytearray as output it is appended there instead of
+    written to stdout. A runtime error exit()s the process either way.
+    """
+    argv = set_args(engine, args)
+    callback = capture_output(engine, output) if output is not None else None
+    # what Python printed comes first
+    sys.stdout.flush()
+    # Look up the function pointer (a Python int)
+    with tracing.span("symbol lookup", symbol="run"):
+        func_ptr = engine.get_function_address("run")
+    # Run the function via ctypes
+    cfunc = CFUNCTYPE(c_int)(func_ptr)
+    with tracing.span("execute"):
+        # the program may exit() the process
+        tracing.write()
+        result = cfunc()
+    flush_output(engine)
+    if callback is not None:
+        capture_output(engine, None)
+    return result
+
+def compile_module(llvm_ir, should_optimize, optimization, total_time, artifacts=None, object_cache_dir=None, jobs=None, report=None, cpu=None):
+    """
+    Create an engine and compile llvm_ir into it, printing the compile
+    banners. Returns the engine and the final IR. artifacts also receives
+    the object code as "object". With object_cache_dir, machine code for
+    modules compiled before is loaded from that directory. jobs and report
+    are passed on to compile_ir. Code is generated for the host CPU, or for
+    cpu, at the opt level of -ol.
+    """
+    print("################## Compile Start ##################", file=sys.stderr)
+    start_time = time.time()
+    opt = codegen_level(should_optimize, optimization)
+    objects = cache.ObjectCache(object_cache_dir, target_id(cpu, opt))
+    engine = create_execution_engine(objects, cpu, opt)
+    mod = compile_ir(engine, llvm_ir, should_optimize, optimization, artifacts, jobs, report, cpu)
+    if artifacts is not None:
+        artifacts["object"] = objects.last_object
+    print("################## Total Compile Time: %s seconds ##################" % (time.time() - start_time + total_time), file=sys.stderr)
+    print(file=sys.stderr)
+    return engine, mod
+
+def load_module(object_code, total_time, cpu=None):
+    """
+    Like compile_module, for object code from the compile cache.
+    """
+    print("################## Compile Start (cached) ##################", file=sys.stderr)
+    start_time = time.time()
+    engine = create_execution_engine(cpu=cpu)
+    load_object(engine, object_code)
+    print("################## Total Compile Time: %s seconds ##################" % (time.time() - start_time + total_time), file=sys.stderr)
+    print(file=sys.stderr)
+    return engine
+
+def execute(engine, args=()):
+    print("######## Execution Start ########", file=sys.stderr)
     start_time = time.time()
-    engine = create_execution_engine()
-    mod = compile_ir(engine, llvm_ir, should_optimize, optimization)
-    print("################## Total Compile Time: %s seconds ##################" % (time.time() - start_time + total_time))
-    print()
+    res = run_function(engine, args)
+    print("######## Total Execution Time: %s seconds ########" % (time.time() - start_time), file=sys.stderr)
+    print(file=sys.stderr)
+    return res
+
+# The function called by ekcc
+def compile_and_execute(llvm_ir, should_optimize, jit, optimization, total_time, object_cache_dir=None, jobs=None, cpu=None, args=()):
+    engine, mod = compile_module(llvm_ir, should_optimize, optimization, total_time, object_cache_dir=object_cache_dir, jobs=jobs, cpu=cpu)
     if jit:
-        print("######## Execution Start ########")
-        # Look up the function pointer (a Python int)
-        func_ptr = engine.get_function_address("run")
-        # Run the function via ctypes
-        start_time = time.time()
-        cfunc = CFUNCTYPE(c_int)(func_ptr)
-        res = cfunc()
-        print("######## Total Execution Time: %s seconds ########" % (time.time() - start_time))
-        print()
+        execute(engine, args)
     return mod
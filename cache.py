@@ -0,0 +1,243 @@
+import os, sys, json
+import pickle
+import hashlib
+import fcntl
+import platform
+
+import llvmlite
+import llvmlite.binding as llvm
+
+import paths
+
+# Content-addressed cache of whole compilations. An entry is keyed by the
+# source text, every flag that changes the generated code, the llvmlite/LLVM
+# version, the host target and the compiler's own sources. It holds the AST
+# YAML, the unoptimized and final IR and the object code of the final module,
+# so a hit skips parsing, checking, code generation and optimization.
+#
+# Entries are single files written under a temporary name and renamed into
+# place, so concurrent ekcc processes can share the directory. The mtime of an
+# entry is its last use; once the directory grows past max_bytes the least
+# recently used entries are removed.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+COMPILER_SOURCES = ["ekcc.py", "lexer.py", "yacc.py", "nodes.py", "codeGen.py", "binding.py", "ranges.py", "fold.py", "parallel.py", "runtime.py"]
+
+_compiler_hash = None
+
+def compiler_hash():
+    global _compiler_hash
+    if _compiler_hash is None:
+        h = hashlib.sha256()
+        for name in ["llvmlite " + llvmlite.__version__,
+                     "llvm " + ".".join(str(v) for v in llvm.llvm_version_info),
+                     llvm.get_default_triple(), llvm.get_host_cpu_name(), platform.python_version()]:
+            h.update(name.encode("utf8") + b"\0")
+        base = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER_SOURCES:
+            with open(os.path.join(base, name), 'rb') as f:
+                h.update(f.read())
+        _compiler_hash = h.hexdigest()
+    return _compiler_hash
+
+def list_entries(directory, suffix):
+    """
+    (mtime, size, path) of every file in directory ending in suffix.
+    """
+    result = []
+    with os.scandir(directory) as it:
+        for e in it:
+            if e.name.endswith(suffix):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, e.path))
+    return result
+
+def evict_lru(entries, max_bytes):
+    """
+    Delete the least recently used of entries until they fit in max_bytes.
+    Returns the number of files deleted.
+    """
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            # another process evicted it first
+            pass
+        total -= size
+        evicted += 1
+    return evicted
+
+def write_atomic(path, data):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class CompileCache():
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or paths.cache_dir("compile")
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, source, flags):
+        """
+        flags is every flag that changes the generated code, as ekcc passes
+        them: [O, --opt-jobs given, dul, it, lv, ol, sl, sv, target_id],
+        target_id being binding.target_id of the -march CPU. The
+        arg()/argf() values are not part of it, one entry runs with any of
+        them.
+        """
+        fields = [compiler_hash(), source, [str(f) for f in flags]]
+        return hashlib.sha256(json.dumps(fields).encode("utf8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + ".entry")
+
+    def get(self, key):
+        """
+        Return the entry stored under key or None, and count the hit or miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.count(misses=1)
+            return None
+        self.count(hits=1)
+        return entry
+
+    def put(self, key, entry):
+        """
+        entry is a dict with "ast", "warnings", "check_report", "ir",
+        "optimized_ir" and "object".
+        """
+        path = self.path(key)
+        write_atomic(path, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        self.count(stores=1, bytes_written=os.path.getsize(path))
+        self.evict()
+
+    def entries(self):
+        return list_entries(self.root, ".entry")
+
+    def evict(self):
+        evicted = evict_lru(self.entries(), self.max_bytes)
+        if evicted:
+            self.count(evictions=evicted)
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.update_stats(lambda stats: stats.clear())
+
+    def count(self, **deltas):
+        def apply(stats):
+            for name, delta in deltas.items():
+                stats[name] = stats.get(name, 0) + delta
+        self.update_stats(apply)
+
+    def update_stats(self, change):
+        # the counters are shared by every ekcc process using this directory
+        with open(os.path.join(self.root, "stats.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stats_path = os.path.join(self.root, "stats.json")
+            try:
+                with open(stats_path, 'r') as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                stats = {}
+            change(stats)
+            with open(stats_path + ".tmp", 'w') as f:
+                json.dump(stats, f)
+            os.replace(stats_path + ".tmp", stats_path)
+
+    def stats(self):
+        try:
+            with open(os.path.join(self.root, "stats.json"), 'r') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        entries = self.entries()
+        result = {"directory": self.root, "entries": len(entries),
+                  "bytes": sum(size for _, size, _ in entries), "max_bytes": self.max_bytes}
+        for name in ["hits", "misses", "stores", "evictions", "bytes_written"]:
+            result[name] = stats.get(name, 0)
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = result["hits"] / lookups if lookups else 0.0
+        return result
+
+class ObjectCache():
+    """
+    MCJIT object cache: install notify and getbuffer as the engine's object
+    cache hooks and machine code is stored in directory as <hash>.o, keyed
+    by the module's IR and the target. A later engine compiling an identical
+    module loads the object instead of running instruction selection and
+    register allocation again. With directory None objects are only kept
+    for the caller. The object of the last module compiled or loaded is
+    available as last_object.
+    """
+    def __init__(self, directory=None, target_id="", max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.target_id = target_id
+        self.max_bytes = max_bytes
+        self.last_object = None
+        self.pending = None
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, module):
+        h = hashlib.sha256(self.target_id.encode("utf8") + b"\0" + str(module).encode("utf8"))
+        return os.path.join(self.directory, h.hexdigest() + ".o")
+
+    # MCJIT asks getbuffer for a module before generating code for it and
+    # calls notify right after. Code generation rewrites the module's IR, so
+    # the key is computed once in getbuffer and remembered for notify.
+
+    def getbuffer(self, module):
+        if self.directory is None:
+            return None
+        path = self.path(module)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            self.pending = path
+            return None
+        self.hits += 1
+        self.last_object = data
+        return data
+
+    def notify(self, module, buffer):
+        self.last_object = buffer
+        if self.directory is not None and self.pending is not None:
+            write_atomic(self.pending, buffer)
+            self.pending = None
+            evict_lru(list_entries(self.directory, ".o"), self.max_bytes)
+
+def print_stats(compile_cache, file=sys.stdout):
+    stats = compile_cache.stats()
+    print("directory:     %s" % stats["directory"], file=file)
+    print("entries:       %d" % stats["entries"], file=file)
+    print("bytes:         %d (max %d)" % (stats["bytes"], stats["max_bytes"]), file=file)
+    print("hits:          %d" % stats["hits"], file=file)
+    print("misses:        %d" % stats["misses"], file=file)
+    print("hit rate:      %.1f%%" % (100 * stats["hit_rate"]), file=file)
+    print("stores:        %d" % stats["stores"], file=file)
+    print("bytes written: %d" % stats["bytes_written"], file=file)
+    print("evictions:     %d" % stats["evictions"], file=file)
@@ -2,6 +2,13 @@ from llvmlite import ir
 import llvmlite.binding as llvm
 import ctypes
 import sys
+import hashlib
+from collections import ChainMap
+
+import nodes
+import ranges
+import pgo
+import runtime
 
 def load_var(builder, pointer):
     while pointer.type.is_pointer:
@@ -17,6 +24,12 @@ def get_pointer(builder, pointer):
         next_pointer = builder.load(pointer)
     return pointer
 
+def entry_alloca(builder, typ):
+    # stack slots go in the entry block, where mem2reg can promote them and
+    # they are allocated once per call rather than once per loop iteration
+    with builder.goto_entry_block():
+        return builder.alloca(typ)
+
 def generate_type(typ):
     if typ == "cint":
         return ir.IntType(32)
@@ -42,85 +55,104 @@ def generate_type(typ):
     elif typ == "slit":
         return ir.PointerType(ir.IntType(8))
 
-def generate_slit(string):
-    c_str_val = ir.Constant(ir.ArrayType(ir.IntType(8), len(string)), bytearray(string.encode("utf8")))
-    return c_str_val
-
-def generate_arg(ast, module, undefined_args):
-    # Declare function
+def generate_line(module, string):
+    """
+    An i8* to string and a newline in a private constant global, and its
+    length. Globals are named after their contents, so every use of the
+    same literal in the module shares one.
+    """
+    data = (string + "\n").encode("utf8")
+    name = "str." + hashlib.sha1(data).hexdigest()[:16]
+    return runtime.string_constant(module, name, string + "\n"), len(data)
+
+def generate_print_string(module, builder, string):
+    line, size = generate_line(module, string)
+    builder.call(runtime.runtime_function(module, "ek.print.bytes"), [line, ir.Constant(ir.IntType(64), size)])
+
+# arg(i) and argf(i) read the i-th value after the input file from the runtime
+# argument array: ARGV holds ARGC strings, set by binding.set_args before
+# run() is called, or by main() in main.cpp from the executable's argv. The
+# globals have common linkage, so main.cpp's definitions take their place and
+# the copies in parallel.py's splits are merged. A compiled program runs
+# against any arguments.
+ARGC = "ek_argc"
+ARGV = "ek_argv"
+
+def declare_args(module):
+    for name, typ in [(ARGC, ir.IntType(32)), (ARGV, ir.IntType(8).as_pointer().as_pointer())]:
+        if name not in module.globals:
+            value = ir.GlobalVariable(module, typ, name=name)
+            value.linkage = 'common'
+            value.initializer = ir.Constant(typ, None)
+
+def declare_libc(module, name, ret_type):
+    # a C function taking a string
+    if name in module.globals:
+        return module.get_global(name)
+    func = ir.Function(module, ir.FunctionType(ret_type, [ir.IntType(8).as_pointer()]), name=name)
+    func.attributes.add("nounwind")
+    return func
+
+def generate_arg_string(func, module, default, convert):
+    """
+    The body of arg/argf: convert the string at the index, default if the
+    index is out of range.
+    """
+    declare_args(module)
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    bbfound = func.append_basic_block("found")
+    bbmissing = func.append_basic_block("missing")
+    index = func.args[0]
+    # unsigned, so negative indices are out of range too
+    builder.cbranch(builder.icmp_unsigned("<", index, builder.load(module.get_global(ARGC))), bbfound, bbmissing)
+    with builder.goto_block(bbmissing):
+        builder.ret(default)
+    builder.position_at_end(bbfound)
+    string = builder.load(builder.gep(builder.load(module.get_global(ARGV)), [index]))
+    builder.ret(convert(builder, string))
+
+def generate_arg(ast, module):
     fnty = ir.FunctionType(generate_type("int"), [generate_type("int")])
     func = ir.Function(module, fnty, name = "arg")
-    entry = func.append_basic_block("entry")
-    builder = ir.IRBuilder(entry)
-
-    # dummy switch else, switch end
-    bbelse = builder.append_basic_block("switch.else")
-    bbend = builder.append_basic_block("switch.end")
-    switch = builder.switch(func.args[0], bbelse)
-    with builder.goto_block(bbelse):
-        builder.ret(ir.Constant(generate_type("int"), 0))
-    with builder.goto_block(bbend):
-        builder.ret(ir.Constant(generate_type("int"), 0))
-
-    # build switch blocks
-    for idx, arg in enumerate(undefined_args):
-        bbi = builder.append_basic_block("switch.%d" % idx)
-        switch.add_case(idx, bbi)
-        with builder.goto_block(bbi):
-            builder.ret(ir.Constant(generate_type("int"), int(arg)))
-
-def generate_argf(ast, module, undefined_args):
-    # Declare function
+    atoi = declare_libc(module, "atoi", ir.IntType(32))
+    generate_arg_string(func, module, ir.Constant(generate_type("int"), 0),
+                        lambda builder, string: builder.call(atoi, [string]))
+
+def generate_argf(ast, module):
     fnty = ir.FunctionType(generate_type("float"), [generate_type("int")])
     func = ir.Function(module, fnty, name = "argf")
-    entry = func.append_basic_block("entry")
-    builder = ir.IRBuilder(entry)
-
-    # dummy switch else, switch end
-    bbelse = builder.append_basic_block("switch.else")
-    bbend = builder.append_basic_block("switch.end")
-    switch = builder.switch(func.args[0], bbelse)
-    with builder.goto_block(bbelse):
-        builder.ret(ir.Constant(generate_type("float"), float(0)))
-    with builder.goto_block(bbend):
-        builder.ret(ir.Constant(generate_type("float"), float(0)))
-
-    # build switch blocks
-    for idx, arg in enumerate(undefined_args):
-        bbi = builder.append_basic_block("switch.%d" % idx)
-        switch.add_case(idx, bbi)
-        with builder.goto_block(bbi):
-            builder.ret(ir.Constant(generate_type("float"), float(arg)))
-
-def generate_extern(ast, module, undefined_args):
-    if ast["globid"] == "arg":
-        generate_arg(ast, module, undefined_args)
-    elif ast["globid"] == "argf":
-        generate_argf(ast, module, undefined_args)
+    atof = declare_libc(module, "atof", ir.DoubleType())
+    generate_arg_string(func, module, ir.Constant(generate_type("float"), float(0)),
+                        lambda builder, string: builder.fptrunc(builder.call(atof, [string]), generate_type("float")))
+
+def generate_extern(ast, module):
+    if ast.globid == "arg":
+        generate_arg(ast, module)
+    elif ast.globid == "argf":
+        generate_argf(ast, module)
     else:  
         args = []
-        ret_type = generate_type(ast["ret_type"])
-        if "tdecls" in ast:
-            for typ in ast["tdecls"]["types"]:
+        ret_type = generate_type(ast.ret_type)
+        if ast.tdecls is not None:
+            for typ in ast.tdecls:
                 args.append(generate_type(typ))
 
         fnty = ir.FunctionType(ret_type, args)
-        func = ir.Function(module, fnty, name=ast["globid"])
+        func = ir.Function(module, fnty, name=ast.globid)
 
-def generate_externs(ast, module, undefined_args):
-    if "externs" in ast:
-        for extern in ast["externs"]:
-            generate_extern(extern, module, undefined_args)
+def generate_externs(externs, module):
+    for extern in externs:
+        generate_extern(extern, module)
 
 def generate_binop(ast, module, builder, variables):
-    op = ast["op"]
-    exptype = ast["exptype"]
+    op = ast.op
+    exptype = ast.exptype
 
     if exptype == "cint":
-        ast["lhs"]["exptype"] = "cint"
-        ast["rhs"]["exptype"] = "cint"
-    lhs = generate_exp(ast["lhs"], module, builder, variables)
-    rhs = generate_exp(ast["rhs"], module, builder, variables)
+        ast.lhs.exptype = "cint"
+        ast.rhs.exptype = "cint"
+    lhs = generate_exp(ast.lhs, module, builder, variables)
+    rhs = generate_exp(ast.rhs, module, builder, variables)
     # load if it is a pointer
     # if lhs.type.is_pointer:
     #     lhs = builder.load(lhs)
@@ -135,14 +167,14 @@ def generate_binop(ast, module, builder, variables):
         elif op == "or":
             return builder.or_(lhs, rhs)
         else:
-            if "int" in ast["lhs"]["exptype"]: 
+            if "int" in ast.lhs.exptype: 
                 if op == "lt":
                     return builder.icmp_signed("<", lhs, rhs)
                 elif op == "gt":
                     return builder.icmp_signed(">", lhs, rhs)
                 elif op == "eq":
                     return builder.icmp_signed("==", lhs, rhs)
-            elif "float" in ast["lhs"]["exptype"]:
+            elif "float" in ast.lhs.exptype:
                 if op == "lt":
                     return builder.fcmp_ordered("<", lhs, rhs)
                 elif op == "gt":
@@ -150,57 +182,30 @@ def generate_binop(ast, module, builder, variables):
                 elif op == "eq":
                     return builder.fcmp_ordered("==", lhs, rhs)
     elif "cint" in exptype:
+        if op in ["add", "sub", "mul"] and "overflow" in ast.proven:
+            # ranges.py showed the result fits, no need for the intrinsic
+            return no_signed_wrap(getattr(builder, op)(lhs, rhs))
         if op == "add":
             struct = builder.sadd_with_overflow(lhs, rhs)
-            result = builder.extract_value(struct, 0)
-            overflow = builder.extract_value(struct, 1)
-            func = module.get_global("isOverflow")
-            builder.call(func, [overflow])
-            return result
+            generate_check(module, builder, builder.extract_value(struct, 1), "trap.overflow")
+            return builder.extract_value(struct, 0)
         elif op == "sub":
             struct = builder.ssub_with_overflow(lhs, rhs)
-            result = builder.extract_value(struct, 0)
-            overflow = builder.extract_value(struct, 1)
-            func = module.get_global("isOverflow")
-            builder.call(func, [overflow])
-            return result
+            generate_check(module, builder, builder.extract_value(struct, 1), "trap.overflow")
+            return builder.extract_value(struct, 0)
         elif op == "mul":
             struct = builder.smul_with_overflow(lhs, rhs)
-            result = builder.extract_value(struct, 0)
-            overflow = builder.extract_value(struct, 1)
-            func = module.get_global("isOverflow")
-            builder.call(func, [overflow])
-            return result
+            generate_check(module, builder, builder.extract_value(struct, 1), "trap.overflow")
+            return builder.extract_value(struct, 0)
         elif op == "div":
-            # if divide by 0
-            with builder.if_then(builder.icmp_signed("==",ir.Constant(ir.IntType(32),0),rhs)):
-                c_str_val = generate_slit("divide by 0!\0")
-                c_str = builder.alloca(c_str_val.type)
-                builder.store(c_str_val, c_str)
-                printf_func = module.get_global("printf")
-                global_fmt = module.get_global("fstr_slit")
-                voidptr_ty = ir.IntType(8).as_pointer()
-                fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-                builder.call(printf_func, [fmt_arg, c_str])
-                func = module.get_global("exit")
-                builder.call(func, [ir.Constant(ir.IntType(32),0)])
-            lhs64 = builder.sext(lhs, ir.IntType(64))            
-            rhs64 = builder.sext(rhs, ir.IntType(64))            
-            res = builder.sdiv(lhs, rhs)
-            condition1 = builder.icmp_signed(">", res, ir.Constant(ir.IntType(64), 2147483647))
-            condition2 = builder.icmp_signed("<", res, ir.Constant(ir.IntType(64), -2147483648))
-            with builder.if_then(builder.or_(condition1, condition2)):                
-                c_str_val = generate_slit("cint overflows!\0")
-                c_str = builder.alloca(c_str_val.type)
-                builder.store(c_str_val, c_str)
-                printf_func = module.get_global("printf")
-                global_fmt = module.get_global("fstr_slit")
-                voidptr_ty = ir.IntType(8).as_pointer()
-                fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-                builder.call(printf_func, [fmt_arg, c_str])
-                func = module.get_global("exit")
-                builder.call(func, [ir.Constant(ir.IntType(32),0)])
-            return builder.trunc(res, ir.IntType(32))
+            if "divzero" not in ast.proven:
+                generate_check(module, builder, builder.icmp_signed("==",ir.Constant(ir.IntType(32),0),rhs), "trap.divzero")
+            if "overflow" not in ast.proven:
+                # the only quotient that does not fit is -2147483648 / -1
+                overflow = builder.and_(builder.icmp_signed("==", lhs, ir.Constant(ir.IntType(32), -2147483648)),
+                                        builder.icmp_signed("==", rhs, ir.Constant(ir.IntType(32), -1)))
+                generate_check(module, builder, overflow, "trap.overflow")
+            return builder.sdiv(lhs, rhs)
     elif "int" in exptype:
         if op == "add":
             return builder.add(lhs, rhs)
@@ -209,17 +214,8 @@ def generate_binop(ast, module, builder, variables):
         elif op == "mul":
             return builder.mul(lhs, rhs)
         elif op == "div":
-            with builder.if_then(builder.icmp_signed("==",ir.Constant(ir.IntType(32),0),rhs)):
-                c_str_val = generate_slit("divide by 0!\0")
-                c_str = builder.alloca(c_str_val.type)
-                builder.store(c_str_val, c_str)
-                printf_func = module.get_global("printf")
-                global_fmt = module.get_global("fstr_slit")
-                voidptr_ty = ir.IntType(8).as_pointer()
-                fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-                builder.call(printf_func, [fmt_arg, c_str])
-                func = module.get_global("exit")
-                builder.call(func, [ir.Constant(ir.IntType(32),0)])
+            if "divzero" not in ast.proven:
+                generate_check(module, builder, builder.icmp_signed("==",ir.Constant(ir.IntType(32),0),rhs), "trap.divzero")
             return builder.sdiv(lhs, rhs)
     elif "float" in exptype:
         if op == "add":
@@ -230,41 +226,31 @@ def generate_binop(ast, module, builder, variables):
             return builder.fmul(lhs, rhs)
         elif op == "div":
             # check if divide by 0
-            with builder.if_then(builder.fcmp_ordered("==",ir.Constant(ir.FloatType(),0.0),rhs)):
-                c_str_val = generate_slit("divide by 0!\0")
-                c_str = builder.alloca(c_str_val.type)
-                builder.store(c_str_val, c_str)
-                printf_func = module.get_global("printf")
-                global_fmt = module.get_global("fstr_slit")
-                voidptr_ty = ir.IntType(8).as_pointer()
-                fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-                builder.call(printf_func, [fmt_arg, c_str])
-                func = module.get_global("exit")
-                builder.call(func, [ir.Constant(ir.IntType(32),0)])
+            if "divzero" not in ast.proven:
+                generate_check(module, builder, builder.fcmp_ordered("==",ir.Constant(ir.FloatType(),0.0),rhs), "trap.divzero")
             return builder.fdiv(lhs, rhs)
     elif exptype == "void":
         pass
 
 def generate_uop(ast, module, builder, variables):
-    op = ast["op"]
-    exptype = ast["exptype"]
+    op = ast.op
+    exptype = ast.exptype
     if op == "not":
-        return builder.not_(generate_exp(ast["exp"], module, builder, variables))
+        return builder.not_(generate_exp(ast.exp, module, builder, variables))
     elif op == "minus":
-        exp = generate_exp(ast["exp"], module, builder, variables)
+        exp = generate_exp(ast.exp, module, builder, variables)
         # if exp.type.is_pointer:
         #     exp = builder.load(exp)
         exp = load_var(builder, exp)
-        if "float" in ast["exptype"]:
+        if "float" in ast.exptype:
             return builder.fsub(ir.Constant(generate_type("float"), 0.0), exp)
-        elif "cint" in ast["exptype"]:
+        elif "cint" in ast.exptype and "overflow" in ast.proven:
+            return no_signed_wrap(builder.sub(ir.Constant(ir.IntType(32),0), exp))
+        elif "cint" in ast.exptype:
             struct = builder.ssub_with_overflow(ir.Constant(ir.IntType(32),0), exp)
-            result = builder.extract_value(struct, 0)
-            overflow = builder.extract_value(struct, 1)
-            func = module.get_global("isOverflow")
-            builder.call(func, [overflow])
-            return result
-        elif  "int" in ast["exptype"]:
+            generate_check(module, builder, builder.extract_value(struct, 1), "trap.overflow")
+            return builder.extract_value(struct, 0)
+        elif  "int" in ast.exptype:
             return builder.sub(ir.Constant(generate_type("int"), 0), exp)
 
 def is_int(typ):
@@ -274,43 +260,45 @@ def is_float(typ):
     return "float" in typ
 
 def generate_caststmt(ast, module, builder, variables):
-    typ = generate_type(ast["type"])
-    exp = generate_exp(ast["exp"], module, builder, variables)
+    typ = generate_type(ast.type)
+    exp = generate_exp(ast.exp, module, builder, variables)
     # if exp.type.is_pointer:
     #     exp = builder.load(exp)
     exp = load_var(builder, exp)
-    if is_int(ast["type"]) and is_int(ast["exp"]["exptype"]):
+    if is_int(ast.type) and is_int(ast.exp.exptype):
         exp = builder.trunc(exp, ir.IntType(32))
-    elif is_int(ast["type"]) and is_float(ast["exp"]["exptype"]):
+    elif is_int(ast.type) and is_float(ast.exp.exptype):
         exp = builder.fptoui(exp, ir.IntType(32))
-    elif is_float(ast["type"])and is_float(ast["exp"]["exptype"]):
+    elif is_float(ast.type)and is_float(ast.exp.exptype):
         exp = builder.fptrunc(exp, ir.FloatType())
-    elif is_float(ast["type"]) and is_int(ast["exp"]["exptype"]):
+    elif is_float(ast.type) and is_int(ast.exp.exptype):
         exp = builder.uitofp(exp, ir.FloatType())
     return exp
 
 def generate_assign(ast, module, builder, variables):
-    exp = generate_exp(ast["exp"], module, builder, variables)
+    if ast.exptype == "cint":
+        ast.exp.exptype = "cint"
+    exp = generate_exp(ast.exp, module, builder, variables)
     # if exp.type.is_pointer:
     #     exp = builder.load(exp)
     exp = load_var(builder, exp)
-    # if ast["var"] == "$d":
+    # if ast.var == "$d":
     #     print("exp: ", exp, ";exp type: ", exp.type)
-    #     print("var?:", ast["var"], "; variables[ast['var']]:", variables[ast["var"]], "; type?:", variables[ast["var"]].type)
-    builder.store(exp, variables[ast["var"]])
-    return variables[ast["var"]]
+    #     print("var?:", ast.var, "; variables[ast['var']]:", variables[ast.var], "; type?:", variables[ast.var].type)
+    builder.store(exp, variables[ast.var])
+    return variables[ast.var]
 
 def generate_funccall(ast, module, builder, variables):
-    # if ast["globid"] == "fib":
+    # if ast.globid == "fib":
     #     for k,v in variables.items():
     #         print(k," : ",v)
 
-    fn = module.get_global(ast["globid"])
+    fn = module.get_global(ast.globid)
     args = []
-    if "params" not in ast or "exps" not in ast["params"]:
+    if ast.params is None:
         pass
     else:
-        for exp in ast["params"]["exps"]:
+        for exp in ast.params:
             args.append(generate_exp(exp, module, builder, variables))
         
         # Customize arg to the desired type
@@ -331,144 +319,147 @@ def generate_funccall(ast, module, builder, variables):
                         args[idx] = arg
     return builder.call(fn, args)
 
-def generate_exp(ast, module, builder, variables):
-    name = ast["name"]
-    if name == "binop":
-        return generate_binop(ast, module, builder, variables)
-    elif name == "caststmt":
-        return generate_caststmt(ast, module, builder, variables)
-    elif name == "uop":
-        return generate_uop(ast, module, builder, variables)
-    elif name == "lit":
-        if ast["exptype"] == "cint":
-            if ast["value"] > 2147483647 or ast["value"] < -2147483648:
-                print("cint overflows!")
-                sys.exit(1)
-            else:
-                return ir.Constant(generate_type(ast["exptype"]), ast["value"])
+def generate_lit(ast, module, builder, variables):
+    if ast.exptype == "cint":
+        if ast.value > 2147483647 or ast.value < -2147483648:
+            print("cint overflows!")
+            sys.exit(1)
         else:
-            return ir.Constant(generate_type(ast["exptype"]), ast["value"])
-    elif name == "varval":
-        return variables[ast["var"]] 
-    elif name == "assign":
-        if ast["exptype"] == "cint":
-            ast["exp"]["exptype"] = "cint"
-        return generate_assign(ast, module, builder, variables)
-    elif name == "funccall":
-        return generate_funccall(ast, module, builder, variables)
+            return ir.Constant(generate_type(ast.exptype), ast.value)
+    else:
+        return ir.Constant(generate_type(ast.exptype), ast.value)
 
-def generate_stmt(ast, module, builder, func, variables):
-    name = ast["name"]
-    if name == "blk":
-        generate_blk(ast, module, builder, func, variables)
-    elif name == "if":
-        pred = generate_exp(ast["cond"], module, builder, variables)
-        if "else_stmt" in ast:
-            with builder.if_else(pred) as (then, otherwise):
-                with then:
-                    generate_stmt(ast["stmt"], module, builder, func, variables)
-                with otherwise:
-                    generate_stmt(ast["else_stmt"], module, builder, func, variables)
-        else:
-            with builder.if_then(pred):
-                generate_stmt(ast["stmt"], module, builder, func, variables)
-    elif name == "ret":
-        if "exp" in ast:
-            exp = generate_exp(ast["exp"], module, builder, variables)
-            # if exp.type.is_pointer:
-            #     exp = builder.load(exp)
-            exp = load_var(builder, exp)
-            builder.ret(exp)
-        else:
-            builder.ret_void()
-    elif name == "vardeclstmt": 
-        if ast["exptype"] == "cint":
-            ast["exp"]["exptype"] = "cint"
-        exp = generate_exp(ast["exp"], module, builder, variables)
-        variables[ast["vdecl"]["var"]] = builder.alloca(exp.type)
-        if "noalias" in ast["vdecl"]["type"]:
-            variables[ast["vdecl"]["var"]].add_attribute("noalias")
-        if "ref" not in ast["vdecl"]["type"]:
-            exp = load_var(builder, exp)
-        builder.store(exp, variables[ast["vdecl"]["var"]])
-    elif name == "expstmt":
-        generate_exp(ast["exp"], module, builder, variables)
-    elif name == "while":
-        loop_head = func.append_basic_block("loop.header")
-        loop_body = func.append_basic_block("loop.body")
-        loop_end = func.append_basic_block("loop.end")
-        builder.branch(loop_head)
-        builder.position_at_end(loop_head)
-        cond = generate_exp(ast["cond"], module, builder, variables)
-        builder.cbranch(cond, loop_body, loop_end)
-        builder.position_at_end(loop_body)
-        #loop body
-        generate_stmt(ast["stmt"], module, builder, func, variables)
-        #jump to loop head
-        builder.branch(loop_head)
-        builder.position_at_end(loop_end)
-    elif name == "print":
-        value = generate_exp(ast["exp"], module, builder, variables)
-        if value.type.is_pointer:
-            value = load_var(builder, value)
-            if value.type == ir.FloatType():
-                global_fmt = module.get_global("fstr_float")
-                value = builder.fpext(value, ir.DoubleType(), name='float_double')
-            elif value.type == ir.IntType(32):
-                global_fmt = module.get_global("fstr_int")
-            elif value.type == ir.IntType(1):
-                global_fmt = module.get_global("fstr_int")
-                value = builder.zext(value, ir.IntType(32), name='bool_int')
-        elif value.type == ir.IntType(32):
-            global_fmt = module.get_global("fstr_int")
-        elif value.type == ir.IntType(1):
-            global_fmt = module.get_global("fstr_int")
+def generate_varval(ast, module, builder, variables):
+    return variables[ast.var] 
+
+def generate_exp(ast, module, builder, variables):
+    return exp_generators[type(ast)](ast, module, builder, variables)
+
+def generate_if(ast, module, builder, func, variables):
+    pred = generate_exp(ast.cond, module, builder, variables)
+    if ast.counter is not None:
+        count(module, builder, ast.counter)
+    block = builder.block
+    if ast.else_stmt is not None:
+        with builder.if_else(pred) as (then, otherwise):
+            with then:
+                if ast.counter is not None:
+                    count(module, builder, ast.counter + 1)
+                generate_stmt(ast.stmt, module, builder, func, variables)
+            with otherwise:
+                generate_stmt(ast.else_stmt, module, builder, func, variables)
+    else:
+        with builder.if_then(pred):
+            if ast.counter is not None:
+                count(module, builder, ast.counter + 1)
+            generate_stmt(ast.stmt, module, builder, func, variables)
+    set_branch_weights(block.terminator, ast.counts)
+
+def generate_ret(ast, module, builder, func, variables):
+    if ast.exp is not None:
+        exp = generate_exp(ast.exp, module, builder, variables)
+        # if exp.type.is_pointer:
+        #     exp = builder.load(exp)
+        exp = load_var(builder, exp)
+        builder.ret(exp)
+    else:
+        builder.ret_void()
+
+def generate_vardeclstmt(ast, module, builder, func, variables):
+    if ast.exptype == "cint":
+        ast.exp.exptype = "cint"
+    exp = generate_exp(ast.exp, module, builder, variables)
+    if "ref" not in ast.vdecl.type:
+        exp = load_var(builder, exp)
+    # a ref variable holds the pointer to the variable it refers to
+    slot = entry_alloca(builder, exp.type)
+    if "noalias" in ast.vdecl.type:
+        slot.add_attribute("noalias")
+    variables[ast.vdecl.var] = slot
+    builder.store(exp, slot)
+
+def generate_expstmt(ast, module, builder, func, variables):
+    generate_exp(ast.exp, module, builder, variables)
+
+def generate_while(ast, module, builder, func, variables):
+    loop_head = func.append_basic_block("loop.header")
+    loop_body = func.append_basic_block("loop.body")
+    loop_end = func.append_basic_block("loop.end")
+    if ast.counter is not None:
+        count(module, builder, ast.counter)
+    builder.branch(loop_head)
+    builder.position_at_end(loop_head)
+    cond = generate_exp(ast.cond, module, builder, variables)
+    set_branch_weights(builder.cbranch(cond, loop_body, loop_end), ast.counts)
+    builder.position_at_end(loop_body)
+    if ast.counter is not None:
+        count(module, builder, ast.counter + 1)
+    #loop body
+    generate_stmt(ast.stmt, module, builder, func, variables)
+    #jump to loop head
+    builder.branch(loop_head)
+    builder.position_at_end(loop_end)
+
+def generate_print(ast, module, builder, func, variables):
+    value = generate_exp(ast.exp, module, builder, variables)
+    if value.type.is_pointer:
+        value = load_var(builder, value)
+    if value.type == ir.FloatType():
+        emitter = "ek.print.float"
+    else:
+        emitter = "ek.print.int"
+        if value.type == ir.IntType(1):
             value = builder.zext(value, ir.IntType(32), name='bool_int')
-        else:
-            global_fmt = module.get_global("fstr_float")
-            value = builder.fpext(value, ir.DoubleType(), name='float_double')
-        printf_func = module.get_global("printf")
-        voidptr_ty = ir.IntType(8).as_pointer()
-        fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-        #call printf function
-        builder.call(printf_func, [fmt_arg, value])
-    elif name == "printslit":
-        # construct c_str
-        c_str_val = generate_slit(ast["string"]+"\0")
-        c_str = builder.alloca(c_str_val.type)
-        builder.store(c_str_val, c_str)
-        printf_func = module.get_global("printf")
-        global_fmt = module.get_global("fstr_slit")
-        voidptr_ty = ir.IntType(8).as_pointer()
-        fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-        # Call print Function
-        builder.call(printf_func, [fmt_arg, c_str])
+    builder.call(runtime.runtime_function(module, emitter), [value])
+
+def generate_printslit(ast, module, builder, func, variables):
+    generate_print_string(module, builder, ast.string)
+
+def generate_stmt(ast, module, builder, func, variables):
+    stmt_generators[type(ast)](ast, module, builder, func, variables)
 
 def generate_blk(ast, module, builder, func, variables):
-    if "contents" in ast:
-        for stmt in ast["contents"]["stmts"]:
+    if ast.stmts is not None:
+        # variables declared in the block go out of scope at its end
+        variables = variables.new_child()
+        for stmt in ast.stmts:
             generate_stmt(stmt, module, builder, func, variables)
 
-def generate_func(ast, module):
+def ref_params(module, globid):
+    return [arg.type.is_pointer for arg in module.get_global(globid).args]
+
+def generate_func(ast, module, check_report=None, name=None):
     args_types = [] # the types of args in llvmlite
     args_names = [] # the names of args in llvmlite
-    variables = {}  # the local vairables in the current function, key: variable name, value: variable type
-    ret_type = generate_type(ast["ret_type"])
-    if "vdecls" in ast:
-        for vdecl in ast["vdecls"]["vars"]:
-            args_types.append(generate_type(vdecl["type"]))
-            args_names.append(vdecl["var"])
+    variables = ChainMap()  # the local vairables in scope, key: variable name, value: variable pointer
+    ret_type = generate_type(ast.ret_type)
+    if ast.vdecls is not None:
+        for vdecl in ast.vdecls:
+            args_types.append(generate_type(vdecl.type))
+            args_names.append(vdecl.var)
 
     # Adds function to module
     fnty = ir.FunctionType(ret_type, args_types)
-    func = ir.Function(module, fnty, name=ast["globid"])
+    func = ir.Function(module, fnty, name=name or ast.globid)
 
     # add_attribute("noalias")
-    if "vdecls" in ast:
-        for idx, vdecl in enumerate(ast["vdecls"]["vars"]):
-            if "noalias" in vdecl:
+    if ast.vdecls is not None:
+        for idx, vdecl in enumerate(ast.vdecls):
+            if "noalias" in vdecl.type:
                 func.args[idx].add_attribute("noalias")
     
+    if ast.counts is not None:
+        # from pgo.apply_profile
+        entry_count, attribute = ast.counts
+        func.set_metadata("prof", module.add_metadata(["function_entry_count", ir.Constant(ir.IntType(64), entry_count)]))
+        if attribute is not None:
+            func.attributes.add(attribute)
+
+    # find the runtime checks the body can do without
+    checks = ranges.analyze_func(ast, lambda globid: ref_params(module, globid))
+    if check_report is not None:
+        check_report[ast.globid] = checks
+
     # Adds entry block to the function
     entry_block = func.append_basic_block(name="entry")
     builder = ir.IRBuilder(entry_block)
@@ -481,84 +472,203 @@ def generate_func(ast, module):
             ptr = builder.alloca(arg.type)
             variables[name]= ptr
             builder.store(arg, ptr)
+    if ast.counter is not None:
+        count(module, builder, ast.counter)
     
-    if "blk" in ast:
-        result = generate_blk(ast["blk"], module, builder, func, variables)
+    if ast.blk is not None:
+        result = generate_blk(ast.blk, module, builder, func, variables)
 
     # Returns void if return type is void
     if not builder.block.is_terminated:
         builder.ret_void()
     
-def generate_funcs(ast, module):
-    for func in ast["funcs"]:
-        generate_func(func, module)
-
-def generate_prog(ast, module, undefined_args):
-    if "externs" in ast and len(ast) > 1:
-        generate_externs(ast["externs"], module, undefined_args)
-
-    generate_funcs(ast["funcs"], module)
-
-def declare_printf(module):
-    #declare printf
-    voidptr_ty = ir.IntType(8).as_pointer()
-    printf_ty = ir.FunctionType(ir.IntType(32), [voidptr_ty], var_arg=True)
-    printf = ir.Function(module, printf_ty, name="printf")
-    #int type
-    fmt1 = "%d\n\0"
-    c_fmt1 = ir.Constant(ir.ArrayType(ir.IntType(8), len(fmt1)), bytearray(fmt1.encode("utf8")))
-    global_fmt1 = ir.GlobalVariable(module, c_fmt1.type, name="fstr_int")
-    global_fmt1.linkage = 'internal'
-    global_fmt1.global_constant = True
-    global_fmt1.initializer = c_fmt1
-    #slit type
-    fmt2 = "%s\n\0"
-    c_fmt2 = ir.Constant(ir.ArrayType(ir.IntType(8), len(fmt2)), bytearray(fmt2.encode("utf8")))
-    global_fmt2 = ir.GlobalVariable(module, c_fmt2.type, name="fstr_slit")
-    global_fmt2.linkage = 'internal'
-    global_fmt2.global_constant = True
-    global_fmt2.initializer = c_fmt2
-    #float type
-    fmt3 = "%f\n\0"
-    c_fmt3 = ir.Constant(ir.ArrayType(ir.IntType(8), len(fmt3)), bytearray(fmt3.encode("utf8")))
-    global_fmt3 = ir.GlobalVariable(module, c_fmt3.type, name="fstr_float")
-    global_fmt3.linkage = 'internal'
-    global_fmt3.global_constant = True
-    global_fmt3.initializer = c_fmt3
-
-def declare_isoverflow(module):
-    bool_ty = ir.IntType(1)
-    check_ty = ir.FunctionType(ir.VoidType(), [ir.IntType(1)], var_arg=False)
-    func = ir.Function(module, check_ty, name="isOverflow")
-    entry = func.append_basic_block("entry")
-    builder = ir.IRBuilder(entry)
-    with builder.if_then(func.args[0]):
-        # if overflow
-        c_str_val = generate_slit("cint overflows!\0")
-        c_str = builder.alloca(c_str_val.type)
-        builder.store(c_str_val, c_str)
-        printf_func = module.get_global("printf")
-        global_fmt = module.get_global("fstr_slit")
-        voidptr_ty = ir.IntType(8).as_pointer()
-        fmt_arg = builder.bitcast(global_fmt, voidptr_ty)
-        builder.call(printf_func, [fmt_arg, c_str])
-
-        exit_func = module.get_global("exit")
-        builder.call(exit_func, [ir.Constant(ir.IntType(32),0)])
-    # if not overflow
-    builder.ret_void()
+def generate_funcs(funcs, module, check_report=None):
+    for func in funcs:
+        generate_func(func, module, check_report)
+
+def generate_prog(ast, module, check_report=None):
+    generate_externs(ast.externs, module)
+
+    generate_funcs(ast.funcs, module, check_report)
+
+# generate_exp and generate_stmt dispatch on the node class
+exp_generators = {
+    nodes.Binop: generate_binop,
+    nodes.CastStmt: generate_caststmt,
+    nodes.Uop: generate_uop,
+    nodes.Lit: generate_lit,
+    nodes.VarVal: generate_varval,
+    nodes.Assign: generate_assign,
+    nodes.FuncCall: generate_funccall,
+}
+
+stmt_generators = {
+    nodes.Blk: generate_blk,
+    nodes.If: generate_if,
+    nodes.Ret: generate_ret,
+    nodes.VarDeclStmt: generate_vardeclstmt,
+    nodes.ExpStmt: generate_expstmt,
+    nodes.While: generate_while,
+    nodes.Print: generate_print,
+    nodes.PrintSlit: generate_printslit,
+}
+
+# The error paths of the runtime checks. Every check in the module branches
+# to one of these shared functions, which are cold, never inlined and never
+# return, so the checked code only carries a compare and an unlikely branch.
+traps = [("trap.divzero", "divide by 0!"), ("trap.overflow", "cint overflows!")]
+
+def declare_traps(module):
+    for name, message in traps:
+        func = ir.Function(module, ir.FunctionType(ir.VoidType(), []), name=name)
+        func.linkage = 'internal'
+        for attribute in ["cold", "noreturn", "noinline", "nounwind"]:
+            func.attributes.add(attribute)
+        builder = ir.IRBuilder(func.append_basic_block("entry"))
+        generate_print_string(module, builder, message)
+        builder.call(module.get_global(runtime.FLUSH), [])
+        builder.call(module.get_global("exit"), [ir.Constant(ir.IntType(32),0)])
+        builder.unreachable()
+
+def no_signed_wrap(instr):
+    instr.flags.append("nsw")
+    return instr
+
+def generate_check(module, builder, failed, trap):
+    # branch weights mark the failure as unlikely
+    with builder.if_then(failed, likely=False):
+        builder.call(module.get_global(trap), [])
+        builder.unreachable()
+
+# Profile counters of pgo.py. The array has common linkage, so the copies
+# parallel.py puts into the split modules are merged again when linking.
+def declare_counters(module, size):
+    counters = ir.GlobalVariable(module, ir.ArrayType(ir.IntType(64), size), name=pgo.COUNTERS)
+    counters.linkage = 'common'
+    counters.initializer = ir.Constant(counters.type.pointee, None)
+
+def count(module, builder, index):
+    zero = ir.Constant(ir.IntType(32), 0)
+    counter = builder.gep(module.get_global(pgo.COUNTERS), [zero, ir.Constant(ir.IntType(32), index)], inbounds=True)
+    builder.store(builder.add(builder.load(counter), ir.Constant(ir.IntType(64), 1)), counter)
+
+def set_branch_weights(branch, counts):
+    weights = pgo.branch_weights(counts) if counts is not None else None
+    if weights is not None:
+        branch.set_weights(weights)
 
 def declare_exit(module):
     int_ty = ir.IntType(32)
     exit_ty = ir.FunctionType(ir.VoidType(), [int_ty], var_arg=False)
     exit = ir.Function(module, exit_ty, name="exit")
+    exit.attributes.add("noreturn")
 
-# The function called by ekcc.py
-def generate_code(ast, undefined_args):
+def declare_function(ast, module):
+    # a func or extern without its body, for modules that only call it
+    args = []
+    if type(ast) is nodes.Func:
+        if ast.vdecls is not None:
+            args = [generate_type(vdecl.type) for vdecl in ast.vdecls]
+    elif ast.tdecls is not None:
+        args = [generate_type(typ) for typ in ast.tdecls]
+    fnty = ir.FunctionType(generate_type(ast.ret_type), args)
+    return ir.Function(module, fnty, name=ast.globid)
+
+# The function called by ekcc.py. With a dict as check_report, it gets the
+# (checks, checks removed) counts of ranges.py for every func. counters is the
+# number of profile counters pgo.instrument gave the funcs of ast.
+def generate_code(ast, check_report=None, counters=0):
     module = ir.Module(name="prog")
-    declare_printf(module)
+    runtime.declare_runtime(module)
+    declare_exit(module)
+    declare_traps(module)
+    if counters:
+        declare_counters(module, counters)
+    generate_prog(ast, module, check_report)
+    return module
+
+
+# Used by incremental.py, which compiles every function in a module of its
+# own and links them with the support module.
+def generate_func_module(ast, callees):
+    """
+    A module defining the func ast, declaring the funcs and externs in
+    callees that it calls.
+    """
+    module = ir.Module(name=ast.globid)
+    runtime.declare_runtime(module)
     declare_exit(module)
-    declare_isoverflow(module)
-    generate_prog(ast, module, undefined_args)
+    declare_traps(module)
+    for callee in callees:
+        declare_function(callee, module)
+    generate_func(ast, module)
     return module
 
+def generate_support_module(ast):
+    """
+    Everything of the program but its funcs: the externs, with arg() and
+    argf().
+    """
+    module = ir.Module(name="prog")
+    runtime.declare_runtime(module)
+    declare_exit(module)
+    generate_externs(ast.externs, module)
+    return module
+
+# Used by tiered.py. In the tier 0 module every func f is compiled as f.t0 and
+# called through the trampoline f, which counts the call in the CALLS array
+# and jumps to the address in slot i of the DISPATCH table: f.t0 at first,
+# the optimized f once tiered.py has compiled it.
+DISPATCH = "ek.dispatch"
+CALLS = "ek.calls"
+
+def generate_trampoline(func, module, slot):
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    zero = ir.Constant(ir.IntType(32), 0)
+    index = ir.Constant(ir.IntType(32), slot)
+    calls = builder.gep(module.get_global(CALLS), [zero, index], inbounds=True)
+    builder.store(builder.add(builder.load(calls), ir.Constant(ir.IntType(64), 1)), calls)
+    # the table changes while the program runs
+    target = builder.load_atomic(builder.gep(module.get_global(DISPATCH), [zero, index], inbounds=True), "monotonic", 8)
+    result = builder.call(builder.bitcast(target, func.type), list(func.args), tail=True)
+    if isinstance(func.function_type.return_type, ir.VoidType):
+        builder.ret_void()
+    else:
+        builder.ret(result)
+
+def generate_tiered_code(ast):
+    """
+    The tier 0 module of the program ast.
+    """
+    module = ir.Module(name="prog")
+    runtime.declare_runtime(module)
+    declare_exit(module)
+    declare_traps(module)
+    generate_externs(ast.externs, module)
+    size = len(ast.funcs)
+    for name, typ in [(DISPATCH, ir.IntType(8).as_pointer()), (CALLS, ir.IntType(64))]:
+        table = ir.GlobalVariable(module, ir.ArrayType(typ, size), name=name)
+        table.initializer = ir.Constant(table.type.pointee, None)
+    trampolines = [declare_function(func, module) for func in ast.funcs]
+    for slot, func in enumerate(ast.funcs):
+        generate_trampoline(trampolines[slot], module, slot)
+        generate_func(func, module, name=func.globid + ".t0")
+    return module
+
+def generate_funcs_code(ast, globids, exported):
+    """
+    A module of the funcs in globids of the program ast, which must include
+    every func they call. Only the funcs in exported are visible outside it.
+    """
+    module = ir.Module(name="prog")
+    # the output buffer is the tier 0 module's
+    runtime.declare_runtime(module, shared=True)
+    declare_exit(module)
+    declare_traps(module)
+    generate_externs(ast.externs, module)
+    for func in ast.funcs:
+        if func.globid in globids:
+            generate_func(func, module)
+            if func.globid not in exported:
+                module.get_global(func.globid).linkage = 'internal'
+    return module
@@ -1,11 +1,12 @@
 import argparse, sys
 import lexer, yacc, codeGen, binding
+import cache, paths, linker, incremental, ranges, fold, stats, tracing, pgo, tiered
 import yaml
 import os
 import time
 
 def read_content(input_file):
-    with open(input_file, 'r') as input:  
+    with tracing.span("read", file=input_file), open(input_file, 'r') as input:  
         content = input.read()
         return content
 
@@ -16,32 +17,99 @@ def write_to_file(output_file, content):
     else:
         output_file.write(content)
 
-parser = argparse.ArgumentParser(prog=sys.argv[0], 
-                                 description='Compiler',
-                                 usage="python3 ekcc.py [-h|-?] [-v] [-O] [-emit-ast|-emit-llvm] -o <output-file> <input-file> [-jit] [-dul] -it <inlining_threshold> [-lv] -ol <opt_level> -sl <size_level> [-sv]", 
-                                 add_help=False)
-parser.add_argument("-h", action="help", help="show this help message and exit")
-parser.add_argument("-v", action="store_true", help="print information for debugging")
-parser.add_argument("-O", action="store_true", help="enable optimization")
-parser.add_argument("-emit-ast", action="store_true", default=False, help="generate AST")
-parser.add_argument("-emit-llvm", action="store_true", default=False, help="generate LLVM IR")
-parser.add_argument("-o", action="store", default=sys.stdout, help="set output file path")
-parser.add_argument("input_file", help = "ek file to be compiled")
-parser.add_argument("-jit", action="store_true", help = "use JIT")
-parser.add_argument("-dul", action="store_true", help = "disable loop unrolling")
-parser.add_argument("-it", action="store", default = 10, help = "the integer threshold for inlining one function into another")
-parser.add_argument("-lv", action="store_true", help = "allow vectorizing loops")
-parser.add_argument("-ol", action="store", default = 3, help = "general optimization level")
-parser.add_argument("-sl", action="store", default = 2, help = "whether and how much to optimize for size, as an integer between 0 and 2")
-parser.add_argument("-sv", action="store_true", help = "enable the SLP vectorizer")
-args, undefined = parser.parse_known_args()
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog=sys.argv[0], 
+                                     description='Compiler',
+                                     usage="python3 ekcc.py [-h|-?] [-v] [-O] [-emit-ast|-emit-llvm] -o <output-file> <input-file> [-jit] [-dul] -it <inlining_threshold> [-lv] -ol <opt_level> -sl <size_level> [-sv] [-march <cpu>] [-tiered [-tier-threshold <calls>]] [-profile-generate <file>|-profile-use <file>] [-time-passes] [-stats] [-stats-file <file>] [-trace <file>] | --serve [--socket <path>] | --batch <path>... [--out-dir <dir>] [-j <jobs>] [-- <args>...] [--cache [--cache-max-mb <n>]] [--object-cache] [--opt-jobs <n>] [--incremental] [--watch] | --cache-stats | --cache-clear", 
+                                     add_help=False)
+    parser.add_argument("-h", action="help", help="show this help message and exit")
+    parser.add_argument("-v", action="store_true", help="print information for debugging")
+    parser.add_argument("-O", action="store_true", help="enable optimization")
+    parser.add_argument("-emit-ast", action="store_true", default=False, help="generate AST")
+    parser.add_argument("-emit-llvm", action="store_true", default=False, help="generate LLVM IR")
+    parser.add_argument("-o", action="store", default=sys.stdout, help="set output file path")
+    parser.add_argument("input_file", nargs="?", help = "ek file to be compiled")
+    parser.add_argument("-jit", action="store_true", help = "use JIT")
+    parser.add_argument("-dul", action="store_true", help = "disable loop unrolling")
+    parser.add_argument("-it", action="store", default = 10, help = "the integer threshold for inlining one function into another")
+    parser.add_argument("-lv", action="store_true", help = "allow vectorizing loops")
+    parser.add_argument("-ol", action="store", default = 3, help = "general optimization level")
+    parser.add_argument("-sl", action="store", default = 2, help = "whether and how much to optimize for size, as an integer between 0 and 2")
+    parser.add_argument("-sv", action="store_true", help = "enable the SLP vectorizer")
+    parser.add_argument("-march", action="store", default=None, help = "generate code for this CPU (for example x86-64) instead of the host CPU and its features")
+    parser.add_argument("-tiered", action="store_true", help = "with -jit, start run() unoptimized and optimize functions in the background once they are called often")
+    parser.add_argument("-tier-threshold", action="store", type=int, default=tiered.DEFAULT_THRESHOLD, help = "calls after which -tiered optimizes a function")
+    parser.add_argument("-profile-generate", action="store", default=None, help = "count function entries and branches during the JIT run and add the counts to this profile file")
+    parser.add_argument("-profile-use", action="store", default=None, help = "optimize with the counts of this profile file")
+    parser.add_argument("-time-passes", action="store_true", help = "report the time of every LLVM pass as JSON")
+    parser.add_argument("-stats", action="store_true", help = "report IR statistics per function before and after optimization as JSON")
+    parser.add_argument("-stats-file", action="store", default=None, help = "write the -time-passes/-stats JSON report to this file instead of stderr")
+    parser.add_argument("-trace", action="store", default=None, help = "write a Chrome trace event JSON file of the compile phases")
+    parser.add_argument("--serve", action="store_true", help = "run a compile server on a Unix socket")
+    parser.add_argument("--socket", action="store", default=None, help = "socket path for --serve")
+    parser.add_argument("--cache-size", action="store", type=int, default=128, help = "number of compiled modules kept in memory by --serve")
+    parser.add_argument("--batch", nargs="+", metavar="PATH", help = "compile many .ek files or directories in a process pool")
+    parser.add_argument("--out-dir", action="store", default="ekcc-out", help = "output directory for --batch")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=None, help = "number of worker processes for --batch")
+    parser.add_argument("--cache", action="store_true", help = "reuse compilation results from the on-disk compile cache")
+    parser.add_argument("--cache-max-mb", action="store", type=int, default=cache.DEFAULT_MAX_BYTES // (1024 * 1024), help = "size limit of the compile cache in megabytes")
+    parser.add_argument("--object-cache", action="store_true", help = "reuse JIT machine code for modules compiled before")
+    parser.add_argument("--opt-jobs", action="store", type=int, default=None, help = "with -O, optimize the functions separately in this many worker processes")
+    parser.add_argument("--incremental", action="store_true", help = "only regenerate and optimize functions that changed since an earlier compile")
+    parser.add_argument("--watch", action="store_true", help = "recompile incrementally whenever the input file changes")
+    parser.add_argument("--cache-stats", action="store_true", help = "print compile cache statistics and exit")
+    parser.add_argument("--cache-clear", action="store_true", help = "empty the compile cache and exit")
+    return parser
 
-exitcode = 0
+def write_llvm(args, mod):
+    if args.emit_llvm:
+        if args.o != "exe":
+            write_to_file(args.o, mod)
+        else:
+            print("######## Object Emission Start ########", file=sys.stderr)
+            start_time = time.time()
+            object_code = binding.emit_object(mod, args.march, binding.codegen_level(args.O, optimization_flags(args)))
+            print("######## Total Object Emission Time: %s seconds ########" % (time.time() - start_time), file=sys.stderr)
+            try:
+                with tracing.span("link executable"):
+                    link_time = linker.link_executable(object_code, "exe")
+            except linker.LinkError as e:
+                print(e.message)
+                print("exit code: "+str(1))
+                sys.exit(1)
+            print("######## Total Link Time: %s seconds ########" % link_time, file=sys.stderr)
+
+def optimization_flags(args):
+    return [args.dul, args.it, args.lv, args.ol, args.sl, args.sv]
 
-if args.emit_ast and args.emit_llvm:
-    raise Exception("Cannot emit_ast and emit_llvm at the same time")
-else:
+def compile_file(args, undefined):
     content = read_content(args.input_file)
+    optimization = optimization_flags(args)
+    object_cache_dir = paths.cache_dir("objects") if args.object_cache else None
+    compile_cache = None
+    profiling = args.profile_generate is not None or args.profile_use is not None
+    # the reports and the trace describe a compile, which a hit skips
+    measuring = args.time_passes or args.stats or args.trace is not None
+    if args.cache and not profiling and not args.tiered and not measuring:
+        compile_cache = cache.CompileCache(max_bytes=args.cache_max_mb * 1024 * 1024)
+        # the machine code depends on the CPU and its features
+        flags = [args.O, args.opt_jobs is not None] + optimization + [binding.target_id(args.march)]
+        key = compile_cache.key(content, flags)
+        entry = compile_cache.get(key)
+        if entry is not None:
+            fold.print_warnings(entry["warnings"])
+            if args.v:
+                ranges.print_report(entry["check_report"])
+            if args.emit_ast:
+                write_to_file(args.o, entry["ast"])
+            if args.jit:
+                engine = binding.load_module(entry["object"], 0, args.march)
+                binding.execute(engine, undefined)
+            write_llvm(args, entry["optimized_ir"])
+            return
+    if args.incremental:
+        compile_incremental(args, undefined, content, object_cache_dir)
+        return
     parse_time1 = time.time()
     ast, err_message = yacc.parse(content)
     parse_time2 = time.time()
@@ -49,20 +117,133 @@ else:
         print(err_message)
         print("exit code: "+str(1))
         sys.exit(1)
+    ast_yaml = None
+    if args.emit_ast or compile_cache is not None:
+        # dump before code generation, which annotates the tree
+        ast_yaml = yaml.dump(ast)
     if args.emit_ast:
-        write_to_file(args.o,  yaml.dump(ast))
+        write_to_file(args.o,  ast_yaml)
     gen_time1 = time.time()
-    mod = codeGen.generate_code(ast, undefined)
+    with tracing.span("fold"):
+        warnings = fold.fold_program(ast)
+    fold.print_warnings(warnings)
+    instrumentation = None
+    if args.profile_generate is not None:
+        instrumentation = pgo.instrument(ast)
+    if args.profile_use is not None:
+        try:
+            profile = pgo.load_profile(args.profile_use)
+        except (OSError, ValueError) as e:
+            print("error: cannot read profile %s: %s" % (args.profile_use, e))
+            print("exit code: "+str(1))
+            sys.exit(1)
+        fold.print_warnings(pgo.apply_profile(ast, profile))
+    if args.tiered:
+        tiered.compile_and_execute(ast, undefined, optimization, parse_time2 - parse_time1 + time.time() - gen_time1,
+                                   args.tier_threshold, args.march)
+        return
+    # kept in the cache entry for -v on a hit
+    check_report = {} if args.v or compile_cache is not None else None
+    with tracing.span("generate_code"):
+        mod = codeGen.generate_code(ast, check_report, instrumentation.size if instrumentation else 0)
     gen_time2 = time.time()
+    if args.v:
+        ranges.print_report(check_report)
     total_time = parse_time2 - parse_time1 + gen_time2 -gen_time1
-    optimization = [args.dul, args.it, args.lv, args.ol, args.sl, args.sv]
-    mod = binding.compile_and_execute(mod, args.O, args.jit, optimization, total_time)
-    if args.emit_llvm:
-        if args.o != "exe":
-            write_to_file(args.o, mod)
-        else:
-            write_to_file("temp.ll", mod)
-            os.system("clang -c temp.ll -o temp.o")
-            os.system("clang main.cpp temp.o -o exe")
+    report = None
+    if args.time_passes or args.stats:
+        report = stats.Report(args.time_passes, args.stats)
+        report.phase("parse", parse_time2 - parse_time1)
+        report.phase("codegen", gen_time2 - gen_time1)
+    artifacts = {"ast": ast_yaml, "warnings": warnings, "check_report": check_report} if compile_cache is not None else None
+    engine, mod = binding.compile_module(mod, args.O, optimization, total_time, artifacts, object_cache_dir, args.opt_jobs, report, args.march)
+    # store before running, the program may exit() the process
+    if compile_cache is not None:
+        compile_cache.put(key, artifacts)
+    if report is not None:
+        report.write(args.stats_file)
+    if args.jit:
+        binding.execute(engine, undefined)
+    if instrumentation is not None:
+        pgo.write_profile(args.profile_generate, instrumentation, pgo.read_counters(engine, instrumentation))
+    write_llvm(args, mod)
+
+def incremental_compiler(args):
+    functions = incremental.FunctionCache(paths.cache_dir("functions"))
+    return incremental.IncrementalCompiler(args.O, optimization_flags(args), functions, args.march)
+
+def compile_incremental(args, undefined, content, object_cache_dir):
+    compiler = incremental_compiler(args)
+    parse_time1 = time.time()
+    try:
+        ast = compiler.parse(content)
+    except yacc.CompilerException as e:
+        print(e.message)
+        print("exit code: "+str(1))
+        sys.exit(1)
+    parse_time2 = time.time()
+    if args.emit_ast:
+        write_to_file(args.o, yaml.dump(ast))
+    with tracing.span("generate_code", incremental=True):
+        mod, stats = compiler.generate(ast)
+    incremental.print_stats(stats)
+    total_time = parse_time2 - parse_time1 + stats["codegen"] + stats["link"]
+    # the functions are optimized already
+    mod = binding.compile_and_execute(mod, False, args.jit, None, total_time, object_cache_dir, cpu=args.march, args=undefined)
+    write_llvm(args, mod)
+
+def main():
+    parser = build_arg_parser()
+    args, undefined = parser.parse_known_args()
+
+    exitcode = 0
+
+    if args.cache_stats or args.cache_clear:
+        compile_cache = cache.CompileCache(max_bytes=args.cache_max_mb * 1024 * 1024)
+        if args.cache_clear:
+            compile_cache.clear()
+        cache.print_stats(compile_cache)
+        return
+    if args.serve:
+        import server
+        server.serve(args.socket, args.cache_size)
+        return
+    if args.batch:
+        import batch
+        # every positional value is an arg()/argf() value in batch mode
+        values = ([args.input_file] if args.input_file is not None else []) + undefined
+        options = {"O": args.O, "dul": args.dul, "it": args.it, "lv": args.lv, "ol": args.ol,
+                   "sl": args.sl, "sv": args.sv, "jit": args.jit, "args": values,
+                   "emit": "ast" if args.emit_ast else "llvm" if args.emit_llvm else None}
+        records = batch.run_batch(args.batch, options, args.out_dir, args.jobs)
+        sys.exit(0 if all(r["ok"] for r in records) else 1)
+    if args.input_file is None:
+        parser.error("the following arguments are required: input_file")
+    if args.profile_generate is not None and not args.jit:
+        parser.error("-profile-generate needs -jit")
+    if (args.profile_generate is not None or args.profile_use is not None) and (args.incremental or args.watch):
+        parser.error("-profile-generate and -profile-use do not work with --incremental or --watch")
+    if args.tiered and (not args.jit or args.emit_llvm or args.incremental or args.watch or args.profile_generate or args.profile_use):
+        parser.error("-tiered needs -jit and does not work with -emit-llvm, --incremental, --watch or the profile flags")
+    if args.march is not None and not binding.known_cpu(args.march):
+        print("error: -march " + args.march + " is not a CPU of the host target")
+        print("exit code: "+str(1))
+        sys.exit(1)
+    if args.emit_ast and args.emit_llvm:
+        raise Exception("Cannot emit_ast and emit_llvm at the same time")
+    elif args.watch:
+        output_file = args.o if args.emit_llvm and isinstance(args.o, str) else None
+        incremental.watch(args.input_file, incremental_compiler(args), args.jit, output_file, args=undefined)
+        return
+    else:
+        if args.trace is not None:
+            tracing.enable(args.trace)
+        try:
+            compile_file(args, undefined)
+        finally:
+            tracing.write()
+
+    print("exit code: "+str(exitcode))
 
-print("exit code: "+str(exitcode))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
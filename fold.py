@@ -0,0 +1,308 @@
+import sys
+import struct
+
+import nodes
+
+# Constant folding and dead code elimination on the checked AST, run between
+# yacc.parse and codeGen. The tree is changed in place:
+#
+#   - binops, uops and casts of literals become literals, computed the way
+#     the generated code would: int wraps around, cint and float keep their
+#     checks and float is single precision,
+#   - ifs and whiles with a literal condition are replaced by the branch
+#     taken, or removed,
+#   - statements after a return in the same block are removed,
+#   - expression statements without effects and declarations of variables
+#     that are never used, initialized without effects, are removed.
+#
+# A constant cint operation that overflows or a constant division by zero is
+# left in the tree, so the program still stops where it did at run time, and
+# a warning is reported.
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+
+arith_ops = ["add", "sub", "mul", "div"]
+
+def wrap(value):
+    return (value + 2**31) % 2**32 - 2**31
+
+def to_float32(value):
+    # None if the value does not fit a float
+    try:
+        return struct.unpack("f", struct.pack("f", value))[0]
+    except OverflowError:
+        return None
+
+def trunc_div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def is_lit(node, exptype=None):
+    if type(node) is not nodes.Lit:
+        return False
+    if exptype == "int":
+        # only fold literals the generated i32 constant holds
+        return "int" in node.exptype and INT_MIN <= node.value <= INT_MAX
+    return exptype is None or node.exptype == exptype
+
+def is_pure(node, cint=False):
+    """
+    Whether evaluating node can neither change a variable, call a func nor
+    stop the program at a runtime check.
+    """
+    kind = type(node)
+    exptype = "cint" if cint else (node.exptype or "")
+    if kind is nodes.Lit or kind is nodes.VarVal:
+        return True
+    elif kind is nodes.CastStmt:
+        return is_pure(node.exp)
+    elif kind is nodes.Uop:
+        return not (node.op == "minus" and "cint" in exptype) and is_pure(node.exp)
+    elif kind is nodes.Binop:
+        if node.op == "div" or node.op in arith_ops and "cint" in exptype:
+            return False
+        return is_pure(node.lhs, exptype == "cint") and is_pure(node.rhs, exptype == "cint")
+    return False
+
+def declares(stmt):
+    # a declaration outside a block is in scope after the if or while
+    return type(stmt) is nodes.VarDeclStmt
+
+def terminates(stmt):
+    # whether code generation ends the current basic block with the stmt
+    if type(stmt) is nodes.Ret:
+        return True
+    elif type(stmt) is nodes.Blk:
+        return bool(stmt.stmts) and terminates(stmt.stmts[-1])
+    return False
+
+class Folder():
+    def __init__(self):
+        self.warnings = []
+        self.func = None
+
+    def warn(self, message):
+        self.warnings.append("warning: %s in function %s" % (message, self.func.globid))
+
+    def fold_func(self, func):
+        self.func = func
+        if func.blk is not None:
+            self.stmt(func.blk)
+            while self.drop_unused(func):
+                pass
+
+    #######
+    # Statements: return the folded stmt, or None to remove it
+    #######
+
+    def stmt(self, node):
+        kind = type(node)
+        if kind is nodes.Blk:
+            return self.blk(node)
+        elif kind is nodes.VarDeclStmt:
+            node.exp = self.exp(node.exp, node.exptype == "cint")
+        elif kind is nodes.ExpStmt:
+            node.exp = self.exp(node.exp)
+            if is_pure(node.exp):
+                return None
+        elif kind is nodes.Print or kind is nodes.Ret:
+            if node.exp is not None:
+                node.exp = self.exp(node.exp)
+        elif kind is nodes.If:
+            return self.if_(node)
+        elif kind is nodes.While:
+            node.cond = self.exp(node.cond)
+            if is_lit(node.cond, "bool") and not node.cond.value and not declares(node.stmt):
+                return None
+            node.stmt = self.branch(node.stmt)
+        return node
+
+    def blk(self, node):
+        if node.stmts is None:
+            return node
+        stmts = []
+        for stmt in node.stmts:
+            stmt = self.stmt(stmt)
+            if stmt is None:
+                continue
+            stmts.append(stmt)
+            if terminates(stmt):
+                # the rest of the block is unreachable
+                break
+        node.stmts = stmts
+        return node
+
+    def branch(self, node):
+        # the stmt of an if or while, which cannot be left out
+        node = self.stmt(node)
+        return node if node is not None else nodes.Blk([])
+
+    def if_(self, node):
+        node.cond = self.exp(node.cond)
+        if is_lit(node.cond, "bool") and not declares(node.stmt) and not declares(node.else_stmt):
+            taken = node.stmt if node.cond.value else node.else_stmt
+            return self.stmt(taken) if taken is not None else None
+        node.stmt = self.branch(node.stmt)
+        if node.else_stmt is not None:
+            node.else_stmt = self.stmt(node.else_stmt)
+        return node
+
+    def drop_unused(self, func):
+        """
+        Remove the declarations of variables that are never read or
+        assigned, with pure initializers. Returns whether any was removed.
+        """
+        used = set()
+        blocks = []
+        stack = [func.blk]
+        while stack:
+            node = stack.pop()
+            kind = type(node)
+            if kind is nodes.VarVal or kind is nodes.Assign:
+                used.add(node.var)
+            elif kind is nodes.Blk and node.stmts:
+                blocks.append(node)
+            stack.extend(node.children())
+        removed = False
+        for blk in blocks:
+            stmts = [stmt for stmt in blk.stmts if not (type(stmt) is nodes.VarDeclStmt and stmt.vdecl.var not in used
+                                                        and is_pure(stmt.exp, stmt.exptype == "cint"))]
+            removed = removed or len(stmts) != len(blk.stmts)
+            blk.stmts = stmts
+        return removed
+
+    #######
+    # Expressions: return the folded expression. cint is set where codeGen
+    # treats the expression as cint although its exptype is not.
+    #######
+
+    def exp(self, node, cint=False):
+        kind = type(node)
+        if kind is nodes.Binop:
+            return self.binop(node, "cint" if cint else node.exptype)
+        elif kind is nodes.Uop:
+            return self.uop(node, "cint" if cint else node.exptype)
+        elif kind is nodes.CastStmt:
+            node.exp = self.exp(node.exp)
+            return self.cast(node)
+        elif kind is nodes.Assign:
+            node.exp = self.exp(node.exp, node.exptype == "cint")
+        elif kind is nodes.FuncCall and node.params is not None:
+            node.params = [self.exp(param) for param in node.params]
+        return node
+
+    def binop(self, node, exptype):
+        node.lhs = self.exp(node.lhs, exptype == "cint")
+        node.rhs = self.exp(node.rhs, exptype == "cint")
+        lhs, rhs, op = node.lhs, node.rhs, node.op
+        if op in ["and", "or"]:
+            if is_lit(lhs, "bool") and is_lit(rhs, "bool"):
+                value = lhs.value and rhs.value if op == "and" else lhs.value or rhs.value
+                return nodes.Lit(value, "bool")
+        elif op in ["lt", "gt", "eq"]:
+            if is_lit(lhs, "int") and is_lit(rhs, "int") or is_lit(lhs, "float") and is_lit(rhs, "float"):
+                a, b = lhs.value, rhs.value
+                if lhs.exptype == "float":
+                    a, b = to_float32(a), to_float32(b)
+                if a is not None and b is not None:
+                    value = a < b if op == "lt" else a > b if op == "gt" else a == b
+                    return nodes.Lit(value, "bool")
+        elif "int" in exptype:
+            if is_lit(lhs, "int") and is_lit(rhs, "int"):
+                value = self.int_arith(op, lhs.value, rhs.value, "cint" in exptype)
+                if value is not None:
+                    return nodes.Lit(value, node.exptype)
+        elif "float" in exptype:
+            if is_lit(lhs, "float") and is_lit(rhs, "float"):
+                value = self.float_arith(op, to_float32(lhs.value), to_float32(rhs.value))
+                if value is not None:
+                    return nodes.Lit(value, node.exptype)
+        return node
+
+    def int_arith(self, op, a, b, cint):
+        # None where the generated code would stop the program
+        if op == "div":
+            if b == 0:
+                self.warn("division by zero")
+                return None
+            if a == INT_MIN and b == -1:
+                if cint:
+                    self.warn("cint overflow")
+                return None
+            return trunc_div(a, b)
+        value = a + b if op == "add" else a - b if op == "sub" else a * b
+        if not cint:
+            return wrap(value)
+        if not INT_MIN <= value <= INT_MAX:
+            self.warn("cint overflow")
+            return None
+        return value
+
+    def float_arith(self, op, a, b):
+        if a is None or b is None:
+            return None
+        if op == "div" and b == 0:
+            self.warn("division by zero")
+            return None
+        value = a + b if op == "add" else a - b if op == "sub" else a * b if op == "mul" else a / b
+        return to_float32(value)
+
+    def uop(self, node, exptype):
+        node.exp = self.exp(node.exp)
+        exp = node.exp
+        if node.op == "not" and is_lit(exp, "bool"):
+            return nodes.Lit(not exp.value, "bool")
+        elif node.op == "minus" and "int" in exptype and is_lit(exp, "int"):
+            if "cint" in exptype and exp.value == INT_MIN:
+                self.warn("cint overflow")
+                return node
+            return nodes.Lit(wrap(-exp.value), node.exptype)
+        elif node.op == "minus" and "float" in exptype and is_lit(exp, "float"):
+            value = to_float32(exp.value)
+            if value is not None:
+                return nodes.Lit(0.0 - value, node.exptype)
+        return node
+
+    def cast(self, node):
+        exp = node.exp
+        if "int" in node.type:
+            if is_lit(exp, "int"):
+                return nodes.Lit(exp.value, node.type)
+            elif is_lit(exp, "float"):
+                # fptoui of the float constant
+                value = to_float32(exp.value)
+                if value is not None and 0 <= value < 2**31:
+                    return nodes.Lit(int(value), node.type)
+        elif node.type == "float":
+            if is_lit(exp, "int"):
+                # uitofp
+                value = to_float32(exp.value % 2**32)
+                if value is not None:
+                    return nodes.Lit(value, "float")
+            elif is_lit(exp, "float"):
+                return nodes.Lit(exp.value, "float")
+        elif node.type == "bool" and is_lit(exp, "bool"):
+            return exp
+        return node
+
+def fold_func(func):
+    """
+    Fold the func in place; returns the warnings.
+    """
+    folder = Folder()
+    folder.fold_func(func)
+    return folder.warnings
+
+def fold_program(prog):
+    """
+    Fold every func of prog in place; returns the warnings.
+    """
+    warnings = []
+    for func in prog.funcs:
+        warnings.extend(fold_func(func))
+    return warnings
+
+def print_warnings(warnings, file=sys.stderr):
+    for warning in warnings:
+        print(warning, file=file)
@@ -0,0 +1,224 @@
+import os, sys, json
+import hashlib
+import time
+
+import llvmlite.binding as llvm
+
+import yacc, codeGen, binding, nodes, fold
+import cache
+
+# Incremental compilation. Every func is generated (and with -O optimized) in a
+# module of its own, and the modules are linked with a support module holding
+# the externs and arg()/argf(). The optimized bitcode of each
+# func is kept under a fingerprint of
+#
+#   - the func's checked AST, including the types the checker filled in,
+#   - the signatures of the funcs and externs it calls,
+#   - the optimization flags and the compiler itself (cache.compiler_hash),
+#
+# so after an edit only the funcs whose fingerprint changed are generated and
+# optimized again. Funcs are not inlined into each other, since each is
+# optimized on its own.
+#
+# Bitcode is kept in memory for --watch and on disk in the "functions" cache
+# directory, so separate ekcc --incremental runs share it.
+
+def signature(ast):
+    if type(ast) is nodes.Func:
+        args = [vdecl.type for vdecl in ast.vdecls] if ast.vdecls is not None else []
+    else:
+        args = list(ast.tdecls) if ast.tdecls is not None else []
+    return [ast.globid, ast.ret_type, args]
+
+def called_functions(ast):
+    """
+    globids of the funcs and externs called in the func ast, in order of
+    first call.
+    """
+    called = {}
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if type(node) is list:
+            stack.extend(node)
+            continue
+        if type(node) is nodes.FuncCall:
+            called[node.globid] = True
+        stack.extend(node.children())
+    return list(called)
+
+def fingerprint(ast, callees, flags):
+    fields = [cache.compiler_hash(), flags, ast.to_dict(), [signature(c) for c in callees]]
+    return hashlib.sha256(json.dumps(fields).encode("utf8")).hexdigest()
+
+class FunctionCache():
+    """
+    Optimized bitcode of single func modules by fingerprint, in memory and,
+    unless directory is None, in directory as <fingerprint>.bc.
+    """
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".bc")
+
+    def get(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                bitcode = f.read()
+            os.utime(self.path(key))
+        except OSError:
+            return None
+        self.memory[key] = bitcode
+        return bitcode
+
+    def put(self, key, bitcode):
+        self.memory[key] = bitcode
+        if self.directory is not None:
+            cache.write_atomic(self.path(key), bitcode)
+            cache.evict_lru(cache.list_entries(self.directory, ".bc"), self.max_bytes)
+
+    def retain(self, keys):
+        # drop in-memory entries of funcs no longer in the program
+        self.memory = {k: v for k, v in self.memory.items() if k in keys}
+
+class IncrementalCompiler():
+    """
+    Builds programs with per-func modules from a FunctionCache. parse()
+    raises yacc.CompilerException for programs that fail to check.
+    """
+    def __init__(self, should_optimize, optimization, function_cache=None, cpu=None):
+        self.should_optimize = should_optimize
+        self.optimization = optimization
+        self.functions = function_cache if function_cache is not None else FunctionCache()
+        self.cpu = cpu
+        # the optimizer's cost model depends on the CPU
+        self.flags = [bool(should_optimize)] + [str(f) for f in optimization] + [binding.target_id(cpu)]
+
+    def compile_function(self, func, callees):
+        fold.print_warnings(fold.fold_func(func))
+        mod = llvm.parse_assembly(str(codeGen.generate_func_module(func, callees)))
+        if self.should_optimize:
+            binding.optimize_module(mod, self.optimization, self.cpu)
+        mod.verify()
+        return mod.as_bitcode()
+
+    def parse(self, source):
+        ast, err_message = yacc.parse(source)
+        if err_message != None:
+            raise yacc.CompilerException(err_message)
+        return ast
+
+    def generate(self, ast):
+        """
+        Link the program ast from cached and newly compiled func modules.
+        Returns the llvm.ModuleRef and a dict of statistics.
+        """
+        stats = {"functions": 0, "regenerated": 0}
+        start_time = time.time()
+        declared = {}
+        for decl in ast.externs:
+            declared[decl.globid] = decl
+        keys = []
+        modules = []
+        for func in ast.funcs:
+            declared[func.globid] = func
+            callees = [declared[name] for name in called_functions(func) if name != func.globid]
+            key = fingerprint(func, callees, self.flags)
+            bitcode = self.functions.get(key)
+            if bitcode is None:
+                bitcode = self.compile_function(func, callees)
+                self.functions.put(key, bitcode)
+                stats["regenerated"] += 1
+            keys.append(key)
+            modules.append(bitcode)
+        self.functions.retain(set(keys))
+        stats["functions"] = len(keys)
+        stats["codegen"] = time.time() - start_time
+
+        start_time = time.time()
+        linked = llvm.parse_assembly(str(codeGen.generate_support_module(ast)))
+        for bitcode in modules:
+            linked.link_in(llvm.parse_bitcode(bitcode))
+        linked.verify()
+        stats["link"] = time.time() - start_time
+        return linked, stats
+
+    def build(self, source):
+        """
+        parse and generate; returns the AST, the linked module and the
+        statistics including the parse time.
+        """
+        start_time = time.time()
+        ast = self.parse(source)
+        parse_time = time.time() - start_time
+        linked, stats = self.generate(ast)
+        stats["parse"] = parse_time
+        return ast, linked, stats
+
+def print_stats(stats, file=sys.stderr):
+    print("######## Incremental Build: %d of %d functions regenerated ########"
+          % (stats["regenerated"], stats["functions"]), file=file)
+
+def watch(input_file, compiler, jit=False, output_file=None, interval=0.2, args=()):
+    """
+    Rebuild input_file with compiler whenever it changes and print how long
+    each rebuild took. With jit, run() is called after every successful
+    build, in a child process so that exit() in the program does not stop
+    the watch, with args as the values of arg()/argf(). With output_file
+    the linked IR is written there.
+    """
+    import pipeline
+    pool = pipeline.EnginePool(size=1)
+    mtime = None
+    print("watching %s, press Ctrl-C to stop" % input_file, file=sys.stderr)
+    try:
+        while True:
+            try:
+                current = os.stat(input_file).st_mtime_ns
+            except OSError:
+                current = None
+            if current is None or current == mtime:
+                time.sleep(interval)
+                continue
+            mtime = current
+            with open(input_file, 'r') as input:
+                source = input.read()
+            start_time = time.time()
+            try:
+                ast, mod, stats = compiler.build(source)
+            except (yacc.CompilerException, SystemExit) as e:
+                # codeGen exits on literal overflow
+                if isinstance(e, yacc.CompilerException):
+                    print(e.message)
+                print("######## Rebuild failed after %.1f ms ########" % ((time.time() - start_time) * 1000), file=sys.stderr)
+                continue
+            llvm_ir = str(mod)
+            latency = time.time() - start_time
+            print_stats(stats)
+            print("######## Rebuild Time: %.1f ms (parse %.1f, codegen %.1f, link %.1f) ########"
+                  % (latency * 1000, stats["parse"] * 1000, stats["codegen"] * 1000, stats["link"] * 1000), file=sys.stderr)
+            if output_file is not None:
+                with open(output_file, 'w') as output:
+                    output.write(llvm_ir)
+            if jit:
+                slot = pool.acquire()
+                try:
+                    output, exit_status, result = pipeline.execute_captured(slot[0], llvm_ir, args)
+                finally:
+                    pool.release(slot)
+                sys.stdout.write(output)
+                print("exit code: %d" % exit_status)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
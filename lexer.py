@@ -1,4 +1,12 @@
-import ply.lex as lex
+import re
+from collections import namedtuple
+from functools import partial
+
+# The tokenizer. One precompiled regular expression matches every token kind
+# as a group, and finditer walks the source with it. Tokens are tuples of
+# (type, value, lineno, lexpos, column), lines and columns counting from 1.
+# The Lexer class hands them to PLY's parser through the input()/token()
+# interface of a PLY lexer, as Token named tuples.
 
 reserved = {
     'int' : 'INT',
@@ -25,7 +33,7 @@ tokens = list(reserved.values()) + [
     # arithmetic
     'PLUS', 'MINUS', 'TIMES', 'DIVIDE', 'ASSIGN',
     # compare
-    'EQUAL', 'GREATERTHAN', 'SMALLERTHAN', 
+    'EQUAL', 'GREATERTHAN', 'SMALLERTHAN',
     # logical operations
     'AND', 'OR', 'NEGATE',
     # (),{},[]
@@ -40,66 +48,97 @@ tokens = list(reserved.values()) + [
     'VARID'
 ]
 
-# arithmetic
-t_PLUS = r"\+"
-t_MINUS = r'\-'
-t_TIMES = r'\*'
-t_DIVIDE = r'\/'
-t_ASSIGN = r'\='
-# compare
-t_EQUAL = r'\=\='
-t_GREATERTHAN = r'\>'
-t_SMALLERTHAN = r'\<'
-# logical operations
-t_AND = r'\&\&'
-t_OR = r'\|\|'
-t_NEGATE = r'\!'
-# (),{},[]
-t_LPARENTHESE = r'\('
-t_RPARENTHESE = r'\)'
-t_LBRACE = r'\{'
-t_RBRACE = r'\}'
-t_LBRACKET = r'\['
-t_RBRACKET = r'\]'
-# delimiter
-t_COMMA = r'\,'
-t_SEMICOLON = r'\;'
-
-t_ignore  = ' \t'
+operators = {
+    # arithmetic
+    '+': 'PLUS', '-': 'MINUS', '*': 'TIMES', '/': 'DIVIDE', '=': 'ASSIGN',
+    # compare
+    '==': 'EQUAL', '>': 'GREATERTHAN', '<': 'SMALLERTHAN',
+    # logical operations
+    '&&': 'AND', '||': 'OR', '!': 'NEGATE',
+    # (),{},[]
+    '(': 'LPARENTHESE', ')': 'RPARENTHESE', '{': 'LBRACE', '}': 'RBRACE', '[': 'LBRACKET', ']': 'RBRACKET',
+    # delimiter
+    ',': 'COMMA', ';': 'SEMICOLON',
+}
 
-t_VARID = r'\$[a-zA-Z_][a-zA-Z_0-9]*'
+# the type of a keyword or operator, anything else in its group is an IDENT
+types = dict(reserved, **operators)
 
-def t_SLIT(t):
-    r'"[^"\n\r]*"'
-    t.value = str(t.value)[1:-1]
-    return t
+# Blanks and comments are taken in front of the token they precede, so every
+# match is a token or a run of line breaks. Something always follows them, if
+# only the end of the source, so they are never backtracked into. The groups
+# are numbered in the order tokenize tests them.
+WORD, NEWLINE, VARID, FNUMBER, NUMBER, SLIT, ILLEGAL, END = range(1, 9)
+master = re.compile(r'(?:[ \t]+|\#[^\r\n]*)*(?:' + "|".join([
+    # the two character operators before their first characters
+    r'([a-zA-Z_][a-zA-Z_0-9]*|==|&&|\|\||[-+*/=><!(){}\[\],;])',
+    r'([\n\r]+)',
+    r'(\$[a-zA-Z_][a-zA-Z_0-9]*)',
+    r'(\d+\.\d+)',
+    r'(\d+)',
+    r'("[^"\n\r]*")',
+    r'(.)',
+    r'(\Z)',
+]) + ')')
 
-def t_newline(t):
-    r'[\n\r]+'
-    t.lexer.lineno += 1
-    pass
+Token = namedtuple("Token", ["type", "value", "lineno", "lexpos", "column"])
+# PLY sets this on the token it passes to p_error unless it has one
+Token.lexer = None
 
-def t_error(t):
-    print("Illegal characters: " + t.value[0])
-    t.lexer.skip(1)
+def count_lines(newlines):
+    # \r\n, \r and \n each end a line
+    return newlines.count("\n") + newlines.count("\r") - newlines.count("\r\n")
 
-def t_IDENT(t):
-    r'[a-zA-Z_]+[a-zA-Z_0-9]*'
-    t.type = reserved.get(t.value, "IDENT")
-    return t
+def tokenize(source, lineno=1):
+    """
+    The tokens of source as a list of (type, value, lineno, lexpos, column)
+    tuples, the first line being lineno. Illegal characters are reported
+    and skipped.
+    """
+    result = []
+    append = result.append
+    get_type = types.get
+    line_start = 0
+    for match in master.finditer(source):
+        kind = match.lastindex
+        start, end = match.span(kind)
+        if kind == WORD:
+            value = source[start:end]
+            append((get_type(value, "IDENT"), value, lineno, start, start - line_start + 1))
+        elif kind == NEWLINE:
+            lineno += count_lines(source[start:end])
+            line_start = end
+        elif kind == VARID:
+            append(("VARID", source[start:end], lineno, start, start - line_start + 1))
+        elif kind == FNUMBER:
+            append(("FNUMBER", float(source[start:end]), lineno, start, start - line_start + 1))
+        elif kind == NUMBER:
+            append(("NUMBER", int(source[start:end]), lineno, start, start - line_start + 1))
+        elif kind == SLIT:
+            append(("SLIT", source[start + 1:end - 1], lineno, start, start - line_start + 1))
+        elif kind == ILLEGAL:
+            print("Illegal characters: " + source[start])
+    return result
 
-def t_FNUMBER(t):
-    r'\d+[\.]\d+'
-    t.value = float(t.value)
-    return t 
+class Lexer():
+    """
+    Tokens one at a time: input(source), then token() until it returns
+    None. lineno is the line the next input starts at.
+    """
+    def __init__(self):
+        self.lineno = 1
+        self.next_token = iter(()).__next__
 
-def t_NUMBER(t):
-    r'\d+'
-    t.value = int(t.value)
-    return t
+    def input(self, source):
+        found = tokenize(source, self.lineno)
+        self.lineno += count_lines(source)
+        # the parser reads the fields by name
+        self.next_token = map(partial(tuple.__new__, Token), found).__next__
 
-def t_comments(t):
-    r'\#[^\r\n]*'
-    pass
+    def token(self):
+        try:
+            return self.next_token()
+        except StopIteration:
+            return None
 
-lexer = lex.lex()
\ No newline at end of file
+lexer = Lexer()
@@ -0,0 +1,83 @@
+import os
+import hashlib
+import shutil, subprocess, tempfile
+import time
+
+import paths
+
+# Native executables: the program's object code (see binding.emit_object) is
+# linked with the object of the main.cpp runtime stub, which is compiled once
+# per compiler and cached. All intermediate files get unique temporary names,
+# so concurrent ekcc runs cannot overwrite each other's files.
+
+RUNTIME_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.cpp")
+
+class LinkError(Exception):
+    def __init__(self, m):
+        self.message = m
+
+def find_compiler():
+    """
+    The C++ compiler driver used to build the stub and link: $CXX, or clang
+    as before, falling back to the system c++.
+    """
+    for name in [os.environ.get("CXX"), "clang", "c++"]:
+        if name and shutil.which(name):
+            return shutil.which(name)
+    raise LinkError("error: no C++ compiler found (set CXX)")
+
+def run(cmd):
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise LinkError("error: %s failed:\n%s" % (" ".join(cmd), result.stdout.decode("utf8", "replace")))
+
+def runtime_object(compiler):
+    """
+    Path of the compiled runtime stub, building it on first use.
+    """
+    h = hashlib.sha256()
+    with open(RUNTIME_SOURCE, 'rb') as f:
+        h.update(f.read())
+    h.update(("%s %s" % (compiler, os.stat(compiler).st_mtime)).encode("utf8"))
+    path = os.path.join(paths.cache_dir("runtime"), "main-%s.o" % h.hexdigest()[:16])
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(suffix=".o", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            run([compiler, "-c", RUNTIME_SOURCE, "-o", tmp])
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    return path
+
+def umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+def link_executable(object_code, output_file):
+    """
+    Link object_code with the runtime stub into output_file. Returns the
+    time spent linking.
+    """
+    compiler = find_compiler()
+    stub = runtime_object(compiler)
+    start_time = time.time()
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, object_file = tempfile.mkstemp(suffix=".o")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(object_code)
+    # link next to the target and rename, so the executable appears atomically
+    fd, tmp = tempfile.mkstemp(dir=output_dir, prefix="." + os.path.basename(output_file))
+    os.close(fd)
+    try:
+        run([compiler, stub, object_file, "-o", tmp])
+        # mkstemp creates the file 0600, the linker keeps that and adds x
+        os.chmod(tmp, 0o777 & ~umask())
+        os.replace(tmp, output_file)
+    finally:
+        os.unlink(object_file)
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return time.time() - start_time
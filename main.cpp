@@ -1,8 +1,16 @@
 extern "C" {
     int run();
+    // writes out the program's output buffer, see runtime.py
+    void ek_flush();
+    // the values of arg()/argf(), see codeGen.ARGC
+    int ek_argc;
+    char **ek_argv;
 }
 
-int main(){
+int main(int argc, char **argv){
+	ek_argc = argc - 1;
+	ek_argv = argv + 1;
 	run();
+	ek_flush();
 	return 0;
-}
\ No newline at end of file
+}
@@ -0,0 +1,338 @@
+import yaml
+
+# AST node classes built by the parser in yacc.py. Every class lists its
+# fields in __slots__; children() yields the child nodes in source order.
+# Expression nodes carry an exptype, filled in by the checker (literals get
+# theirs from the parser). Binop and uop nodes also carry proven, the names of
+# the runtime checks ranges.py found they never need. Func, if and while
+# nodes carry the counter and counts fields of pgo.py.
+#
+# to_dict() gives the dict form the tree is written as for -emit-ast,
+# including the wrapper mappings ("externs", "funcs", "stmts", "exps",
+# "vdecls", "tdecls") around lists, and yaml.dump() of a node writes it.
+
+class Node():
+    __slots__ = ()
+    name = None
+
+    def children(self):
+        return ()
+
+def to_dict(value):
+    if isinstance(value, Node):
+        return value.to_dict()
+    elif type(value) is list:
+        return [to_dict(v) for v in value]
+    return value
+
+def with_exptype(d, node):
+    if node.exptype is not None:
+        d["exptype"] = node.exptype
+    return d
+
+#######
+# Top level
+#######
+
+class Prog(Node):
+    __slots__ = ("externs", "funcs")
+    name = "prog"
+
+    def __init__(self, externs, funcs):
+        self.externs = externs
+        self.funcs = funcs
+
+    def children(self):
+        return self.externs + self.funcs
+
+    def to_dict(self):
+        externs = {"name": "externs"}
+        if self.externs:
+            externs["externs"] = to_dict(self.externs)
+        return {"name": "prog", "externs": externs,
+                "funcs": {"name": "funcs", "funcs": to_dict(self.funcs)}}
+
+class Extern(Node):
+    __slots__ = ("ret_type", "globid", "tdecls")
+    name = "extern"
+
+    def __init__(self, ret_type, globid, tdecls=None):
+        self.ret_type = ret_type
+        self.globid = globid
+        self.tdecls = tdecls
+
+    def to_dict(self):
+        d = {"name": "extern", "ret_type": self.ret_type, "globid": self.globid}
+        if self.tdecls is not None:
+            d["tdecls"] = {"name": "tdecls", "types": list(self.tdecls)}
+        return d
+
+class Func(Node):
+    __slots__ = ("ret_type", "globid", "vdecls", "blk", "counter", "counts")
+    name = "func"
+
+    def __init__(self, ret_type, globid, vdecls, blk):
+        self.ret_type = ret_type
+        self.globid = globid
+        self.vdecls = vdecls
+        self.blk = blk
+        self.counter = None
+        self.counts = None
+
+    def children(self):
+        if self.vdecls is not None:
+            return self.vdecls + [self.blk]
+        return (self.blk,)
+
+    def to_dict(self):
+        d = {"name": "func", "ret_type": self.ret_type, "globid": self.globid}
+        if self.vdecls is not None:
+            d["vdecls"] = {"name": "vdecls", "vars": to_dict(self.vdecls)}
+        d["blk"] = self.blk.to_dict()
+        return d
+
+class VDecl(Node):
+    __slots__ = ("type", "var")
+
+    def __init__(self, type, var):
+        self.type = type
+        self.var = var
+
+    def to_dict(self):
+        return {"node": "vdecl", "type": self.type, "var": self.var}
+
+#######
+# Statements
+#######
+
+class Blk(Node):
+    __slots__ = ("stmts",)
+    name = "blk"
+
+    def __init__(self, stmts=None):
+        self.stmts = stmts
+
+    def children(self):
+        return self.stmts or ()
+
+    def to_dict(self):
+        d = {"name": "blk"}
+        if self.stmts is not None:
+            d["contents"] = {"name": "stmts", "stmts": to_dict(self.stmts)}
+        return d
+
+class Ret(Node):
+    __slots__ = ("exp",)
+    name = "ret"
+
+    def __init__(self, exp=None):
+        self.exp = exp
+
+    def children(self):
+        return (self.exp,) if self.exp is not None else ()
+
+    def to_dict(self):
+        d = {"name": "ret"}
+        if self.exp is not None:
+            d["exp"] = self.exp.to_dict()
+        return d
+
+class VarDeclStmt(Node):
+    __slots__ = ("vdecl", "exp", "exptype")
+    name = "vardeclstmt"
+
+    def __init__(self, vdecl, exp):
+        self.vdecl = vdecl
+        self.exp = exp
+        self.exptype = None
+
+    def children(self):
+        return (self.vdecl, self.exp)
+
+    def to_dict(self):
+        return with_exptype({"name": "vardeclstmt", "vdecl": self.vdecl.to_dict(),
+                             "exp": self.exp.to_dict()}, self)
+
+class ExpStmt(Node):
+    __slots__ = ("exp",)
+    name = "expstmt"
+
+    def __init__(self, exp):
+        self.exp = exp
+
+    def children(self):
+        return (self.exp,)
+
+    def to_dict(self):
+        return {"name": "expstmt", "exp": self.exp.to_dict()}
+
+class While(Node):
+    __slots__ = ("cond", "stmt", "counter", "counts")
+    name = "while"
+
+    def __init__(self, cond, stmt):
+        self.cond = cond
+        self.stmt = stmt
+        self.counter = None
+        self.counts = None
+
+    def children(self):
+        return (self.cond, self.stmt)
+
+    def to_dict(self):
+        return {"name": "while", "cond": self.cond.to_dict(), "stmt": self.stmt.to_dict()}
+
+class If(Node):
+    __slots__ = ("cond", "stmt", "else_stmt", "counter", "counts")
+    name = "if"
+
+    def __init__(self, cond, stmt, else_stmt=None):
+        self.cond = cond
+        self.stmt = stmt
+        self.else_stmt = else_stmt
+        self.counter = None
+        self.counts = None
+
+    def children(self):
+        if self.else_stmt is not None:
+            return (self.cond, self.stmt, self.else_stmt)
+        return (self.cond, self.stmt)
+
+    def to_dict(self):
+        d = {"name": "if", "cond": self.cond.to_dict(), "stmt": self.stmt.to_dict()}
+        if self.else_stmt is not None:
+            d["else_stmt"] = self.else_stmt.to_dict()
+        return d
+
+class Print(Node):
+    __slots__ = ("exp",)
+    name = "print"
+
+    def __init__(self, exp):
+        self.exp = exp
+
+    def children(self):
+        return (self.exp,)
+
+    def to_dict(self):
+        return {"name": "print", "exp": self.exp.to_dict()}
+
+class PrintSlit(Node):
+    __slots__ = ("string",)
+    name = "printslit"
+
+    def __init__(self, string):
+        self.string = string
+
+    def to_dict(self):
+        return {"name": "printslit", "string": self.string}
+
+#######
+# Expressions
+#######
+
+class FuncCall(Node):
+    __slots__ = ("globid", "params", "exptype")
+    name = "funccall"
+
+    def __init__(self, globid, params=None):
+        self.globid = globid
+        self.params = params
+        self.exptype = None
+
+    def children(self):
+        return self.params or ()
+
+    def to_dict(self):
+        d = {"name": "funccall", "globid": self.globid}
+        if self.params is not None:
+            d["params"] = {"name": "exps", "exps": to_dict(self.params)}
+        return with_exptype(d, self)
+
+class VarVal(Node):
+    __slots__ = ("var", "exptype")
+    name = "varval"
+
+    def __init__(self, var):
+        self.var = var
+        self.exptype = None
+
+    def to_dict(self):
+        return with_exptype({"name": "varval", "var": self.var}, self)
+
+class Lit(Node):
+    __slots__ = ("value", "exptype")
+    name = "lit"
+
+    def __init__(self, value, exptype):
+        self.value = value
+        self.exptype = exptype
+
+    def to_dict(self):
+        return {"name": "lit", "value": self.value, "exptype": self.exptype}
+
+class Binop(Node):
+    __slots__ = ("op", "lhs", "rhs", "exptype", "proven")
+    name = "binop"
+
+    def __init__(self, op, lhs, rhs):
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+        self.exptype = None
+        self.proven = ()
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+    def to_dict(self):
+        return with_exptype({"name": "binop", "op": self.op, "lhs": self.lhs.to_dict(),
+                             "rhs": self.rhs.to_dict()}, self)
+
+class Uop(Node):
+    __slots__ = ("op", "exp", "exptype", "proven")
+    name = "uop"
+
+    def __init__(self, op, exp):
+        self.op = op
+        self.exp = exp
+        self.exptype = None
+        self.proven = ()
+
+    def children(self):
+        return (self.exp,)
+
+    def to_dict(self):
+        return with_exptype({"name": "uop", "op": self.op, "exp": self.exp.to_dict()}, self)
+
+class Assign(Node):
+    __slots__ = ("var", "exp", "exptype")
+    name = "assign"
+
+    def __init__(self, var, exp):
+        self.var = var
+        self.exp = exp
+        self.exptype = None
+
+    def children(self):
+        return (self.exp,)
+
+    def to_dict(self):
+        return with_exptype({"name": "assign", "var": self.var, "exp": self.exp.to_dict()}, self)
+
+class CastStmt(Node):
+    __slots__ = ("type", "exp", "exptype")
+    name = "caststmt"
+
+    def __init__(self, type, exp):
+        self.type = type
+        self.exp = exp
+        self.exptype = None
+
+    def children(self):
+        return (self.exp,)
+
+    def to_dict(self):
+        return with_exptype({"name": "caststmt", "type": self.type, "exp": self.exp.to_dict()}, self)
+
+yaml.add_multi_representer(Node, lambda dumper, node: dumper.represent_dict(node.to_dict()))
@@ -0,0 +1,138 @@
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from llvmlite import ir
+import llvmlite.binding as llvm
+
+import binding
+import tracing
+
+# Parallel optimization. The module from codeGen is split into one module per
+# func, holding the func, declarations of the funcs it calls and copies of
+# the internal functions (the runtime check traps) and globals it uses. The
+# splits are optimized with binding.optimize_module in a process pool,
+# linked back together and given a cheap interprocedural pass, which inlines
+# across the splits and removes the duplicated internals.
+
+# llvmlite writes every global reference as @"name"
+_reference = re.compile(r'@"((?:[^"\\]|\\.)*)"')
+
+def references(value):
+    return set(_reference.findall(str(value)))
+
+def is_local(value):
+    return value.linkage in ["internal", "private"]
+
+class Splitter():
+    """
+    Builds the split of every externally visible function defined in the
+    llvmlite.ir.Module module.
+    """
+    def __init__(self, module):
+        self.module = module
+        self.values = {value.name: value for value in module.global_values}
+        self.order = {name: i for i, name in enumerate(self.values)}
+        # names used by the internal functions and globals, which every
+        # split using them gets a copy of
+        self.local_uses = {value.name: references(value) - {value.name}
+                           for value in module.global_values if is_local(value)}
+        self.names = [func.name for func in module.functions
+                      if not func.is_declaration and not is_local(func)]
+
+    def split(self, name):
+        """
+        The IR of the split of the function name.
+        """
+        module = self.module
+        text = str(self.values[name])
+        needed = set()
+        pending = set(_reference.findall(text)) - {name}
+        while pending:
+            used = pending.pop()
+            if used in needed or used not in self.values:
+                continue
+            needed.add(used)
+            pending |= self.local_uses.get(used, set())
+        split = ir.Module(name=name)
+        split.triple = module.triple
+        split.data_layout = module.data_layout
+        for used in sorted(needed, key=self.order.get):
+            value = self.values[used]
+            if isinstance(value, ir.Function) and not value.is_declaration and not is_local(value):
+                # defined in another split
+                ir.Function(split, value.ftype, name=value.name)
+            else:
+                split.add_global(value)
+        # branch weights and other metadata are numbered module wide
+        split.metadata = module.metadata
+        split.namedmetadata = module.namedmetadata
+        # definitions may come in any order, so the function is printed once
+        return str(split) + "\n" + text
+
+def split_module(module):
+    """
+    The IR of one module for every externally visible function defined in
+    the llvmlite.ir.Module module.
+    """
+    splitter = Splitter(module)
+    return [splitter.split(name) for name in splitter.names]
+
+def optimize_split(llvm_ir, optimization, cpu):
+    mod = llvm.parse_assembly(llvm_ir)
+    binding.optimize_module(mod, optimization, cpu)
+    return mod.as_bitcode()
+
+# The Splitter of the module being optimized, which forked workers inherit:
+# printing IR with llvmlite takes about as long as optimizing it, so every
+# worker prints its own splits.
+_splitter = None
+
+def optimize_function(name, optimization, cpu):
+    return optimize_split(_splitter.split(name), optimization, cpu)
+
+def optimize_linked(mod, optimization):
+    """
+    The pass run after linking: inline with the -it threshold, clean up
+    the inlined code and merge or drop the duplicated internals.
+    """
+    pm = llvm.create_module_pass_manager()
+    pm.add_function_attrs_pass()
+    pm.add_ipsccp_pass()
+    pm.add_function_inlining_pass(int(optimization[1]))
+    pm.add_instruction_combining_pass()
+    pm.add_cfg_simplification_pass()
+    pm.add_constant_merge_pass()
+    pm.add_merge_functions_pass()
+    pm.add_global_dce_pass()
+    with tracing.span("linked pass manager"):
+        pm.run(mod)
+
+def optimize_module(module, optimization, jobs, cpu=None):
+    """
+    Optimize the llvmlite.ir.Module module split by function in jobs worker
+    processes (in this process for jobs 1) and return the linked
+    llvm.ModuleRef. cpu is passed on to binding.optimize_module.
+    """
+    global _splitter
+    splitter = Splitter(module)
+    names = splitter.names
+    if jobs > 1 and len(names) > 1:
+        _splitter = splitter
+        try:
+            # the workers' own spans are not recorded
+            with tracing.span("optimize splits", functions=len(names), jobs=jobs), \
+                 ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+                chunksize = max(1, len(names) // (jobs * 4))
+                bitcodes = list(pool.map(optimize_function, names, repeat(optimization), repeat(cpu), chunksize=chunksize))
+        finally:
+            _splitter = None
+    else:
+        bitcodes = [optimize_split(splitter.split(name), optimization, cpu) for name in names]
+    with tracing.span("link", modules=len(bitcodes)):
+        linked = llvm.parse_bitcode(bitcodes[0])
+        for bitcode in bitcodes[1:]:
+            linked.link_in(llvm.parse_bitcode(bitcode))
+    optimize_linked(linked, optimization)
+    return linked
@@ -0,0 +1,16 @@
+import os
+
+# Every on-disk cache ekcc keeps between runs lives under one root directory.
+# EKCC_CACHE_DIR overrides it; otherwise the user's cache directory is used
+# ($XDG_CACHE_HOME/ekcc, falling back to ~/.cache/ekcc).
+def cache_root():
+    root = os.environ.get("EKCC_CACHE_DIR")
+    if not root:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        root = os.path.join(base, "ekcc")
+    return root
+
+def cache_dir(*parts):
+    path = os.path.join(cache_root(), *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
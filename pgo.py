@@ -0,0 +1,147 @@
+import json
+import hashlib
+from ctypes import c_uint64
+
+import nodes
+
+# Profile-guided optimization. With -profile-generate, every func, if and
+# while of the folded AST gets counters (the counter field of the node), which
+# codeGen increments in the global array COUNTERS:
+#
+#   func   entries
+#   if     times executed, times the then branch was taken
+#   while  times entered, times the body ran (the back edges)
+#
+# After the JIT run the counts are added to the profile file, a JSON document
+# of {"functions": {globid: {"hash", "entry", "ifs": [[taken, not taken]...],
+# "whiles": [[body, exit]...]}}}. The ifs and whiles are listed in source
+# order and hash identifies the func's folded AST, so the profile of a func
+# applies to the same func only, however the rest of the program changed.
+#
+# With -profile-use, the counts field of the nodes is set from the profile:
+# codeGen turns it into branch weights and function entry counts, marks funcs
+# that never ran cold and funcs taking a large share of the calls inlinehint,
+# which raises the inlining threshold of their call sites.
+
+COUNTERS = "ek.counters"
+
+# share of all func entries from which a func is hot
+HOT_SHARE = 0.05
+
+def func_hash(func):
+    return hashlib.sha256(json.dumps(func.to_dict(), sort_keys=True).encode("utf8")).hexdigest()
+
+def branches(func):
+    """
+    The ifs and whiles of func in source order.
+    """
+    found = []
+    stack = [func.blk] if func.blk is not None else []
+    while stack:
+        node = stack.pop()
+        if type(node) is nodes.If or type(node) is nodes.While:
+            found.append(node)
+        stack.extend(reversed(list(node.children())))
+    return found
+
+class Instrumentation():
+    """
+    The counters instrument(prog) gave every func.
+    """
+    def __init__(self):
+        self.size = 0
+        # globid -> (digest, entry counter, [(kind, first counter)...])
+        self.funcs = {}
+
+    def counter(self, node, count):
+        node.counter = self.size
+        self.size += count
+        return node.counter
+
+def instrument(prog):
+    """
+    Number the counters of the funcs, ifs and whiles of prog, for codeGen to
+    increment.
+    """
+    instrumentation = Instrumentation()
+    for func in prog.funcs:
+        entry = instrumentation.counter(func, 1)
+        sites = [(type(node).__name__.lower(), instrumentation.counter(node, 2)) for node in branches(func)]
+        instrumentation.funcs[func.globid] = (func_hash(func), entry, sites)
+    return instrumentation
+
+def read_counters(engine, instrumentation):
+    """
+    The counts of the program run on engine.
+    """
+    if instrumentation.size == 0:
+        return []
+    address = engine.get_global_value_address(COUNTERS)
+    return list((c_uint64 * instrumentation.size).from_address(address))
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+def write_profile(path, instrumentation, counts):
+    """
+    Add the counts to the profile in path, replacing the profiles of funcs
+    that changed.
+    """
+    try:
+        profile = load_profile(path)
+    except (OSError, ValueError):
+        profile = {"functions": {}}
+    for globid, (digest, entry, sites) in instrumentation.funcs.items():
+        ifs = []
+        whiles = []
+        for kind, first in sites:
+            if kind == "if":
+                ifs.append([counts[first + 1], counts[first] - counts[first + 1]])
+            else:
+                whiles.append([counts[first + 1], counts[first]])
+        old = profile["functions"].get(globid)
+        if old is not None and old["hash"] == digest:
+            entry_count = old["entry"] + counts[entry]
+            ifs = [[a + c, b + d] for (a, b), (c, d) in zip(old["ifs"], ifs)]
+            whiles = [[a + c, b + d] for (a, b), (c, d) in zip(old["whiles"], whiles)]
+        else:
+            entry_count = counts[entry]
+        profile["functions"][globid] = {"hash": digest, "entry": entry_count, "ifs": ifs, "whiles": whiles}
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=1)
+
+def apply_profile(prog, profile):
+    """
+    Set the counts of the funcs, ifs and whiles of prog from profile. Returns
+    warnings for the funcs it has no profile of.
+    """
+    warnings = []
+    functions = profile["functions"]
+    total = sum(f["entry"] for f in functions.values())
+    for func in prog.funcs:
+        data = functions.get(func.globid)
+        if data is None or data["hash"] != func_hash(func):
+            warnings.append("warning: no profile of function %s" % func.globid)
+            continue
+        if data["entry"] == 0:
+            attribute = "cold"
+        elif data["entry"] > 1 and data["entry"] >= HOT_SHARE * total:
+            attribute = "inlinehint"
+        else:
+            attribute = None
+        func.counts = (data["entry"], attribute)
+        ifs = iter(data["ifs"])
+        whiles = iter(data["whiles"])
+        for node in branches(func):
+            node.counts = tuple(next(ifs) if type(node) is nodes.If else next(whiles))
+    return warnings
+
+def branch_weights(counts):
+    """
+    counts as LLVM's 32 bit branch weights, None if neither side ran.
+    """
+    if not any(counts):
+        return None
+    scale = max(1, -(-max(counts) // (2**32 - 1)))
+    return [count // scale for count in counts]
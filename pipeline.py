@@ -0,0 +1,112 @@
+import os, sys
+import time
+
+import yaml
+import llvmlite.binding as llvm
+
+import yacc, codeGen, binding, fold
+
+# The ekcc phases as plain functions, for drivers that compile many programs
+# in one process (the compile server and batch mode). Options are a dict using
+# the ekcc flag names: "O", "dul", "it", "lv", "ol", "sl", "sv", plus "emit"
+# ("ast", "llvm" or None) and "args", the values of arg()/argf() when the
+# program runs.
+
+class EnginePool():
+    """
+    A fixed number of MCJIT engines that modules are added to and removed
+    from. MCJIT never releases the machine code of a removed module, so an
+    engine is disposed and replaced after max_uses modules. object_cache
+    is passed on to binding.create_execution_engine.
+    """
+    def __init__(self, size=2, max_uses=64, object_cache=None):
+        self.max_uses = max_uses
+        self.object_cache = object_cache
+        self.free = [[binding.create_execution_engine(object_cache), 0] for _ in range(size)]
+
+    def acquire(self):
+        slot = self.free.pop()
+        if slot[1] >= self.max_uses:
+            slot[0].close()
+            slot = [binding.create_execution_engine(self.object_cache), 0]
+        slot[1] += 1
+        return slot
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def close(self):
+        for engine, uses in self.free:
+            engine.close()
+        self.free = []
+
+def optimization_flags(options):
+    return [bool(options.get("dul")), int(options.get("it", 10)), bool(options.get("lv")),
+            int(options.get("ol", 3)), int(options.get("sl", 2)), bool(options.get("sv"))]
+
+def compile_source(source, options):
+    """
+    Run the front end, code generation and (with "O") the pass pipeline and
+    return {"ast": <yaml or None>, "ir": <final IR>, "timings": {...},
+    "warnings": [<fold.py warnings>]}.
+    Raises yacc.CompilerException for programs that fail to check.
+    """
+    timings = {}
+    start_time = time.time()
+    ast, err_message = yacc.parse(source)
+    timings["parse"] = time.time() - start_time
+    if err_message != None:
+        raise yacc.CompilerException(err_message)
+    ast_yaml = yaml.dump(ast) if options.get("emit") == "ast" else None
+
+    start_time = time.time()
+    warnings = fold.fold_program(ast)
+    module = codeGen.generate_code(ast)
+    timings["codegen"] = time.time() - start_time
+
+    mod = llvm.parse_assembly(str(module))
+    if options.get("O"):
+        start_time = time.time()
+        binding.optimize_module(mod, optimization_flags(options))
+        timings["optimize"] = time.time() - start_time
+    mod.verify()
+    return {"ast": ast_yaml, "ir": str(mod), "timings": timings, "warnings": warnings}
+
+def execute_captured(engine, llvm_ir, args=()):
+    """
+    JIT llvm_ir on engine and call run() in a forked child, so that the
+    program's stdout can be captured and an exit() from a runtime error does
+    not take the calling process down. args are the values of arg()/argf().
+    The module is removed from the engine afterwards. Returns (output,
+    exit_status, result).
+    """
+    mod = llvm.parse_assembly(llvm_ir)
+    engine.add_module(mod)
+    try:
+        engine.finalize_object()
+        engine.run_static_constructors()
+        out_read, out_write = os.pipe()
+        res_read, res_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(out_read)
+            os.close(res_read)
+            os.dup2(out_write, 1)
+            result = binding.run_function(engine, args)
+            binding.flush_stdio()
+            os.write(res_write, str(result).encode("utf8"))
+            os._exit(0)
+        os.close(out_write)
+        os.close(res_write)
+        with os.fdopen(out_read, "rb") as f:
+            output = f.read()
+        with os.fdopen(res_read, "rb") as f:
+            result = f.read()
+        status = os.waitpid(pid, 0)[1]
+    finally:
+        engine.remove_module(mod)
+        mod.close()
+    exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return (output.decode("utf8", "replace"), exit_status, int(result) if result else None)
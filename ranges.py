@@ -0,0 +1,349 @@
+import sys
+
+import nodes, fold
+
+# Value range analysis over the checked AST of one func, run by codeGen before
+# it generates the func's body. It finds the runtime checks that can never
+# fail and stores their names in the proven field of the binop or uop node,
+# and codeGen leaves those checks out:
+#
+#   "divzero"   the divisor of an int, cint or float division is never zero
+#   "overflow"  a cint add, sub, mul, div or negation never overflows
+#
+# Int values are tracked as intervals (lo, hi) within the i32 range. Ranges
+# come from literals, casts, arithmetic and the conditions of ifs and while
+# loops; loops are iterated to a fixed point, widening bounds that keep
+# growing, so induction variables get the bound of their loop condition.
+# Locals that a ref can point to are never tracked. For floats only "known
+# nonzero" is tracked, for literals that are nonzero as floats and casts
+# of nonzero ints.
+#
+# A check is proven only if it holds on every visit of its node, and nodes in
+# code the analysis never reaches keep their checks.
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+TOP = (INT_MIN, INT_MAX)
+
+# abstract value of a float known not to be zero
+NONZERO = "nonzero"
+
+MISSING = object()
+
+def fits(lo, hi):
+    return INT_MIN <= lo and hi <= INT_MAX
+
+def clip(lo, hi):
+    lo, hi = max(lo, INT_MIN), min(hi, INT_MAX)
+    return (lo, hi) if lo <= hi else TOP
+
+def trunc_div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def div_range(a, b):
+    """
+    Range of a / b rounded towards zero, for the nonzero values of b.
+    """
+    parts = []
+    if b[0] <= -1:
+        parts.append((b[0], min(b[1], -1)))
+    if b[1] >= 1:
+        parts.append((max(b[0], 1), b[1]))
+    if not parts:
+        return TOP
+    # for a divisor of one sign the extremes are at the corners
+    values = [trunc_div(x, y) for lo, hi in parts for x in a for y in (lo, hi)]
+    return clip(min(values), max(values))
+
+def join(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    env = {}
+    for name, x in a.items():
+        y = b.get(name)
+        if y is not None:
+            env[name] = (min(x[0], y[0]), max(x[1], y[1]))
+    return env
+
+def widen(old, new):
+    if old is None or new is None:
+        return new
+    env = {}
+    for name, y in new.items():
+        x = old.get(name)
+        if x is not None:
+            env[name] = (x[0] if y[0] >= x[0] else INT_MIN, x[1] if y[1] <= x[1] else INT_MAX)
+    return env
+
+def has_assign(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if type(node) is nodes.Assign:
+            return True
+        stack.extend(node.children())
+    return False
+
+class RangeAnalysis():
+    """
+    ref_params(globid) gives, for every parameter of the func or extern
+    globid, whether it is a ref.
+    """
+    def __init__(self, func, ref_params):
+        self.func = func
+        self.ref_params = ref_params
+        # (node, check) -> whether the check was proven on every visit
+        self.sites = {}
+        # while -> the head it reached the last time it was analyzed
+        self.heads = {}
+        self.untracked = self.referenced_variables(func)
+
+    def referenced_variables(self, func):
+        # names of ref variables and of the variables refs can point to
+        names = set()
+        for vdecl in func.vdecls or ():
+            if "ref" in vdecl.type:
+                names.add(vdecl.var)
+        stack = [func.blk]
+        while stack:
+            node = stack.pop()
+            if type(node) is list:
+                stack.extend(node)
+                continue
+            if type(node) is nodes.VarDeclStmt and "ref" in node.vdecl.type:
+                names.add(node.vdecl.var)
+                if type(node.exp) is nodes.VarVal:
+                    names.add(node.exp.var)
+            elif type(node) is nodes.FuncCall and node.params is not None:
+                for param, is_ref in zip(node.params, self.ref_params(node.globid)):
+                    if is_ref and type(param) is nodes.VarVal:
+                        names.add(param.var)
+            stack.extend(node.children())
+        return names
+
+    def run(self):
+        """
+        Analyze the func, set the proven field of its nodes and return
+        (number of checks, number of checks proven unnecessary).
+        """
+        self.stmt(self.func.blk, {})
+        proven = {}
+        for (node, check), ok in self.sites.items():
+            proven.setdefault(node, [])
+            if ok:
+                proven[node].append(check)
+        for node, checks in proven.items():
+            node.proven = tuple(checks)
+        return len(self.sites), len([ok for ok in self.sites.values() if ok])
+
+    def record(self, node, check, ok):
+        key = (node, check)
+        self.sites[key] = self.sites.get(key, True) and ok
+
+    #######
+    # Statements: take the environment (variable -> range) before the
+    # statement and return the one after it, None for unreachable
+    #######
+
+    def stmt(self, node, env):
+        if env is None:
+            return None
+        kind = type(node)
+        if kind is nodes.Blk:
+            return self.blk(node, env)
+        elif kind is nodes.VarDeclStmt:
+            value = self.exp(node.exp, env, node.exptype == "cint")
+            self.bind(env, node.vdecl.var, value)
+            return env
+        elif kind is nodes.ExpStmt or kind is nodes.Print:
+            self.exp(node.exp, env)
+            return env
+        elif kind is nodes.Ret:
+            if node.exp is not None:
+                self.exp(node.exp, env)
+            return None
+        elif kind is nodes.If:
+            self.exp(node.cond, env)
+            then_env = self.stmt(node.stmt, self.refine(dict(env), node.cond, True))
+            else_env = self.refine(dict(env), node.cond, False)
+            if node.else_stmt is not None:
+                else_env = self.stmt(node.else_stmt, else_env)
+            return join(then_env, else_env)
+        elif kind is nodes.While:
+            return self.loop(node, env)
+        return env
+
+    def blk(self, node, env):
+        # variables declared in the block shadow outer ones until its end
+        saved = {}
+        for stmt in node.stmts or ():
+            if env is None:
+                break
+            if type(stmt) is nodes.VarDeclStmt and stmt.vdecl.var not in saved:
+                saved[stmt.vdecl.var] = env.get(stmt.vdecl.var, MISSING)
+            env = self.stmt(stmt, env)
+        if env is not None:
+            for name, value in saved.items():
+                if value is MISSING:
+                    env.pop(name, None)
+                else:
+                    env[name] = value
+        return env
+
+    def loop(self, node, env):
+        # A loop inside another one is analyzed again on every iteration of
+        # the outer loop. Starting from the head it stopped at before, which
+        # holds for the earlier entries, it usually stops at once instead of
+        # taking as many iterations again at every level of the nest.
+        head = join(self.heads.get(node), env)
+        iteration = 0
+        while True:
+            after_cond = dict(head)
+            self.exp(node.cond, after_cond)
+            body = self.stmt(node.stmt, self.refine(dict(after_cond), node.cond, True))
+            new_head = join(head, body)
+            if iteration >= 2:
+                new_head = widen(head, new_head)
+            if new_head == head:
+                self.heads[node] = head
+                return self.refine(after_cond, node.cond, False)
+            head = new_head
+            iteration += 1
+
+    def bind(self, env, var, value):
+        if type(value) is tuple and var not in self.untracked:
+            env[var] = value
+        else:
+            env.pop(var, None)
+
+    def refine(self, env, cond, truth):
+        """
+        Narrow env to the states where cond is truth; None if there are none.
+        """
+        if env is None:
+            return None
+        kind = type(cond)
+        if kind is nodes.Uop and cond.op == "not":
+            return self.refine(env, cond.exp, not truth)
+        if kind is not nodes.Binop:
+            return env
+        if cond.op == "and" and truth or cond.op == "or" and not truth:
+            return self.refine(self.refine(env, cond.lhs, truth), cond.rhs, truth)
+        if cond.op not in ("lt", "gt", "eq") or has_assign(cond):
+            return env
+        for var, other, op in [(cond.lhs, cond.rhs, cond.op), (cond.rhs, cond.lhs, {"lt": "gt", "gt": "lt", "eq": "eq"}[cond.op])]:
+            if type(var) is not nodes.VarVal or var.var not in env:
+                continue
+            bound = self.exp(other, dict(env))
+            if type(bound) is not tuple:
+                continue
+            lo, hi = env[var.var]
+            if op == "lt":
+                lo, hi = (lo, min(hi, bound[1] - 1)) if truth else (max(lo, bound[0]), hi)
+            elif op == "gt":
+                lo, hi = (max(lo, bound[0] + 1), hi) if truth else (lo, min(hi, bound[1]))
+            elif truth:
+                lo, hi = max(lo, bound[0]), min(hi, bound[1])
+            if lo > hi:
+                return None
+            env[var.var] = (lo, hi)
+        return env
+
+    #######
+    # Expressions: return the range of an int, NONZERO or None for other
+    # values, updating env for assignments. cint is set where codeGen
+    # treats the expression as cint although its exptype is not.
+    #######
+
+    def exp(self, node, env, cint=False):
+        kind = type(node)
+        exptype = "cint" if cint else (node.exptype or "")
+        if kind is nodes.Lit:
+            if exptype == "bool":
+                return None
+            elif exptype == "float":
+                # emitted as a float, to which tiny literals round to zero
+                return NONZERO if fold.to_float32(node.value) else None
+            return (node.value, node.value) if fits(node.value, node.value) else TOP
+        elif kind is nodes.VarVal:
+            if "int" not in exptype:
+                return None
+            return env.get(node.var, TOP)
+        elif kind is nodes.Assign:
+            value = self.exp(node.exp, env, node.exptype == "cint")
+            self.bind(env, node.var, value)
+            if "int" in exptype:
+                return value if type(value) is tuple else TOP
+            return None
+        elif kind is nodes.FuncCall:
+            for param in node.params or ():
+                self.exp(param, env)
+            return TOP if "int" in exptype else None
+        elif kind is nodes.CastStmt:
+            value = self.exp(node.exp, env)
+            if "int" in node.type:
+                return value if type(value) is tuple else TOP
+            elif "float" in node.type:
+                if value is NONZERO or type(value) is tuple and not value[0] <= 0 <= value[1]:
+                    return NONZERO
+            return None
+        elif kind is nodes.Uop:
+            value = self.exp(node.exp, env)
+            if node.op != "minus" or "int" not in exptype:
+                return value if node.op == "minus" and value is NONZERO else None
+            lo, hi = value if type(value) is tuple else TOP
+            if "cint" in exptype:
+                self.record(node, "overflow", lo > INT_MIN)
+                return clip(-hi, -lo)
+            return (-hi, -lo) if fits(-hi, -lo) else TOP
+        elif kind is nodes.Binop:
+            return self.binop(node, env, exptype)
+        return None
+
+    def binop(self, node, env, exptype):
+        cint = exptype == "cint"
+        a = self.exp(node.lhs, env, cint)
+        b = self.exp(node.rhs, env, cint)
+        if exptype == "bool":
+            return None
+        elif "int" in exptype:
+            a = a if type(a) is tuple else TOP
+            b = b if type(b) is tuple else TOP
+            if node.op == "div":
+                self.record(node, "divzero", not b[0] <= 0 <= b[1])
+                if "cint" in exptype:
+                    self.record(node, "overflow", a[0] > INT_MIN or not b[0] <= -1 <= b[1])
+                return div_range(a, b)
+            if node.op == "add":
+                lo, hi = a[0] + b[0], a[1] + b[1]
+            elif node.op == "sub":
+                lo, hi = a[0] - b[1], a[1] - b[0]
+            else:
+                corners = [x * y for x in a for y in b]
+                lo, hi = min(corners), max(corners)
+            if "cint" in exptype:
+                self.record(node, "overflow", fits(lo, hi))
+                return clip(lo, hi)
+            # int arithmetic wraps around
+            return (lo, hi) if fits(lo, hi) else TOP
+        elif "float" in exptype and node.op == "div":
+            self.record(node, "divzero", b is NONZERO)
+        return None
+
+def analyze_func(func, ref_params):
+    """
+    Run the analysis over func; returns (checks, checks removed).
+    """
+    return RangeAnalysis(func, ref_params).run()
+
+def print_report(report, file=sys.stderr):
+    """
+    Print the per-func counts generate_code collected in check_report.
+    """
+    print("######## Runtime Checks Removed: %d of %d ########"
+          % (sum(r[1] for r in report.values()), sum(r[0] for r in report.values())), file=file)
+    for globid, (checks, removed) in report.items():
+        print("%s: %d of %d" % (globid, removed, checks), file=file)
@@ -0,0 +1,259 @@
+from llvmlite import ir
+
+# The output runtime of ek programs, emitted as IR into every module. print
+# calls an emitter for its type, which formats into the BUFFER at POSITION
+# without going through stdio; FLUSH writes the buffer out when it is full,
+# when run() has returned (binding.run_function and main.cpp call it) and
+# before a runtime error exits. If CALLBACK is set, FLUSH hands the bytes to
+# it instead of writing them to fd 1, which is how binding.run_function
+# captures the output of a JIT run.
+#
+# The state has common linkage and FLUSH is weak_odr, so the copies in the
+# modules incremental.py and parallel.py link are merged; the emitters are
+# internal, for the optimizer to inline. Modules run in an engine of their own
+# (see tiered.py) declare the state and share that of the program.
+#
+# Floats print as printf's "%f" does. For |x| < 2^40, x * 10^6 is exact in a
+# double (24 bit mantissa times 15625), so rounding it to the nearest integer,
+# ties to even, gives the same 6 decimals; larger floats and nan/inf go
+# through snprintf.
+
+BUFFER = "ek_out_buffer"
+POSITION = "ek_out_position"
+CALLBACK = "ek_out_callback"
+FLUSH = "ek_flush"
+
+STATE = [BUFFER, POSITION, CALLBACK]
+
+SIZE = 1 << 16
+
+# room a number needs at most, with its newline
+NUMBER_ROOM = 64
+
+FAST_FLOAT_LIMIT = float(2**40)
+
+i1 = ir.IntType(1)
+i8 = ir.IntType(8)
+i32 = ir.IntType(32)
+i64 = ir.IntType(64)
+bytes_ptr = i8.as_pointer()
+callback_type = ir.FunctionType(ir.VoidType(), [bytes_ptr, i64])
+
+def declare_runtime(module, shared=False):
+    """
+    The runtime's state and FLUSH. With shared, the state is only declared,
+    to be resolved to that of another module.
+    """
+    state = [(BUFFER, ir.ArrayType(i8, SIZE)), (POSITION, i64), (CALLBACK, callback_type.as_pointer())]
+    for name, typ in state:
+        value = ir.GlobalVariable(module, typ, name=name)
+        if not shared:
+            value.linkage = 'common'
+            value.initializer = ir.Constant(typ, None)
+    ir.Function(module, ir.FunctionType(i64, [i32, bytes_ptr, i64]), name="write")
+    ir.Function(module, ir.FunctionType(i32, [bytes_ptr, i64, bytes_ptr], var_arg=True), name="snprintf")
+    generate_flush(module)
+
+def constant(typ, value):
+    return ir.Constant(typ, value)
+
+def buffer_at(module, builder, position):
+    return builder.gep(module.get_global(BUFFER), [constant(i32, 0), position], inbounds=True)
+
+def memcpy(module, builder, dest, src, size):
+    func = module.declare_intrinsic('llvm.memcpy', [bytes_ptr, bytes_ptr, i64])
+    builder.call(func, [dest, src, size, constant(i1, 0)])
+
+def generate_flush(module):
+    func = ir.Function(module, ir.FunctionType(ir.VoidType(), []), name=FLUSH)
+    func.linkage = 'weak_odr'
+    func.attributes.add("nounwind")
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    bbcallback = func.append_basic_block("callback")
+    bbwrite = func.append_basic_block("write")
+    bbadvance = func.append_basic_block("advance")
+    bbdone = func.append_basic_block("done")
+    position = module.get_global(POSITION)
+    size = builder.load(position)
+    callback = builder.load(module.get_global(CALLBACK))
+    entry = builder.block
+    builder.cbranch(builder.icmp_unsigned("==", callback, constant(callback.type, None)), bbwrite, bbcallback)
+
+    builder.position_at_end(bbcallback)
+    builder.call(callback, [buffer_at(module, builder, constant(i64, 0)), size])
+    builder.branch(bbdone)
+
+    # write until all is out or write fails
+    builder.position_at_end(bbwrite)
+    written = builder.phi(i64)
+    written.add_incoming(constant(i64, 0), entry)
+    left = builder.icmp_unsigned("<", written, size)
+    with builder.if_then(left):
+        result = builder.call(module.get_global("write"), [constant(i32, 1), buffer_at(module, builder, written),
+                                                            builder.sub(size, written)])
+        builder.cbranch(builder.icmp_signed(">", result, constant(i64, 0)), bbadvance, bbdone)
+    builder.branch(bbdone)
+
+    builder.position_at_end(bbadvance)
+    written.add_incoming(builder.add(written, result), bbadvance)
+    builder.branch(bbwrite)
+
+    builder.position_at_end(bbdone)
+    builder.store(constant(i64, 0), position)
+    builder.ret_void()
+
+def reserve(module, builder, room):
+    """
+    Flush unless room bytes are left in the buffer; the position.
+    """
+    position = module.get_global(POSITION)
+    full = builder.icmp_unsigned(">", builder.add(builder.load(position), constant(i64, room)), constant(i64, SIZE))
+    with builder.if_then(full, likely=False):
+        builder.call(module.get_global(FLUSH), [])
+    return builder.load(position)
+
+def generate_digits(module, func):
+    # (u, out, min) -> the number of digits of u written at out, at least min
+    u, out, minimum = func.args
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    digits = builder.alloca(ir.ArrayType(i8, 20))
+    entry = builder.block
+    bbloop = func.append_basic_block("loop")
+    bbcopy = func.append_basic_block("copy")
+    builder.branch(bbloop)
+
+    builder.position_at_end(bbloop)
+    value = builder.phi(i64)
+    index = builder.phi(i64)
+    value.add_incoming(u, entry)
+    index.add_incoming(constant(i64, 20), entry)
+    digit = builder.add(builder.trunc(builder.urem(value, constant(i64, 10)), i8), constant(i8, ord("0")))
+    next_value = builder.udiv(value, constant(i64, 10))
+    next_index = builder.sub(index, constant(i64, 1))
+    builder.store(digit, builder.gep(digits, [constant(i64, 0), next_index], inbounds=True))
+    count = builder.sub(constant(i64, 20), next_index)
+    more = builder.or_(builder.icmp_unsigned("!=", next_value, constant(i64, 0)),
+                       builder.icmp_unsigned("<", count, minimum))
+    value.add_incoming(next_value, bbloop)
+    index.add_incoming(next_index, bbloop)
+    builder.cbranch(more, bbloop, bbcopy)
+
+    builder.position_at_end(bbcopy)
+    memcpy(module, builder, out, builder.gep(digits, [constant(i64, 0), next_index], inbounds=True), count)
+    builder.ret(count)
+
+def store_char(builder, char, at):
+    builder.store(constant(i8, ord(char)), at)
+
+def generate_print_int(module, func):
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    position = reserve(module, builder, 12)
+    out = buffer_at(module, builder, position)
+    value = builder.sext(func.args[0], i64)
+    negative = builder.icmp_signed("<", value, constant(i64, 0))
+    # written over by the first digit unless negative
+    store_char(builder, "-", out)
+    sign = builder.zext(negative, i64)
+    start = builder.gep(out, [sign])
+    count = builder.call(runtime_function(module, "ek.out.digits"),
+                         [builder.select(negative, builder.neg(value), value), start, constant(i64, 1)])
+    store_char(builder, "\n", builder.gep(start, [count]))
+    builder.store(builder.add(position, builder.add(sign, builder.add(count, constant(i64, 1)))),
+                  module.get_global(POSITION))
+    builder.ret_void()
+
+def generate_print_float(module, func):
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    bbfast = func.append_basic_block("fast")
+    bbslow = func.append_basic_block("slow")
+    position = reserve(module, builder, NUMBER_ROOM)
+    out = buffer_at(module, builder, position)
+    value = builder.fpext(func.args[0], ir.DoubleType())
+    magnitude = builder.call(module.declare_intrinsic('llvm.fabs', [ir.DoubleType()]), [value])
+    # false for nan
+    fast = builder.fcmp_ordered("<", magnitude, constant(ir.DoubleType(), FAST_FLOAT_LIMIT))
+    builder.cbranch(fast, bbfast, bbslow)
+
+    builder.position_at_end(bbfast)
+    rint = module.declare_intrinsic('llvm.rint', [ir.DoubleType()])
+    scaled = builder.fptoui(builder.call(rint, [builder.fmul(magnitude, constant(ir.DoubleType(), 1e6))]), i64)
+    # the sign of -0.0 and of negatives that round to 0 is printed too
+    negative = builder.icmp_signed("<", builder.bitcast(value, i64), constant(i64, 0))
+    store_char(builder, "-", out)
+    sign = builder.zext(negative, i64)
+    start = builder.gep(out, [sign])
+    digits = runtime_function(module, "ek.out.digits")
+    count = builder.call(digits, [builder.udiv(scaled, constant(i64, 10**6)), start, constant(i64, 1)])
+    store_char(builder, ".", builder.gep(start, [count]))
+    fraction = builder.gep(start, [builder.add(count, constant(i64, 1))])
+    builder.call(digits, [builder.urem(scaled, constant(i64, 10**6)), fraction, constant(i64, 6)])
+    store_char(builder, "\n", builder.gep(fraction, [constant(i64, 6)]))
+    builder.store(builder.add(position, builder.add(sign, builder.add(count, constant(i64, 8)))),
+                  module.get_global(POSITION))
+    builder.ret_void()
+
+    builder.position_at_end(bbslow)
+    fmt = string_constant(module, "ek.fmt.float", "%f\n\0")
+    count = builder.call(module.get_global("snprintf"), [out, constant(i64, NUMBER_ROOM), fmt, value])
+    builder.store(builder.add(position, builder.sext(count, i64)), module.get_global(POSITION))
+    builder.ret_void()
+
+def generate_print_bytes(module, func):
+    # (data, size): copy size bytes, flushing as the buffer fills
+    data, size = func.args
+    builder = ir.IRBuilder(func.append_basic_block("entry"))
+    entry = builder.block
+    bbloop = func.append_basic_block("loop")
+    bbcopy = func.append_basic_block("copy")
+    bbdone = func.append_basic_block("done")
+    builder.branch(bbloop)
+
+    builder.position_at_end(bbloop)
+    current = builder.phi(bytes_ptr)
+    left = builder.phi(i64)
+    current.add_incoming(data, entry)
+    left.add_incoming(size, entry)
+    builder.cbranch(builder.icmp_unsigned("==", left, constant(i64, 0)), bbdone, bbcopy)
+
+    builder.position_at_end(bbcopy)
+    position = reserve(module, builder, 1)
+    room = builder.sub(constant(i64, SIZE), position)
+    count = builder.select(builder.icmp_unsigned("<", left, room), left, room)
+    memcpy(module, builder, buffer_at(module, builder, position), current, count)
+    builder.store(builder.add(position, count), module.get_global(POSITION))
+    current.add_incoming(builder.gep(current, [count]), builder.block)
+    left.add_incoming(builder.sub(left, count), builder.block)
+    builder.branch(bbloop)
+
+    builder.position_at_end(bbdone)
+    builder.ret_void()
+
+def string_constant(module, name, string):
+    if name not in module.globals:
+        data = bytearray(string.encode("utf8"))
+        value = ir.GlobalVariable(module, ir.ArrayType(i8, len(data)), name=name)
+        value.linkage = 'private'
+        value.global_constant = True
+        value.unnamed_addr = True
+        value.initializer = ir.Constant(value.type.pointee, data)
+    return module.get_global(name).bitcast(bytes_ptr)
+
+runtime_functions = {
+    "ek.out.digits": (ir.FunctionType(i64, [i64, bytes_ptr, i64]), generate_digits),
+    "ek.print.int": (ir.FunctionType(ir.VoidType(), [i32]), generate_print_int),
+    "ek.print.float": (ir.FunctionType(ir.VoidType(), [ir.FloatType()]), generate_print_float),
+    "ek.print.bytes": (ir.FunctionType(ir.VoidType(), [bytes_ptr, i64]), generate_print_bytes),
+}
+
+def runtime_function(module, name):
+    """
+    The emitter name of the module, generated on first use.
+    """
+    if name in module.globals:
+        return module.get_global(name)
+    fnty, generate = runtime_functions[name]
+    func = ir.Function(module, fnty, name=name)
+    func.linkage = 'internal'
+    func.attributes.add("nounwind")
+    generate(module, func)
+    return func
@@ -0,0 +1,153 @@
+import json, os, sys
+import socket, socketserver
+import signal
+import hashlib
+import time
+from collections import OrderedDict
+
+import yaml
+
+import paths, cache
+import yacc, binding, pipeline
+
+# A long running ekcc. The interpreter, llvmlite (initialized when binding is
+# imported) and the parser are set up once, and every request on the socket
+# reuses them.
+#
+# The protocol is one JSON object per line in each direction. A request looks
+# like
+#
+#   {"source": "<ek program>", "emit": "ast" | "llvm" | null, "jit": true,
+#    "O": false, "dul": false, "it": 10, "lv": false, "ol": 3, "sl": 2,
+#    "sv": false, "args": ["5", "2"]}
+#
+# and is answered with
+#
+#   {"ok": true, "ast": <yaml or null>, "ir": <llvm ir or null>,
+#    "output": <program stdout or null>, "exit_status": <int or null>,
+#    "result": <return value of run() or null>, "cached": <bool>,
+#    "timings": {"parse": s, "codegen": s, "optimize": s, "compile": s,
+#                "execute": s}}
+#
+# or {"ok": false, "error": "<message>"}.
+
+def default_socket_path():
+    return os.path.join(paths.cache_dir(), "ekcc.sock")
+
+class ModuleCache():
+    """
+    Bounded LRU of compiled programs, keyed by everything that changes the
+    generated code: source and optimization flags. The arg values are passed
+    to the program when it runs.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def key(self, request):
+        fields = [request["source"], bool(request.get("O")), pipeline.optimization_flags(request)]
+        return hashlib.sha256(json.dumps(fields).encode("utf8")).hexdigest()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+def execute(pool, llvm_ir, args=()):
+    """
+    JIT llvm_ir on a pooled engine, see pipeline.execute_captured.
+    """
+    slot = pool.acquire()
+    try:
+        return pipeline.execute_captured(slot[0], llvm_ir, args)
+    finally:
+        pool.release(slot)
+
+class CompileServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, cache_size):
+        self.cache = ModuleCache(cache_size)
+        # cached modules are JIT-ed again for every run, reuse their machine code
+        object_cache = cache.ObjectCache(paths.cache_dir("objects"), binding.target_id())
+        self.pool = pipeline.EnginePool(object_cache=object_cache)
+        socketserver.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+
+    def handle_compile(self, request):
+        start_time = time.time()
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        cached = entry is not None
+        if not cached:
+            entry = pipeline.compile_source(request["source"], request)
+            self.cache.put(key, entry)
+        timings = dict(entry["timings"]) if not cached else {}
+        timings["compile"] = time.time() - start_time
+
+        response = {"ok": True, "cached": cached, "timings": timings, "warnings": entry["warnings"],
+                    "ast": None, "ir": None, "output": None, "exit_status": None, "result": None}
+        if request.get("emit") == "ast":
+            if entry["ast"] is None:
+                # cached from a request that did not ask for the AST
+                entry["ast"] = yaml.dump(yacc.parse(request["source"])[0])
+            response["ast"] = entry["ast"]
+        elif request.get("emit") == "llvm":
+            response["ir"] = entry["ir"]
+        if request.get("jit"):
+            start_time = time.time()
+            output, exit_status, result = execute(self.pool, entry["ir"], [str(a) for a in request.get("args", [])])
+            timings["execute"] = time.time() - start_time
+            response.update(output=output, exit_status=exit_status, result=result)
+        return response
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.close()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.handle_compile(json.loads(line))
+            except yacc.CompilerException as e:
+                response = {"ok": False, "error": e.message}
+            except Exception as e:
+                response = {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf8"))
+            self.wfile.flush()
+
+def serve(socket_path=None, cache_size=128):
+    socket_path = socket_path or default_socket_path()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # build the parser before the first request arrives
+    yacc.get_parser()
+    server = CompileServer(socket_path, cache_size)
+    # shut down cleanly (disposing engines, removing the socket) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("ekcc server listening on %s" % socket_path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+def send_request(request, socket_path=None):
+    """
+    Client side helper: send one request to a running server and return
+    the decoded response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall((json.dumps(request) + "\n").encode("utf8"))
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
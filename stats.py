@@ -0,0 +1,105 @@
+import sys, json
+import re
+
+import llvmlite.binding as llvm
+
+# The -time-passes / -stats report: LLVM's pass timings and the IR size of
+# every function before and after optimization, written as one JSON
+# document:
+#
+#   {"phases": {"parse": s, "codegen": s, "optimize": s},
+#    "passes": {"total": s, "passes": [{"name", "count", "wall", "user", "system"}, ...]},
+#    "ir": {"before": <module stats>, "after": <module stats>}}
+#
+# where module stats are {"functions": n, "totals": {...}, "per_function":
+# {name: {"blocks", "instructions", "load", "store", "alloca", "call"}}}.
+# Passes, including the machine code generation passes of the JIT, are listed
+# by wall time, with the instances LLVM numbers "#2", "#3", ... added up under
+# one name. With --opt-jobs only the passes run in the compiling process are
+# timed.
+
+COUNTED = ["blocks", "instructions", "load", "store", "alloca", "call"]
+
+def function_stats(func):
+    counts = dict.fromkeys(COUNTED, 0)
+    for block in func.blocks:
+        counts["blocks"] += 1
+        for instr in block.instructions:
+            counts["instructions"] += 1
+            if instr.opcode in counts:
+                counts[instr.opcode] += 1
+    return counts
+
+def module_stats(mod):
+    per_function = {func.name: function_stats(func) for func in mod.functions if not func.is_declaration}
+    totals = {key: sum(counts[key] for counts in per_function.values()) for key in COUNTED}
+    return {"functions": len(per_function), "totals": totals, "per_function": per_function}
+
+_columns = re.compile(r"-+([A-Za-z+ ]+?)-+")
+_timing = re.compile(r"(\d+\.\d+) \(\s*[\d.]+%\)")
+
+def parse_timings(text):
+    """
+    The passes of LLVM's timing report text.
+    """
+    columns = None
+    passes = {}
+    total = 0.0
+    for line in text.splitlines():
+        if "--- Name ---" in line:
+            columns = [name.strip().lower() for name in _columns.findall(line)]
+            continue
+        times = _timing.findall(line)
+        if columns is None or not times:
+            continue
+        name = _timing.sub("", line).strip()
+        values = dict(zip(columns, [float(t) for t in times]))
+        if name == "Total":
+            total += values.get("wall time", 0.0)
+            continue
+        entry = passes.setdefault(re.sub(r" #\d+$", "", name),
+                                  {"count": 0, "wall": 0.0, "user": 0.0, "system": 0.0})
+        entry["count"] += 1
+        entry["wall"] += values.get("wall time", 0.0)
+        entry["user"] += values.get("user time", 0.0)
+        entry["system"] += values.get("system time", 0.0)
+    ranked = sorted(passes.items(), key=lambda item: -item[1]["wall"])
+    return {"total": total, "passes": [dict(name=name, **entry) for name, entry in ranked]}
+
+class Report():
+    """
+    Collects what time_passes and ir_stats ask for while binding.compile_ir
+    runs (start, optimized, finish), and the phase times the driver adds.
+    """
+    def __init__(self, time_passes=False, ir_stats=False):
+        self.time_passes = time_passes
+        self.ir_stats = ir_stats
+        self.data = {"phases": {}}
+
+    def phase(self, name, seconds):
+        self.data["phases"][name] = seconds
+
+    def start(self, mod):
+        # before optimization
+        if self.ir_stats:
+            self.data["ir"] = {"before": module_stats(mod)}
+        if self.time_passes:
+            llvm.set_time_passes(True)
+
+    def optimized(self, mod):
+        if self.ir_stats:
+            self.data["ir"]["after"] = module_stats(mod)
+
+    def finish(self):
+        # after machine code generation, whose passes are timed as well
+        if self.time_passes:
+            self.data["passes"] = parse_timings(llvm.report_and_reset_timings())
+            llvm.set_time_passes(False)
+
+    def write(self, path=None):
+        if path is None:
+            json.dump(self.data, sys.stderr, indent=2)
+            print(file=sys.stderr)
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.data, f, indent=2)
@@ -0,0 +1,142 @@
+import sys, threading
+import time
+from ctypes import c_uint64
+
+import llvmlite.binding as llvm
+
+import codeGen, binding, incremental, tracing, runtime
+
+# Tiered JIT. run() starts right away from tier 0, a module compiled without
+# optimization in which every func f is called through a trampoline that
+# counts its calls and jumps through slot i of a dispatch table (see
+# codeGen.generate_tiered_code). A background thread polls the counts, and
+# once funcs are called threshold times it generates them again with the funcs
+# they call, optimizes them with the -O flags in an engine of their own and
+# writes their addresses into the table, so that every later call runs the
+# optimized code.
+#
+# A call that is running when its func is promoted finishes in tier 0: run()
+# itself, or a func called a few times that loops for long, stays
+# unoptimized.
+
+DEFAULT_THRESHOLD = 1000
+
+# seconds between two looks at the call counts
+POLL_INTERVAL = 0.005
+
+class TieredProgram():
+    """
+    The program ast compiled to tier 0, with the funcs the background thread
+    promoted to optimized code.
+    """
+    def __init__(self, ast, args, optimization, threshold=DEFAULT_THRESHOLD, cpu=None):
+        self.ast = ast
+        self.args = args
+        self.optimization = optimization
+        self.threshold = threshold
+        self.cpu = cpu
+        self.slots = {func.globid: slot for slot, func in enumerate(ast.funcs)}
+        self.callees = {func.globid: [name for name in incremental.called_functions(func) if name in self.slots]
+                        for func in ast.funcs}
+        # globids in the order they were promoted
+        self.promoted = []
+        self.compile_time = 0.0
+        # the engines of the optimized code and their argument arrays (see
+        # binding.set_args), which must outlive the program
+        self.engines = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+        with tracing.span("generate_code", tier=0):
+            module = codeGen.generate_tiered_code(ast)
+        mod = binding.parse_assembly(module)
+        with tracing.span("verify"):
+            mod.verify()
+        self.engine = binding.create_execution_engine(cpu=cpu, opt=0)
+        with tracing.span("finalize", tier=0):
+            self.engine.add_module(mod)
+            self.engine.finalize_object()
+        # the optimized modules print into the same buffer
+        for name in runtime.STATE:
+            llvm.add_symbol(name, self.engine.get_global_value_address(name))
+        size = len(ast.funcs)
+        self.dispatch = (c_uint64 * size).from_address(self.engine.get_global_value_address(codeGen.DISPATCH))
+        self.calls = (c_uint64 * size).from_address(self.engine.get_global_value_address(codeGen.CALLS))
+        for func in ast.funcs:
+            self.dispatch[self.slots[func.globid]] = self.engine.get_function_address(func.globid + ".t0")
+
+    def closure(self, globids):
+        """
+        globids and the funcs they call, directly or not.
+        """
+        found = set()
+        stack = list(globids)
+        while stack:
+            globid = stack.pop()
+            if globid not in found:
+                found.add(globid)
+                stack.extend(self.callees[globid])
+        return found
+
+    def promote(self, globids):
+        """
+        Compile the funcs in globids optimized and point their slots at them.
+        """
+        start_time = time.time()
+        with tracing.span("promote", functions=len(globids)):
+            module = codeGen.generate_funcs_code(self.ast, self.closure(globids), globids)
+            mod = binding.parse_assembly(module)
+            binding.optimize_module(mod, self.optimization, self.cpu)
+            with tracing.span("verify"):
+                mod.verify()
+            engine = binding.create_execution_engine(cpu=self.cpu, opt=binding.codegen_level(True, self.optimization))
+            with tracing.span("finalize", tier=1):
+                engine.add_module(mod)
+                engine.finalize_object()
+        self.engines.append((engine, binding.set_args(engine, self.args)))
+        for globid in globids:
+            # an aligned 8 byte store, which the trampolines load atomically
+            self.dispatch[self.slots[globid]] = engine.get_function_address(globid)
+            self.promoted.append(globid)
+        self.compile_time += time.time() - start_time
+
+    def hot_functions(self):
+        done = set(self.promoted)
+        return [func.globid for func in self.ast.funcs
+                if func.globid not in done and self.calls[self.slots[func.globid]] >= self.threshold]
+
+    def poll(self):
+        while not self.stopped.wait(POLL_INTERVAL):
+            hot = self.hot_functions()
+            if hot:
+                self.promote(hot)
+
+    def start(self):
+        # a daemon, the program may exit() the process
+        self.thread = threading.Thread(target=self.poll, name="ek-tier1", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+def print_stats(program, file=sys.stderr):
+    print("######## Tiered: %d of %d functions promoted (%s), %s seconds of background compiles ########"
+          % (len(program.promoted), len(program.slots), ", ".join(program.promoted) or "none", program.compile_time),
+          file=file)
+
+# The function called by ekcc
+def compile_and_execute(ast, args, optimization, total_time, threshold=DEFAULT_THRESHOLD, cpu=None):
+    print("################## Compile Start (tier 0) ##################", file=sys.stderr)
+    start_time = time.time()
+    program = TieredProgram(ast, args, optimization, threshold, cpu)
+    print("################## Total Compile Time: %s seconds ##################" % (time.time() - start_time + total_time), file=sys.stderr)
+    print(file=sys.stderr)
+    program.start()
+    try:
+        binding.execute(program.engine, args)
+    finally:
+        program.stop()
+    print_stats(program)
+    return program
@@ -0,0 +1,73 @@
+import os, json
+import time
+import threading
+from contextlib import contextmanager
+
+# Phase tracing for -trace. Every phase of a compile runs in a span, timed with
+# the monotonic time.perf_counter_ns, and the spans are written in the Chrome
+# trace event format, which chrome://tracing and https://ui.perfetto.dev open:
+#
+#   {"traceEvents": [{"name", "cat", "ph": "X", "ts", "dur", "pid", "tid", "args"}, ...],
+#    "displayTimeUnit": "ms"}
+#
+# with ts and dur in microseconds from the start of the process. Spans nest,
+# so e.g. the pass manager runs show up under "optimize".
+#
+# Tracing is off unless enable() is called, and span() then costs one check.
+# The JIT-ed program may exit() without returning to Python, so the trace is
+# written once when it starts as well: spans still open at a write are given
+# as "B" (begin) events, which the viewers draw to the end of the trace.
+
+events = None
+output = None
+_open = []
+_origin = time.perf_counter_ns()
+
+def enable(path):
+    """
+    Start recording spans, to be written to path.
+    """
+    global events, output
+    events = []
+    output = path
+
+def enabled():
+    return events is not None
+
+def _timestamp(ns):
+    return (ns - _origin) / 1000.0
+
+@contextmanager
+def span(name, **args):
+    """
+    Record the time spent in the with block as the phase name, with args
+    shown alongside it.
+    """
+    if events is None:
+        yield
+        return
+    event = {"name": name, "cat": "ekcc", "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+    start = time.perf_counter_ns()
+    _open.append((event, start))
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        _open.remove((event, start))
+        event.update(ph="X", ts=_timestamp(start), dur=(end - start) / 1000.0)
+        events.append(event)
+
+def write():
+    """
+    Write the spans recorded so far to the file given to enable, if tracing
+    is on.
+    """
+    if events is None:
+        return
+    trace_events = list(events)
+    for event, start in _open:
+        trace_events.append(dict(event, ph="B", ts=_timestamp(start)))
+    trace_events.sort(key=lambda event: event["ts"])
+    data = {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+    with open(output, 'w') as f:
+        json.dump(data, f)
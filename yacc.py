@@ -1,6 +1,10 @@
 import ply.yacc as yacc
 import lexer
+import nodes
+import paths
+import tracing
 import json, sys
+import os, hashlib
 
 tokens = lexer.tokens 
 
@@ -22,10 +26,6 @@ class CompilerException(Exception):
     def __init__(self, m):
         self.message = m
 
-funcs_declare = {} 
-variables = {}
-current_func_prefix = None
-
 logicOps = ["eq", "gt", "lt", "and", "or"]
 arithOps = ["add", "sub",  "mul", "div"]
 uOps = ["not", "minus"]
@@ -45,58 +45,49 @@ def p_prog(p):
     '''
     prog : externs funcs
     '''
-    p[0] = {"name" : "prog"}
-    p[0]["externs"] = p[1]
-    p[0]["funcs"] = p[2]
+    p[0] = nodes.Prog(p[1], p[2])
 
 def p_externs(p):
     '''
     externs : 
-            | extern
-            | extern externs
+            | externs extern
     '''
-    p[0] = {"name" : "externs"}
-    if len(p) >= 2:
-        p[0]["externs"] = [p[1]]
-    if len(p) == 3:
-        if "externs" in p[2]:
-            p[0]["externs"].extend(p[2]["externs"])
+    # left recursive, so each extern is appended in O(1)
+    if len(p) == 1:
+        p[0] = []
+    else:
+        p[0] = p[1]
+        p[0].append(p[2])
 
 def p_funcs(p):
     '''
     funcs : func
-          | func funcs
+          | funcs func
     '''
-    p[0] = {"name" : "funcs"}
-    p[0]["funcs"] =[p[1]]
-    if len(p) == 3:
-        if "funcs" in p[2]:
-            p[0]["funcs"].extend(p[2]["funcs"])
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = p[1]
+        p[0].append(p[2])
 
 def p_extern(p):
     '''
     extern : EXTERN type globid LPARENTHESE RPARENTHESE SEMICOLON
            | EXTERN type globid LPARENTHESE tdecls RPARENTHESE SEMICOLON
     '''
-    p[0] = {"name" : "extern"}
-    p[0]["ret_type"] = p[2]
-    p[0]["globid"]  = p[3]
+    p[0] = nodes.Extern(p[2], p[3])
     if len(p) == 8:
-        p[0]["tdecls"] = p[5]
+        p[0].tdecls = p[5]
 
 def p_func(p):
     '''
     func : DEF type globid LPARENTHESE RPARENTHESE blk
          | DEF type globid LPARENTHESE vdecls RPARENTHESE blk
     '''
-    p[0] = {"name" : "func"}
-    p[0]["ret_type"] = p[2]
-    p[0]["globid"]  = p[3]
     if len(p) == 7:
-        p[0]["blk"] = p[6]
+        p[0] = nodes.Func(p[2], p[3], None, p[6])
     if len(p) == 8:
-        p[0]["vdecls"] = p[5]
-        p[0]["blk"] = p[7]
+        p[0] = nodes.Func(p[2], p[3], p[5], p[7])
 
 
     
@@ -106,21 +97,21 @@ def p_blk(p):
     blk : LBRACE RBRACE
         | LBRACE stmts RBRACE
     '''
-    p[0] = {"name" : "blk"}
+    p[0] = nodes.Blk()
     if len(p) == 4:
-        p[0]["contents"] = p[2]
+        p[0].stmts = p[2]
 
 
 def p_stmts(p):
     '''
     stmts : stmt
-          | stmt stmts
+          | stmts stmt
     '''
-    p[0] = {"name" : "stmts"}
-    p[0]["stmts"] = [p[1]]
-    if len(p) == 3:
-        if "stmts" in p[2]:
-            p[0]["stmts"].extend(p[2]["stmts"])
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = p[1]
+        p[0].append(p[2])
 
 def p_stmt0(p):
     '''
@@ -134,51 +125,41 @@ def p_stmt0(p):
          | IF LPARENTHESE exp RPARENTHESE stmt ELSE stmt
          | PRINT exp SEMICOLON
     '''
-    p[0] = {}
     if len(p) == 2:
         p[0] = p[1]
     elif p[1] == "return":
-        p[0]["name"] = "ret"
+        p[0] = nodes.Ret()
         if len(p) == 4:
-            p[0]["exp"] = p[2]
+            p[0].exp = p[2]
     elif len(p) == 5:
-        p[0]["name"] = "vardeclstmt"
-        p[0]["vdecl"] = p[1]
-        p[0]["exp"] = p[3]
+        p[0] = nodes.VarDeclStmt(p[1], p[3])
     elif len(p) == 3:
-        p[0]["name"] = "expstmt"
-        p[0]["exp"] = p[1]
+        p[0] = nodes.ExpStmt(p[1])
     elif p[1] == "while":
-        p[0]["name"] = "while"
-        p[0]["cond"] = p[3]
-        p[0]["stmt"] = p[5]
+        p[0] = nodes.While(p[3], p[5])
     elif p[1] == "if":
-        p[0]["name"] = "if"
-        p[0]["cond"] = p[3]
-        p[0]["stmt"] = p[5]
+        p[0] = nodes.If(p[3], p[5])
         if len(p) == 8:
-            p[0]["else_stmt"] = p[7]
+            p[0].else_stmt = p[7]
     elif p[1] == "print":
-        p[0]["name"] = "print"
-        p[0]["exp"] = p[2]
+        p[0] = nodes.Print(p[2])
 
 def p_stmt1(p):
     '''
     stmt : PRINT SLIT SEMICOLON
     '''
-    p[0] = {"name" : "printslit", "string" : p[2]}
+    p[0] = nodes.PrintSlit(p[2])
 
 def p_exps(p):
     '''
     exps : exp
-         | exp COMMA exps
+         | exps COMMA exp
     ''' 
-    p[0] = {"name" : "exps"}
-    if len(p) >= 2:
-        p[0]["exps"] = [p[1]]    
-    if len(p) == 4:
-        if "exps" in p[3]:
-            p[0]["exps"].extend(p[3]["exps"])
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = p[1]
+        p[0].append(p[3])
 
 def p_exp0(p):
     '''
@@ -191,27 +172,17 @@ def p_exp0(p):
     if len(p) == 2:
         p[0] = p[1]
     elif len(p) == 5:
-        p[0] = {
-            "name": "funccall",
-            "globid": p[1],
-            "params": p[3]
-        }
+        p[0] = nodes.FuncCall(p[1], p[3])
     elif p[1] == "(":
         p[0] = p[2]
     else:
-        p[0] = {
-            "name": "funccall",
-            "globid": p[1],
-        }
+        p[0] = nodes.FuncCall(p[1])
 
 def p_exp1(p):
     '''
     exp : VARID
     '''
-    p[0] = {
-        "name": "varval",
-        "var": p[1]
-    }
+    p[0] = nodes.VarVal(p[1])
 
 def p_exp2(p):
     '''
@@ -229,18 +200,9 @@ def p_binop(p):
     if len(p) == 2:
         p[0] = p[1]
     elif len(p) == 4:
-        p[0] = {
-            "name": "assign",
-            "var": p[1],
-            "exp": p[3],
-            # "exptype": "assign"
-        }
+        p[0] = nodes.Assign(p[1], p[3])
     else:
-        p[0] = {
-            "name": "caststmt",
-            "type": p[2],
-            "exp": p[4]
-        }
+        p[0] = nodes.CastStmt(p[2], p[4])
 
 def p_arithOps(p):
     '''
@@ -258,12 +220,7 @@ def p_arithOps(p):
         op = "mul"
     elif p[2] == '/':
         op = "div"
-    p[0] = {
-        "name": "binop",
-        "op": op,
-        "lhs": p[1],
-        "rhs": p[3]
-    }
+    p[0] = nodes.Binop(op, p[1], p[3])
 
 def p_logicOps(p):
     '''
@@ -284,12 +241,7 @@ def p_logicOps(p):
         op = "and"
     elif p[2] == "||":
         op = "or"
-    p[0] = {
-        "name": "binop",
-        "op": op,
-        "lhs": p[1],
-        "rhs": p[3]
-    }
+    p[0] = nodes.Binop(op, p[1], p[3])
 
 
 def p_uop(p):
@@ -298,17 +250,9 @@ def p_uop(p):
         | MINUS exp %prec UMINUS
     '''
     if p[1]=='!':
-        p[0] = {
-            "name": "uop",
-            "op": "not",
-            "exp": p[2]
-        }
+        p[0] = nodes.Uop("not", p[2])
     else:
-        p[0] = {
-            "name": "uop",
-            "op": "minus",
-            "exp": p[2]
-        }
+        p[0] = nodes.Uop("minus", p[2])
 
 def p_lit0(p):
     '''
@@ -321,41 +265,25 @@ def p_lit1(p):
     '''
     lit : FNUMBER
     '''
-    p[0] = {
-        "name": "lit",
-        "value": p[1],
-        "exptype": "float"
-    }
+    p[0] = nodes.Lit(p[1], "float")
 
 def p_lit2(p):
     '''
     lit : NUMBER
     '''
-    p[0] = {
-        "name": "lit",
-        "value": p[1],
-        "exptype": "lit int"
-    }
+    p[0] = nodes.Lit(p[1], "lit int")
 
 def p_true(p):
     '''
     true : TRUE
     '''
-    p[0] = {
-        "name": "lit",
-        "value": p[1] == "true",
-        "exptype": "bool"
-    }
+    p[0] = nodes.Lit(p[1] == "true", "bool")
 
 def p_false(p):
     '''
     false : FALSE
     '''
-    p[0] = {
-        "name": "lit",
-        "value": p[1] == "true",
-        "exptype": "bool"
-    }
+    p[0] = nodes.Lit(p[1] == "true", "bool")
 
 def p_globid(p):
     '''
@@ -387,37 +315,37 @@ def p_noAliasRefType(p):
 
 def p_vdecls(p):
     '''
-    vdecls : vdecl COMMA vdecls
+    vdecls : vdecls COMMA vdecl
            | vdecl
     '''
-    p[0] = {"name" : "vdecls"}
-    if len(p) >= 2:
-        p[0]["vars"] = [p[1]]    
-    if len(p) == 4:
-        if "vars" in p[3]:
-            p[0]["vars"].extend(p[3]["vars"])
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = p[1]
+        p[0].append(p[3])
 
 def p_tdecls(p):
     '''
     tdecls : type
-           | type COMMA tdecls
+           | tdecls COMMA type
     '''
-    p[0] = {"name" : "tdecls"}
-    if len(p) >= 2:
-        p[0]["types"] = [p[1]]    
-    if len(p) == 4:
-        if "types" in p[3]:
-            p[0]["types"].extend(p[3]["types"])
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = p[1]
+        p[0].append(p[3])
 
 def p_vdecl(p):
     '''
     vdecl : type VARID
     '''
-    p[0] = {
-        "node": "vdecl",
-        "type": p[1],
-        "var": p[2]
-    }
+    p[0] = nodes.VDecl(p[1], p[2])
+
+def p_error(p):
+    # stop at the first error; parse returns it as the error message
+    if p is None:
+        raise CompilerException("error: syntax error at the end of the input")
+    raise CompilerException("error: syntax error at line %d, column %d, at '%s'" % (p.lineno, p.column, p.value))
 
 def not_same_type(left_type, right_type):
     ltype = left_type.split()[-1]
@@ -446,154 +374,234 @@ def can_cast(cast_type, exp_type):
     else:
         return False
 
-def check_violation(node):
-    global funcs_declare
-    global current_func_prefix
-    global variables
-    global logicOps
-    global arithOps
-    global uOps
-
-    if type(node) is list:
-        for v in node:
-            check_violation(v)
-
-    elif type(node) is dict:
-        #Check: <vdecl> may not have void type.
-        #Check: a ref type may not contain a 'ref' or 'void' type.
-        if "node" in node:
-            if node["type"] == "void":
-                raise CompilerException("error: <vdecl> type cannot be void")
-            elif "noalias" not in node["type"]:
-                if "ref" in node["type"][3:] or "void" in node["type"][3:]:
-                    raise CompilerException("error: a ref type may not contain a 'ref' or 'void' type.")
-            elif "noalias" in node["type"]:
-                if "ref" in node["type"][11:] or "void" in node["type"][11:]:
-                    raise CompilerException("error: a ref type may not contain a 'ref' or 'void' type.")
-            if current_func_prefix != None:
-                variables[current_func_prefix+" "+node["var"]] = node["type"]
-            else:
-                variables[node["var"]] = node["type"]
-        
-        if "name" in node:
-            #store exptype in node
-            if node["name"] == "varval":
-                varval_key = current_func_prefix + " " + node["var"]
-                if varval_key not in variables:
-                    raise CompilerException("error: variable " + node["var"] + " has not been declared")
-                node["exptype"] = variables[varval_key]
-
-            #Check: ref var initializer must be a variable.
-            elif node["name"] == "vardeclstmt":
-                if "exp" not in node or "vdecl" not in node:
-                    raise CompilerException("error: ref var initializer must be a variable.")
-                elif "name" not in node["exp"]:
-                    raise CompilerException("error: ref var initializer must be a variable.")
-                elif "type" not in node["vdecl"]:
-                    raise CompilerException("error: ref var initializer must be a variable.")
-                elif node["vdecl"]["type"][0:3] == "ref" and node["exp"]["name"] != "varval":
+class SymbolTable():
+    """
+    Variables in scope, innermost declaration first. Every name maps to a
+    stack of types, so lookup, declare, push and pop are all O(1) (pop is
+    linear in the names declared in the scope being left).
+    """
+    def __init__(self):
+        self.symbols = {}
+        self.scopes = []
+
+    def push(self):
+        self.scopes.append(set())
+
+    def pop(self):
+        for name in self.scopes.pop():
+            types = self.symbols[name]
+            types.pop()
+            if not types:
+                del self.symbols[name]
+
+    def declare(self, name, type):
+        scope = self.scopes[-1]
+        if name in scope:
+            # declaring a variable again in the same scope replaces it
+            self.symbols[name][-1] = type
+        else:
+            scope.add(name)
+            self.symbols.setdefault(name, []).append(type)
+
+    def lookup(self, name):
+        types = self.symbols.get(name)
+        if types is None:
+            raise CompilerException("error: variable " + name + " has not been declared")
+        return types[-1]
+
+class Checker():
+    """
+    Checks a program and stores the type of every expression in its
+    exptype. Nodes are visited in source order with an explicit stack, so
+    deeply nested programs do not hit the recursion limit; pre handlers run
+    before a node's children are visited and post handlers after.
+    """
+    def __init__(self):
+        self.funcs_declare = {}
+        self.variables = SymbolTable()
+
+    def check(self, prog):
+        pre = self.pre_handlers
+        post = self.post_handlers
+        stack = [(prog, False)]
+        push = stack.append
+        while stack:
+            node, visited = stack.pop()
+            kind = type(node)
+            if visited:
+                post[kind](self, node)
+                continue
+            if kind in pre:
+                pre[kind](self, node)
+            if kind in post:
+                push((node, True))
+            children = node.children()
+            if children:
+                for i in range(len(children) - 1, -1, -1):
+                    push((children[i], False))
+        if "run" not in self.funcs_declare:
+            raise CompilerException("error: run function should be declared once.")
+
+    #Check: <vdecl> may not have void type.
+    #Check: a ref type may not contain a 'ref' or 'void' type.
+    def check_vdecl(self, node):
+        if node.type == "void":
+            raise CompilerException("error: <vdecl> type cannot be void")
+        elif "noalias" not in node.type:
+            if "ref" in node.type[3:] or "void" in node.type[3:]:
+                raise CompilerException("error: a ref type may not contain a 'ref' or 'void' type.")
+        elif "noalias" in node.type:
+            if "ref" in node.type[11:] or "void" in node.type[11:]:
+                raise CompilerException("error: a ref type may not contain a 'ref' or 'void' type.")
+        self.variables.declare(node.var, node.type)
+
+    def check_varval(self, node):
+        node.exptype = self.variables.lookup(node.var)
+
+    #Check: ref var initializer must be a variable.
+    def check_vardeclstmt(self, node):
+        if node.vdecl.type[0:3] == "ref" and type(node.exp) is not nodes.VarVal:
+            raise CompilerException("error: ref var initializer must be a variable.")
+        node.exptype = node.vdecl.type
+
+    #Check: all functions must be declared before use
+    def check_funccall(self, node):
+        if node.globid not in self.funcs_declare:
+            raise CompilerException("error: function " + node.globid + " has not been declared")
+        func = self.funcs_declare[node.globid]
+        if node.params is not None:
+            for x in range(len(node.params)):
+                if "ref" in func.args[x] and type(node.params[x]) is not nodes.VarVal:
                     raise CompilerException("error: ref var initializer must be a variable.")
-                node["exptype"] = node["vdecl"]["type"]
-
-            #Check: all functions must be declared before use
-            elif node["name"] == "funccall":
-                if node["globid"] not in funcs_declare:
-                    raise CompilerException("error: function " + node["globid"] + " has not been declared")
-                if "params" in node and "exps" in node["params"]:
-                    for x in range(len(node["params"]["exps"])):
-                        if "ref" in funcs_declare[node["globid"]].args[x] and node["params"]["exps"][x]["name"] != "varval":
-                            raise CompilerException("error: ref var initializer must be a variable.")
-                node["exptype"] = funcs_declare[node["globid"]].return_type
-
-            #Check: a function may not return a ref type.
-            #Check: all programs define the "run" function with the right type.
-            elif node["name"] == "func":
-                args=[]
-                if node["globid"] == "run":
-                    if "run" in funcs_declare:
-                        raise CompilerException("error: run function should only declare once")
-                    elif node['ret_type'] != "int":
-                        raise CompilerException("error: run function should only return int type")
-                    elif "vdecls" in node:
-                        raise CompilerException("error: run function should take no arguments")
-                else:
-                    if "ref" in node['ret_type']:
-                        raise CompilerException("error: function cannot return ref type")
-                    if "vdecls" in node:
-                        for arg in node["vdecls"]["vars"]:
-                            args.append(arg["type"])
-                funcs_declare[node["globid"]] = Func(node["globid"], node['ret_type'], args)
-                current_func_prefix = node["ret_type"]+" "+node["globid"]
-
-            elif node["name"] == "extern":
-                args=[]
-                if "tdecls" in node and "types" in node["tdecls"]:
-                    args = node["tdecls"]["types"]
-                funcs_declare[node["globid"]] = Func(node["globid"], node['ret_type'], args)
-
-        #visit children node
-        for k, v in node.items():
-            if v is list or dict:
-                check_violation(v)
-
-        #Check: the types on both sides of binops are the same
-        if "op" in node:
-            if node["op"] in logicOps:
-                if not_same_type(node["lhs"]["exptype"], node["rhs"]["exptype"]):
-                    raise CompilerException("error: the type on two sides do not match")
-                node["exptype"] = "bool"
-
-            elif node["op"] in arithOps:
-                if not_same_type(node["lhs"]["exptype"], node["rhs"]["exptype"]):
-                    raise CompilerException("error: the type on two sides do not match")
-                node["exptype"] = node["rhs"]["exptype"]
-
-            elif node["op"] in uOps:
-                node["exptype"] = node["exp"]["exptype"]
-
-        if "name" in node:
-            if node["name"] == "assign":
-                if current_func_prefix is not None:
-                    var_key = current_func_prefix + " " + node["var"]
-                else:
-                    var_key = node["var"]
-                if var_key not in variables:
-                    raise CompilerException("error: variable " + node["var"] + " has not been declared")
-                
-                if not_same_type(variables[var_key], node["exp"]["exptype"]):
-                    raise CompilerException("error: the type on two sides do not match")
-                    
-                node["exptype"] = variables[var_key]
-
-            elif node["name"] == "caststmt":
-                if can_cast(node["type"], node["exp"]["exptype"]):
-                    node["exptype"] = node["type"]
-                else:
-                    raise CompilerException("error: cannot cast {} to {}", node["exp"]["exptype"], node["type"])
-
-            elif node["name"] == "func":
-                for k, v in variables.copy().items():
-                    if k.startswith(current_func_prefix):
-                        variables.pop(k)
-                current_func_prefix = None
-
-def check_run():
-    global funcs_declare
-    if "run" not in funcs_declare:
-        raise CompilerException("error: run function should be declared once.")
+        node.exptype = func.return_type
+
+    #Check: a function may not return a ref type.
+    #Check: all programs define the "run" function with the right type.
+    def enter_func(self, node):
+        args = []
+        if node.globid == "run":
+            if "run" in self.funcs_declare:
+                raise CompilerException("error: run function should only declare once")
+            elif node.ret_type != "int":
+                raise CompilerException("error: run function should only return int type")
+            elif node.vdecls is not None:
+                raise CompilerException("error: run function should take no arguments")
+        else:
+            if "ref" in node.ret_type:
+                raise CompilerException("error: function cannot return ref type")
+            if node.vdecls is not None:
+                for arg in node.vdecls:
+                    args.append(arg.type)
+        self.funcs_declare[node.globid] = Func(node.globid, node.ret_type, args)
+        # the arguments, the body gets a scope of its own as a block
+        self.variables.push()
+
+    def check_extern(self, node):
+        args = []
+        if node.tdecls is not None:
+            args = node.tdecls
+        self.funcs_declare[node.globid] = Func(node.globid, node.ret_type, args)
+
+    def enter_blk(self, node):
+        self.variables.push()
+
+    def leave_scope(self, node):
+        self.variables.pop()
+
+    #Check: the types on both sides of binops are the same
+    def check_binop(self, node):
+        if node.op in logicOps:
+            if not_same_type(node.lhs.exptype, node.rhs.exptype):
+                raise CompilerException("error: the type on two sides do not match")
+            node.exptype = "bool"
+
+        elif node.op in arithOps:
+            if not_same_type(node.lhs.exptype, node.rhs.exptype):
+                raise CompilerException("error: the type on two sides do not match")
+            node.exptype = node.rhs.exptype
+
+    def check_uop(self, node):
+        node.exptype = node.exp.exptype
+
+    def check_assign(self, node):
+        var_type = self.variables.lookup(node.var)
+        if not_same_type(var_type, node.exp.exptype):
+            raise CompilerException("error: the type on two sides do not match")
+        node.exptype = var_type
+
+    def check_cast(self, node):
+        if can_cast(node.type, node.exp.exptype):
+            node.exptype = node.type
+        else:
+            raise CompilerException("error: cannot cast {} to {}".format(node.exp.exptype, node.type))
+
+    pre_handlers = {
+        nodes.VDecl: check_vdecl,
+        nodes.VarVal: check_varval,
+        nodes.VarDeclStmt: check_vardeclstmt,
+        nodes.FuncCall: check_funccall,
+        nodes.Func: enter_func,
+        nodes.Extern: check_extern,
+        nodes.Blk: enter_blk,
+    }
+
+    post_handlers = {
+        nodes.Func: leave_scope,
+        nodes.Blk: leave_scope,
+        nodes.Binop: check_binop,
+        nodes.Uop: check_uop,
+        nodes.Assign: check_assign,
+        nodes.CastStmt: check_cast,
+    }
+
+# The LALR tables only depend on the grammar in this file and the tokens in
+# lexer.py, so they are pickled into the user cache directory under a hash of
+# both sources and the PLY table version.
+_parser = None
+
+def grammar_hash():
+    h = hashlib.sha256(yacc.__tabversion__.encode("utf8"))
+    for source in (__file__, lexer.__file__):
+        with open(source, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def build_parser():
+    picklefile = os.path.join(paths.cache_dir("parser"), "parsetab-%s.pickle" % grammar_hash())
+    if os.path.exists(picklefile):
+        try:
+            return yacc.yacc(debug=False, optimize=True, picklefile=picklefile)
+        except Exception:
+            # unreadable or truncated table, rebuild it below
+            pass
+    # write to a private name first so concurrent ekcc runs never see a partial table
+    tmpfile = "%s.%d.tmp" % (picklefile, os.getpid())
+    parser = yacc.yacc(debug=False, picklefile=tmpfile)
+    try:
+        os.replace(tmpfile, picklefile)
+    except OSError:
+        pass
+    return parser
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        _parser = build_parser()
+    return _parser
 
 # The function called by ekcc.py
 def parse(input_content):
-    parser = yacc.yacc()
-    result = parser.parse(input_content)
+    parser = get_parser()
+    lexer.lexer.lineno = 1
+    # the lexer is driven by the parser, one token at a time
 
-    #Compiler ruturns ( ast tree, error message) 
+    #Compiler ruturns ( ast tree, error message)
     try:
-        check_violation(result)
-        check_run()
+        with tracing.span("lex/parse", bytes=len(input_content)):
+            result = parser.parse(input_content, lexer=lexer.lexer)
+        with tracing.span("check_violation"):
+            Checker().check(result)
     except CompilerException as e:
         return (None, e.message)
 
     return (result, None)
-
-    